@@ -0,0 +1,1005 @@
+# Copyright 2019 bitconnect
+# Author: Tobias Perschon
+# License: GNU GPLv2, see LICENSE.txt
+import configparser
+import hashlib
+import json
+import os
+import platform
+import re
+import selectors
+import struct
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from . import fastcopy, metrics, player_process
+from .fake_reader import write_mp4
+from .manifest import file_hash
+from .metadata import MetadataIndex
+from .model import Movie, Playlist
+from .picker import create_picker
+from .playlist_file import read_playlist_file
+from .scanner import MovieScanner
+from .schedule import Schedule, parse_window, week_seconds
+
+# Small benchmarks that can be run off-device to compare the cost of parts of
+# the video looper.  Run them with:
+#
+#   python3 -m Pi_Video_Looper.benchmark [--json] [name ...]
+#
+# Every benchmark is a function taking no arguments and returning a dict of
+# measured values.  With --json the results are printed as one JSON object to
+# keep track of them across releases.
+#
+# The looper benchmarks (idle, switch, loop_cpu, build and startup) run the
+# whole VideoLooper with the fake_player and fake_reader modules and the dummy
+# SDL video driver (if the display is used at all), so they don't need a
+# display, omxplayer or USB drives.
+
+
+def bench_idle(seconds=5.0):
+    """Measure the cpu usage and wakeups of the main loop of a looper while
+    one long movie plays, without and with keyboard control.  Keyboard
+    control pumps the pygame events every KEYBOARD_POLL_INTERVAL if there is
+    no input device to watch, like when the benchmark isn't run on the device.
+    """
+    results = {}
+    for keyboard in ('false', 'true'):
+        path = tempfile.mkdtemp()
+        try:
+            looper = _create_looper(_looper_config(path, files=5, duration=3600, keyboard_control=keyboard))
+            name = 'keyboard' if keyboard == 'true' else 'plain'
+            results[name + '_input_devices'] = len(looper._keyboards)
+            cpu_start = time.process_time()
+            start = time.monotonic()
+            _run_looper(looper, seconds)
+            elapsed = time.monotonic() - start
+            results[name + '_cpu_percent'] = 100 * (time.process_time() - cpu_start) / elapsed
+            results[name + '_wakeups_per_s'] = looper._wakeups / elapsed
+        finally:
+            shutil.rmtree(path)
+    return results
+
+
+def _make_files(path, count):
+    """Create count empty files in path, mostly movies with some repeat
+    settings, hidden files and other files mixed in.
+    """
+    for i in range(count):
+        if i % 50 == 0:
+            name = '.hidden_{0}.mp4'.format(i)
+        elif i % 20 == 0:
+            name = 'notes_{0}.txt'.format(i)
+        elif i % 10 == 0:
+            name = 'movie_{0}_repeat_3x.mov'.format(i)
+        else:
+            name = 'movie_{0}.mp4'.format(i)
+        open(os.path.join(path, name), 'wb').close()
+
+
+def _legacy_scan(path, extensions):
+    """The playlist scan as it was done before MovieScanner."""
+    movies = []
+    for x in os.listdir(path):
+        if x[0] != '.' and re.search('\\.{0}$'.format(extensions), x, flags=re.IGNORECASE):
+            repeatsetting = re.search('_repeat_([0-9]*)x', x, flags=re.IGNORECASE)
+            if (repeatsetting is not None):
+                repeat = repeatsetting.group(1)
+            else:
+                repeat = 1
+            movies.append(Movie('{0}/{1}'.format(path.rstrip('/'), x), repeat))
+    return sorted(movies)
+
+
+def bench_scan(sizes=(10000, 100000)):
+    """Time building the sorted movie list of directories with many entries
+    with the old listdir/regex scan and with MovieScanner (first scan and a
+    rescan that hits the cache).
+    """
+    extensions = ['avi', 'mov', 'mkv', 'mp4', 'm4v']
+    results = {}
+    for size in sizes:
+        path = tempfile.mkdtemp()
+        try:
+            _make_files(path, size)
+            start = time.perf_counter()
+            _legacy_scan(path, '|'.join(extensions))
+            results['legacy_{0}_ms'.format(size)] = 1000 * (time.perf_counter() - start)
+            scanner = MovieScanner(extensions)
+            start = time.perf_counter()
+            scanner.scan([path])
+            results['scandir_{0}_ms'.format(size)] = 1000 * (time.perf_counter() - start)
+            start = time.perf_counter()
+            scanner.scan([path])
+            results['scandir_cached_{0}_ms'.format(size)] = 1000 * (time.perf_counter() - start)
+        finally:
+            shutil.rmtree(path)
+    return results
+
+
+def bench_tree(directories=200, files=50):
+    """Time searching a tree of nested directories for movies in the
+    background: until the first movies can be played and until the whole tree
+    was walked.  The time of the first batch doesn't depend on the size of
+    the tree.
+    """
+    from .scanner import BackgroundScan
+    path = tempfile.mkdtemp()
+    results = {}
+    try:
+        for i in range(directories):
+            # Every tenth directory is nested in the one before.
+            parent = path if i % 10 == 0 else os.path.join(path, 'dir_{0:04d}'.format(i - i % 10))
+            directory = os.path.join(parent, 'dir_{0:04d}'.format(i))
+            os.makedirs(directory)
+            _make_files(directory, files)
+        for name in ('scan', 'rescan'):
+            scanner = MovieScanner(['mp4', 'mov'])
+            if name == 'rescan':
+                list(scanner.scan_tree([path]))
+            start = time.perf_counter()
+            scan = BackgroundScan(scanner, [path])
+            selector = selectors.DefaultSelector()
+            selector.register(scan.fileno(), selectors.EVENT_READ)
+            found = 0
+            first = None
+            done = False
+            while not done:
+                selector.select()
+                directories_walked, movies, done = scan.get()
+                found += len(movies)
+                if first is None and found:
+                    first = time.perf_counter() - start
+            results[name + '_first_ms'] = 1000 * first
+            results[name + '_complete_ms'] = 1000 * (time.perf_counter() - start)
+            results[name + '_movies'] = found
+            selector.close()
+            scan.close()
+    finally:
+        shutil.rmtree(path)
+    return results
+
+
+def _legacy_copyfileobj(fsrc, fdst, callback, length=16 * 1024):
+    """The copy loop of usb_drive_copymode as it was before fastcopy."""
+    copied = 0
+    while True:
+        buf = fsrc.read(length)
+        if not buf:
+            break
+        fdst.write(buf)
+        copied += len(buf)
+        callback(copied)
+
+
+def bench_copy(size=256 * 1024 * 1024, directory=None):
+    """Compare the throughput of the old 16 KiB copy loop with fastcopy.  The
+    number of progress callbacks is reported too, every one of them used to
+    redraw the progress bar.  The cost of verifying copies is measured by
+    fastcopy hashing in the same pass (sha256) and by a plain copy followed by
+    reading the source again to hash it (copy_then_hash).  The source is
+    dropped from the page cache before every read, like a freshly plugged in
+    drive.  Pass directory to copy on a specific device.
+    """
+    path = tempfile.mkdtemp(dir=directory)
+    src = os.path.join(path, 'src.mp4')
+    dst = os.path.join(path, 'dst.mp4')
+    results = {}
+    try:
+        with open(src, 'wb') as f:
+            chunk = os.urandom(1024 * 1024)
+            for i in range(size // len(chunk)):
+                f.write(chunk)
+        variants = (('legacy', _legacy_copyfileobj),
+                    ('fastcopy', fastcopy.copyfileobj),
+                    ('sha256', lambda fsrc, fdst, callback: fastcopy.copyfileobj(
+                        fsrc, fdst, callback, digest=hashlib.sha256())),
+                    ('copy_then_hash', fastcopy.copyfileobj))
+        for name, func in variants:
+            calls = []
+            _drop_cache(src)
+            start = time.perf_counter()
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                func(fsrc, fdst, callback=calls.append)
+                os.fsync(fdst.fileno())
+            if name == 'copy_then_hash':
+                _drop_cache(src)
+                file_hash(src)
+            elapsed = time.perf_counter() - start
+            results[name + '_mb_per_s'] = size / elapsed / 1e6
+            results[name + '_callbacks'] = len(calls)
+            os.remove(dst)
+    finally:
+        shutil.rmtree(path)
+    return results
+
+
+def _drop_cache(filename):
+    """Drop the (clean) pages of a file from the page cache."""
+    with open(filename, 'rb') as f:
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+
+def _read_head(filename, size):
+    """Return the seconds it takes to read the first size bytes of a file,
+    like a player filling its buffers before the first frame.
+    """
+    start = time.perf_counter()
+    with open(filename, 'rb', buffering=0) as f:
+        while size > 0:
+            data = f.read(min(size, 1024 * 1024))
+            if not data:
+                break
+            size -= len(data)
+    return time.perf_counter() - start
+
+
+def bench_prefetch(size=128 * 1024 * 1024, head=16 * 1024 * 1024, first_read=8 * 1024 * 1024,
+                   rounds=5, directory=None):
+    """Time reading the start of a movie that is not in the page cache (cold)
+    and one the prefetcher loaded while the previous movie played (warm).
+    Pass directory to use a specific device, like a mounted USB stick (it
+    must not be a tmpfs, whose pages can't be dropped).
+    """
+    from .prefetch import Prefetcher
+    path = tempfile.mkdtemp(dir=directory)
+    filename = os.path.join(path, 'movie.mp4')
+    results = {}
+    try:
+        with open(filename, 'wb') as f:
+            chunk = os.urandom(1024 * 1024)
+            for i in range(size // len(chunk)):
+                f.write(chunk)
+            os.fsync(f.fileno())
+        cold = []
+        warm = []
+        for i in range(rounds):
+            _drop_cache(filename)
+            cold.append(_read_head(filename, first_read))
+            _drop_cache(filename)
+            # A new prefetcher every round, otherwise it knows the file is
+            # warm already.
+            prefetcher = Prefetcher(head, 4 * head)
+            prefetcher.prefetch([filename])
+            prefetcher.wait()
+            prefetcher.close()
+            # WILLNEED only starts the reads, give the kernel time to finish
+            # them like it has while the previous movie plays.
+            time.sleep(0.5)
+            warm.append(_read_head(filename, first_read))
+        results['cold_first_read_ms'] = 1000 * sum(cold) / rounds
+        results['warm_first_read_ms'] = 1000 * sum(warm) / rounds
+        results['cold_first_read_max_ms'] = 1000 * max(cold)
+        results['warm_first_read_max_ms'] = 1000 * max(warm)
+    finally:
+        shutil.rmtree(path)
+    return results
+
+
+def _legacy_stop(process, block_timeout_sec=3):
+    """Player stop as it was before player_process: kill -9 and spin."""
+    subprocess.call(['kill', '-9', str(process.pid)])
+    start = time.time()
+    while process.returncode is None:
+        if (time.time() - start) >= block_timeout_sec:
+            break
+        time.sleep(0)
+
+
+def bench_stop(rounds=20):
+    """Measure how long stopping a dummy player child takes with the old
+    kill/spin loop (which never polls and so burns the whole timeout) and
+    with player_process.stop.
+    """
+    results = {}
+    for name in ('legacy', 'player_process'):
+        total = 0
+        for i in range(rounds if name == 'player_process' else 2):
+            process = player_process.spawn(['sleep', '60'])
+            start = time.perf_counter()
+            if name == 'legacy':
+                _legacy_stop(process)
+            else:
+                player_process.stop(process, 3)
+            total += time.perf_counter() - start
+            process.wait()
+        results[name + '_ms'] = 1000 * total / (rounds if name == 'player_process' else 2)
+    return results
+
+
+def bench_player(rounds=50):
+    """Compare starting and stopping movies with a player process per movie
+    (the fake player, started like omxplayer) and with one player process
+    that loads every movie over IPC (the mpv player with fake_mpv).  The time
+    of spawn only lasts until the process was forked, starting the player
+    program and its decoder comes on top.  ipc_us is the round trip of a
+    property query.
+    """
+    from . import fake_mpv, fake_player, mpv
+    config = configparser.ConfigParser()
+    config.read_dict({'fake_player': {'duration': '1000'},
+                      'mpv': {'command': '{0} {1} --fake-duration=1000'.format(sys.executable, fake_mpv.__file__)}})
+    results = {}
+    for name, player in (('spawn', fake_player.create_player(config)), ('ipc', mpv.create_player(config))):
+        # The mpv player starts its process for the first movie.
+        player.play('movie.mp4')
+        player.stop(3)
+        play = 0
+        stop = 0
+        for i in range(rounds):
+            start = time.perf_counter()
+            player.play('movie_{0}.mp4'.format(i % 2))
+            play += time.perf_counter() - start
+            start = time.perf_counter()
+            player.stop(3)
+            stop += time.perf_counter() - start
+        results[name + '_play_ms'] = 1000 * play / rounds
+        results[name + '_stop_ms'] = 1000 * stop / rounds
+        if name == 'ipc':
+            player.play('movie.mp4')
+            start = time.perf_counter()
+            for i in range(rounds):
+                player.position()
+            results['ipc_us'] = 1e6 * (time.perf_counter() - start) / rounds
+            player.close()
+    return results
+
+
+def _ebml(element_id, *children):
+    payload = b''.join(children)
+    size = struct.pack('>Q', len(payload) | (1 << 56))
+    return element_id + size + payload
+
+
+def _make_mkv(filename, duration, width, height):
+    """Write a small Matroska file with a single H264 video track."""
+    header = _ebml(b'\x1a\x45\xdf\xa3', _ebml(b'\x42\x82', b'matroska'))
+    info = _ebml(b'\x15\x49\xa9\x66', _ebml(b'\x2a\xd7\xb1', struct.pack('>I', 1000000)),
+                 _ebml(b'\x44\x89', struct.pack('>d', duration * 1000)))
+    track = _ebml(b'\xae', _ebml(b'\x83', b'\x01'), _ebml(b'\x86', b'V_MPEG4/ISO/AVC'),
+                  _ebml(b'\xe0', _ebml(b'\xb0', struct.pack('>H', width)),
+                        _ebml(b'\xba', struct.pack('>H', height))))
+    cluster = _ebml(b'\x1f\x43\xb6\x75', bytes(4096))
+    with open(filename, 'wb') as f:
+        f.write(header + _ebml(b'\x18\x53\x80\x67', info, _ebml(b'\x16\x54\xae\x6b', track), cluster))
+
+
+def bench_metadata(count=2000):
+    """Time reading the metadata of count movies with an empty index (every
+    header is parsed) and again with the saved index (only stat calls).
+    """
+    path = tempfile.mkdtemp()
+    results = {}
+    try:
+        filenames = []
+        for i in range(count):
+            filename = os.path.join(path, 'movie_{0}.{1}'.format(i, 'mkv' if i % 2 else 'mp4'))
+            if i % 2:
+                _make_mkv(filename, 60 + i, 1920, 1080)
+            else:
+                write_mp4(filename, 60 + i, truncate=i % 10 == 0)
+            filenames.append(filename)
+        index_path = os.path.join(path, 'index.json')
+        for name in ('cold', 'warm'):
+            start = time.perf_counter()
+            index = MetadataIndex(index_path)
+            infos = [index.get(x) for x in filenames]
+            index.save()
+            results[name + '_ms'] = 1000 * (time.perf_counter() - start)
+        results['invalid'] = sum(1 for x in infos if x.valid is False)
+    finally:
+        shutil.rmtree(path)
+    return results
+
+
+def bench_schedule(windows=1000, lookups=100000):
+    """Time finding the active windows of a schedule with many windows with
+    the precomputed segment index and with a linear check of every window.
+    """
+    specs = [('w{0}'.format(i), '{0} {1:02d}:{2:02d}-{3:02d}:{2:02d} w{4}_*'.format(
+        ['mon-fri', 'sat,sun', '*'][i % 3], i % 24, i % 60, (i * 7 + 3) % 24, i))
+        for i in range(windows)]
+    start = time.perf_counter()
+    schedule = Schedule(specs)
+    results = {'build_ms': 1000 * (time.perf_counter() - start)}
+    parsed = [parse_window(x[1]) for x in specs]
+    now = time.time()
+    times = [now + i * 601 for i in range(lookups)]
+
+    def linear(t):
+        seconds = week_seconds(t)
+        day, seconds = divmod(seconds, 86400)
+        return [spec[0] for spec, (days, begin, end, _) in zip(specs, parsed)
+                if day in days and (begin <= seconds < end or
+                                    (end <= begin and (seconds >= begin or seconds < end)))]
+
+    # The matching function of a set of windows is created on its first
+    # lookup, time the lookups once that happened.
+    for t in times:
+        schedule.lookup(t)
+    start = time.perf_counter()
+    for t in times:
+        schedule.lookup(t)
+    results['indexed_us'] = 1e6 * (time.perf_counter() - start) / lookups
+    start = time.perf_counter()
+    for t in times[:lookups // 100]:
+        linear(t)
+    results['linear_us'] = 1e6 * (time.perf_counter() - start) / (lookups // 100)
+    return results
+
+
+class _LegacyMovie:
+    """Movie as it was before slots were used."""
+
+    def __init__(self, filename, repeats=1):
+        self.filename = filename
+        self.repeats = int(repeats)
+        self.playcount = 0
+
+
+def bench_playlist(entries=300000, distinct=(1000, 300000)):
+    """Time loading a M3U playlist with many entries and measure the memory
+    the loaded playlist uses, compared to a plain list with a Movie object
+    without slots for every entry.  The playlist repeats each number of
+    distinct movies, from a few movies played many times to every entry
+    being a different movie.
+    """
+    path = tempfile.mkdtemp()
+    results = {}
+    try:
+        for count in distinct:
+            filename = os.path.join(path, 'playlist.m3u')
+            with open(filename, 'w') as f:
+                f.write('#EXTM3U\n')
+                for i in range(entries):
+                    f.write('videos/signage_movie_{0:06d}.mp4\n'.format(i % count))
+            for name in ('legacy', 'ordered'):
+                def load():
+                    if name == 'legacy':
+                        with open(filename, 'r') as f:
+                            return [_LegacyMovie(os.path.join(path, x.strip())) for x in f
+                                    if x.strip() and x[0] != '#']
+                    return read_playlist_file(filename, False)
+                # Time without tracemalloc, it slows down allocations a lot.
+                start = time.perf_counter()
+                load()
+                results['{0}_{1}_load_ms'.format(name, count)] = 1000 * (time.perf_counter() - start)
+                tracemalloc.start()
+                playlist = load()
+                results['{0}_{1}_mb'.format(name, count)] = tracemalloc.get_traced_memory()[0] / 1e6
+                tracemalloc.stop()
+                del playlist
+    finally:
+        shutil.rmtree(path)
+    return results
+
+
+def bench_random(movies=100, cycles=10, sizes=(100, 100000), picks=100000):
+    """Compare the random modes: how many picks repeat the previous movie,
+    the difference between the most and least played movie after playing
+    cycles times as many movies as there are, and the time per pick for
+    playlists of different sizes.
+    """
+    results = {}
+    for mode in ('uniform', 'shuffle', 'weighted'):
+        playlist = Playlist([Movie('movie_{0:06d}.mp4'.format(i)) for i in range(movies)], True)
+        playlist.set_picker(create_picker(mode, 1))
+        played = [playlist.get_next().filename for i in range(movies * cycles)]
+        counts = [played.count(x.filename) for x in playlist.movies()]
+        results[mode + '_repeats'] = sum(1 for a, b in zip(played, played[1:]) if a == b)
+        results[mode + '_spread'] = max(counts) - min(counts)
+        for size in sizes:
+            playlist = Playlist([Movie('movie_{0:06d}.mp4'.format(i)) for i in range(size)], True)
+            playlist.set_picker(create_picker(mode, 1))
+            # The first pick builds the bag or alias table.
+            playlist.get_next()
+            start = time.perf_counter()
+            for i in range(picks):
+                playlist.get_next()
+            results['{0}_{1}_pick_us'.format(mode, size)] = 1e6 * (time.perf_counter() - start) / picks
+    return results
+
+
+def bench_metrics(calls=1000000, files=500):
+    """Time recording to the metrics (the cost added to the main loop) and
+    rendering them with many labeled values.
+    """
+    counter = metrics.Counter('bench_total', 'Benchmark counter.')
+    labeled = metrics.Counter('bench_labeled_total', 'Benchmark counter.', 'file')
+    histogram = metrics.Histogram('bench_seconds', 'Benchmark histogram.')
+    names = ['/home/pi/video/movie_{0}.mp4'.format(i) for i in range(files)]
+    results = {}
+    start = time.perf_counter()
+    for i in range(calls):
+        counter.inc()
+    results['counter_ns'] = 1e9 * (time.perf_counter() - start) / calls
+    start = time.perf_counter()
+    for i in range(calls):
+        histogram.observe(0.003)
+    results['histogram_ns'] = 1e9 * (time.perf_counter() - start) / calls
+    start = time.perf_counter()
+    for i in range(calls):
+        labeled.inc(1, names[i % files])
+    results['labeled_ns'] = 1e9 * (time.perf_counter() - start) / calls
+    registry = metrics.Registry()
+    for metric in (counter, labeled, histogram):
+        registry.register(metric)
+    start = time.perf_counter()
+    text = registry.render()
+    results['render_ms'] = 1000 * (time.perf_counter() - start)
+    results['render_kb'] = len(text) / 1000
+    return results
+
+
+def bench_osd(size=(1920, 1080), frames=50):
+    """Time clearing the screen with a background image and drawing a
+    countdown frame the old way (unconverted image, text rendered every time,
+    full display update) and with the OSD renderer.  Runs with the dummy SDL
+    video driver, so the time to push the pixels to the display isn't
+    included.
+    """
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    import pygame
+    from .osd import OSDRenderer
+    pygame.display.init()
+    pygame.font.init()
+    path = tempfile.mkdtemp()
+    results = {}
+    try:
+        screen = pygame.display.set_mode(size)
+        imagepath = os.path.join(path, 'bg.png')
+        image = pygame.Surface((size[0] // 2, size[1] // 2), depth=24)
+        for x in range(0, image.get_width(), 16):
+            pygame.draw.line(image, (x % 256, 64, 128), (x, 0), (x, image.get_height()), 8)
+        pygame.image.save(image, imagepath)
+        bgcolor, fgcolor = (0, 0, 0), (255, 255, 255)
+        fonts = {50: pygame.font.Font(None, 50), 250: pygame.font.Font(None, 250)}
+        sw, sh = size
+
+        def countdown_labels(text, i):
+            label1 = text('Found 10 movies. Starting playback in:', 50)
+            label2 = text(str(i % 10), 250)
+            l1w, l1h = label1.get_size()
+            l2w, l2h = label2.get_size()
+            return [(label1, (sw/2-l1w/2, sh/2-l2h/2-l1h)), (label2, (sw/2-l2w/2, sh/2-l2h/2))]
+
+        # The old way.
+        bgimage = pygame.transform.scale(pygame.image.load(imagepath), size)
+        legacy_text = lambda message, size: fonts[size].render(message, True, fgcolor, bgcolor)
+
+        def legacy_blank(i):
+            screen.fill(bgcolor)
+            screen.blit(bgimage, bgimage.get_rect())
+            pygame.display.update()
+
+        def legacy_frame(i):
+            screen.fill(bgcolor)
+            for surface, pos in countdown_labels(legacy_text, i):
+                screen.blit(surface, pos)
+            pygame.display.update()
+
+        renderer = OSDRenderer(screen, bgcolor, fgcolor, pygame.image.load(imagepath))
+        for name, func in (('legacy_blank', legacy_blank),
+                           ('legacy_frame', legacy_frame),
+                           ('blank', lambda i: renderer.blank()),
+                           ('frame', lambda i: renderer.draw(countdown_labels(renderer.text, i)))):
+            start = time.perf_counter()
+            for i in range(frames):
+                func(i)
+            results[name + '_ms'] = 1000 * (time.perf_counter() - start) / frames
+    finally:
+        pygame.quit()
+        shutil.rmtree(path)
+    return results
+
+
+def bench_control(clients=200, commands=50):
+    """Time commands sent to the control server by many clients at once
+    while the main thread handles them like the main loop does.
+    """
+    import threading
+    from .control import ControlServer
+    path = tempfile.mkdtemp()
+    results = {}
+    try:
+        server = ControlServer(os.path.join(path, 'control.sock'))
+        selector = selectors.DefaultSelector()
+        selector.register(server.fileno(), selectors.EVENT_READ)
+        handled = [0]
+
+        def handler(command, args, output):
+            handled[0] += 1
+            return {'movie': 'movie.mp4'}
+
+        latencies = []
+
+        def client():
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+                s.connect(os.path.join(path, 'control.sock'))
+                f = s.makefile('rb')
+                for i in range(commands):
+                    start = time.perf_counter()
+                    s.sendall(b'status\n')
+                    f.readline()
+                    latencies.append(time.perf_counter() - start)
+
+        threads = [threading.Thread(target=client) for i in range(clients)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        while handled[0] < clients * commands:
+            selector.select(1.0)
+            server.handle(handler)
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        results['commands_per_s'] = clients * commands / elapsed
+        results['mean_ms'] = 1000 * sum(latencies) / len(latencies)
+        results['p95_ms'] = 1000 * _percentile(latencies, 95)
+        server.close()
+    finally:
+        shutil.rmtree(path)
+    return results
+
+
+def _looper_config(directory, files=10, duration=1.0, sections=None, **options):
+    """Write a config file for a looper with the fake player and reader to
+    directory and return its path.  Options override [video_looper] values,
+    sections is a dict of additional sections.
+    """
+    looper = {
+        'video_player': 'fake_player',
+        'file_reader': 'fake_reader',
+        'osd': 'false',
+        'console_output': 'false',
+        'is_random': 'false',
+        'keyboard_control': 'false',
+        'countdown_time': '0',
+        'wait_time': '0',
+        'bgcolor': '0, 0, 0',
+        'fgcolor': '255, 255, 255',
+        'metadata_index': os.path.join(directory, 'metadata.json'),
+    }
+    looper.update(options)
+    config = configparser.ConfigParser()
+    config.read_dict({
+        'video_looper': looper,
+        'omxplayer': {'sound_vol_file': 'sound_volume'},
+        'fake_player': {'duration': str(duration)},
+        'fake_reader': {'path': os.path.join(directory, 'movies'), 'files': str(files), 'duration': str(duration)},
+    })
+    config.read_dict(sections or {})
+    path = os.path.join(directory, 'video_looper.ini')
+    with open(path, 'w') as f:
+        config.write(f)
+    return path
+
+
+def _create_looper(config_path):
+    """Create a VideoLooper that renders to the dummy SDL video driver."""
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    from .video_looper import VideoLooper
+    return VideoLooper(config_path)
+
+
+def _run_looper(looper, seconds):
+    """Run the main loop of a looper for seconds."""
+    old_handler = signal.signal(signal.SIGALRM, looper.signal_quit)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        looper.run()
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, old_handler)
+
+
+def _percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def bench_switch(duration=1.0, load_time=0.3, seconds=8.0):
+    """Measure the time from the end of a movie until the first frame of the
+    next one, with and without gapless playback.  The fake player takes
+    load_time seconds until the first frame of a movie shows.
+    """
+    results = {}
+    for gapless in ('false', 'true'):
+        path = tempfile.mkdtemp()
+        try:
+            looper = _create_looper(_looper_config(path, files=5, duration=duration, gapless=gapless,
+                                                   gapless_preload=str(2 * load_time),
+                                                   sections={'fake_player': {'load_time': str(load_time)}}))
+            _run_looper(looper, seconds)
+            latencies = looper._outputs[0].player.switch_latencies()
+            name = 'gapless' if gapless == 'true' else 'spawn'
+            results[name + '_switches'] = len(latencies)
+            if latencies:
+                results[name + '_mean_ms'] = 1000 * sum(latencies) / len(latencies)
+                results[name + '_p95_ms'] = 1000 * _percentile(latencies, 95)
+                results[name + '_max_ms'] = 1000 * max(latencies)
+        finally:
+            shutil.rmtree(path)
+    return results
+
+
+def bench_loop_cpu(seconds=10.0):
+    """Measure the cpu time the main loop uses per hour while one long movie
+    plays and while movies switch every second.
+    """
+    results = {}
+    for name, duration in (('playing', 3600), ('switching', 1.0)):
+        path = tempfile.mkdtemp()
+        try:
+            looper = _create_looper(_looper_config(path, files=5, duration=duration))
+            cpu_start = time.process_time()
+            start = time.monotonic()
+            _run_looper(looper, seconds)
+            cpu = time.process_time() - cpu_start
+            results[name + '_cpu_s_per_hour'] = 3600 * cpu / (time.monotonic() - start)
+        finally:
+            shutil.rmtree(path)
+    return results
+
+
+def bench_build(sizes=(1000, 10000, 100000)):
+    """Time building the playlist of a looper with many movies, the first
+    time (every movie header is read) and again (from the metadata index).
+    """
+    results = {}
+    for size in sizes:
+        path = tempfile.mkdtemp()
+        try:
+            looper = _create_looper(_looper_config(path, files=size))
+            for name in ('cold', 'warm'):
+                start = time.perf_counter()
+                looper._build_playlists()
+                results['{0}_{1}_ms'.format(name, size)] = 1000 * (time.perf_counter() - start)
+            looper.quit()
+        finally:
+            shutil.rmtree(path)
+    return results
+
+
+_STARTUP_SCRIPT = '''
+import os, sys, time
+start = time.perf_counter()
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+from Pi_Video_Looper.video_looper import VideoLooper
+imported = time.perf_counter()
+looper = VideoLooper(sys.argv[1])
+created = time.perf_counter()
+
+def play(*args, **kwargs):
+    # CLOCK_MONOTONIC is the same in all processes.
+    print(imported - start, created - imported, time.monotonic())
+    sys.stdout.flush()
+    os._exit(0)
+
+looper._outputs[0].player.play = play
+looper.run()
+'''
+
+
+def bench_startup(rounds=5):
+    """Time starting the looper in a new process until the first movie is
+    played, with the on screen display (pygame is loaded) and without it
+    (headless).  import and init are the time to import the modules and to
+    create the VideoLooper, first_play is the time from starting the process
+    until the player is asked to play the first movie.
+    """
+    path = tempfile.mkdtemp()
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))]
+        + [x for x in [env.get('PYTHONPATH')] if x])
+    results = {}
+    try:
+        for name, osd in (('osd', 'true'), ('headless', 'false')):
+            os.mkdir(os.path.join(path, name))
+            config_path = _looper_config(os.path.join(path, name), files=100, osd=osd)
+            totals = [0.0, 0.0, 0.0]
+            for i in range(rounds):
+                start = time.monotonic()
+                output = subprocess.check_output([sys.executable, '-c', _STARTUP_SCRIPT, config_path], env=env)
+                imported, created, played = [float(x) for x in output.split()[-3:]]
+                totals[0] += imported
+                totals[1] += created
+                totals[2] += played - start
+            for key, total in zip(('import_ms', 'init_ms', 'first_play_ms'), totals):
+                results['{0}_{1}'.format(name, key)] = 1000 * total / rounds
+    finally:
+        shutil.rmtree(path)
+    return results
+
+
+_OUTPUTS_SCRIPT = '''
+import resource, sys, time
+from Pi_Video_Looper.benchmark import _create_looper, _run_looper
+looper = _create_looper(sys.argv[1])
+start = time.monotonic()
+cpu_start = time.process_time()
+_run_looper(looper, float(sys.argv[2]))
+cpu = time.process_time() - cpu_start
+played = sum(len(x.player.played()) for x in looper._outputs)
+print(played, 3600 * cpu / (time.monotonic() - start), resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+
+def bench_outputs(counts=(1, 2, 4), seconds=10.0, files=10):
+    """Measure the cpu time per hour and the peak memory of one looper process
+    driving 1, 2 and 4 outputs that switch movies every second.  Separate
+    processes would need count times the cpu and memory of one output.
+    """
+    path = tempfile.mkdtemp()
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))]
+        + [x for x in [env.get('PYTHONPATH')] if x])
+    results = {}
+    try:
+        for count in counts:
+            directory = os.path.join(path, str(count))
+            os.mkdir(directory)
+            names = ['out{0}'.format(i) for i in range(count)]
+            sections = {'output:' + x: {'duration': '1.0'} for x in names}
+            config_path = _looper_config(directory, files=files, sections=sections, outputs=', '.join(names))
+            output = subprocess.check_output([sys.executable, '-c', _OUTPUTS_SCRIPT, config_path, str(seconds)], env=env)
+            played, cpu, rss = output.split()[-3:]
+            results['movies_played_{0}'.format(count)] = int(played)
+            results['cpu_s_per_hour_{0}'.format(count)] = float(cpu)
+            results['max_rss_mb_{0}'.format(count)] = int(rss) / 1024
+    finally:
+        shutil.rmtree(path)
+    return results
+
+
+_SYNC_SCRIPT = '''
+import json, os, sys, time
+from Pi_Video_Looper.benchmark import _create_looper, _run_looper
+looper = _create_looper(sys.argv[1])
+sync = looper._sync
+offset, drift = float(sys.argv[3]), float(sys.argv[4])
+player = looper._outputs[0].player
+# Start times of the movies started by the leader.
+synced = []
+if sync.role == 'follower':
+    # Stand in for a unit whose clock has a different time and rate.
+    sync._clock = lambda: time.monotonic() * (1 + drift) + offset
+    started = sync.started
+    def record(seq, at):
+        synced.append(player.start_times()[-1])
+        return started(seq, at)
+    sync.started = record
+_run_looper(looper, float(sys.argv[2]))
+true_offset = time.monotonic() - sync._clock()
+print(json.dumps({
+    'starts': [[os.path.basename(x), t] for x, t in zip(player.played(), player.start_times())],
+    'synced': synced,
+    'offset_error': sync.offset() - true_offset if sync.role == 'follower' else 0.0,
+}))
+'''
+
+
+def bench_sync(followers=2, seconds=8.0, duration=1.0, lead_time=0.2):
+    """Run a sync leader and followers as separate processes on localhost,
+    the followers with clocks that are off by up to 1000 seconds and run
+    fast or slow by 100 ppm.  Measures the skew between the start of the same
+    movie on the leader and the followers (all processes share the monotonic
+    clock of the host), how many movies the followers started on their own
+    and the error of the estimated clock offsets.
+    """
+    path = tempfile.mkdtemp()
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(os.path.abspath(__file__)))]
+        + [x for x in [env.get('PYTHONPATH')] if x])
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    results = {}
+    try:
+        processes = []
+        for i in range(followers + 1):
+            directory = os.path.join(path, str(i))
+            os.mkdir(directory)
+            sync = {'port': str(port), 'lead_time': str(lead_time), 'probe_interval': '0.5'}
+            if i == 0:
+                sync.update(role='leader', address='127.0.0.1')
+                clock = ('0', '0')
+            else:
+                sync.update(role='follower', leader='127.0.0.1')
+                clock = (str(1000.0 / i * (-1) ** i), str(0.0001 * (-1) ** i))
+            config_path = _looper_config(directory, files=5, duration=duration, sections={'sync': sync})
+            processes.append(subprocess.Popen([sys.executable, '-c', _SYNC_SCRIPT, config_path, str(seconds)] + list(clock),
+                                              env=env, stdout=subprocess.PIPE))
+            if i == 0:
+                # Let the leader bind its port first.
+                time.sleep(0.5)
+        reports = [json.loads(x.communicate()[0].decode('utf-8').split('\n')[-2]) for x in processes]
+        leader = reports[0]['starts']
+        skews = []
+        unsynced = 0
+        for report in reports[1:]:
+            synced = set(report['synced'])
+            for name, t in report['starts']:
+                # Only the starts of the leader's movies count, not the ones
+                # the follower played on its own while it wasn't following.
+                if t not in synced:
+                    unsynced += 1
+                    continue
+                matches = [abs(t - x) for y, x in leader if y == name and abs(t - x) < duration / 2]
+                if matches:
+                    skews.append(min(matches))
+        results['synchronized_starts'] = len(skews)
+        results['unsynchronized_starts'] = unsynced
+        if skews:
+            results['skew_mean_ms'] = 1000 * sum(skews) / len(skews)
+            results['skew_p95_ms'] = 1000 * _percentile(skews, 95)
+            results['skew_max_ms'] = 1000 * max(skews)
+        results['offset_error_max_ms'] = 1000 * max(abs(x['offset_error']) for x in reports[1:])
+    finally:
+        shutil.rmtree(path)
+    return results
+
+
+BENCHMARKS = {
+    'switch': bench_switch,
+    'loop_cpu': bench_loop_cpu,
+    'build': bench_build,
+    'startup': bench_startup,
+    'outputs': bench_outputs,
+    'sync': bench_sync,
+    'random': bench_random,
+    'metrics': bench_metrics,
+    'osd': bench_osd,
+    'control': bench_control,
+    'playlist': bench_playlist,
+    'schedule': bench_schedule,
+    'metadata': bench_metadata,
+    'stop': bench_stop,
+    'player': bench_player,
+    'copy': bench_copy,
+    'prefetch': bench_prefetch,
+    'idle': bench_idle,
+    'scan': bench_scan,
+    'tree': bench_tree,
+}
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(prog='python3 -m Pi_Video_Looper.benchmark',
+                                     description='Run benchmarks of parts of the video looper.')
+    parser.add_argument('--json', action='store_true', help='print the results as one JSON object')
+    parser.add_argument('names', nargs='*', metavar='name',
+                        help='benchmark to run (default all): {0}'.format(', '.join(sorted(BENCHMARKS))))
+    options = parser.parse_args(argv)
+    unknown = [x for x in options.names if x not in BENCHMARKS]
+    if unknown:
+        parser.error('unknown benchmark {0}, choose from {1}'.format(
+            ', '.join(unknown), ', '.join(sorted(BENCHMARKS))))
+    results = {}
+    for name in options.names or sorted(BENCHMARKS):
+        results[name] = BENCHMARKS[name]()
+        if not options.json:
+            for key, value in results[name].items():
+                print('{0}.{1}: {2:.3f}'.format(name, key, value))
+    if options.json:
+        print(json.dumps({'python': platform.python_version(),
+                          'machine': platform.machine(),
+                          'time': int(time.time()),
+                          'benchmarks': results}, sort_keys=True))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,240 @@
+# Copyright 2019 bitconnect
+# Author: Tobias Perschon
+# License: GNU GPLv2, see LICENSE.txt
+import asyncio
+import collections
+import json
+import os
+import socket
+import stat
+import sys
+import threading
+
+# Control of a running video looper over a UNIX domain socket.  Clients send
+# one command per line, either as text like "jump 3" or as a JSON object like
+# {"command": "jump", "args": [3]}, and get one line of JSON back for every
+# command, like {"ok": true, "movie": "/home/pi/video/ad.mp4"} or
+# {"ok": false, "error": "unknown command: foo"}.  If the looper has several
+# outputs a JSON command can select one with "output": "<name>", otherwise it
+# goes to the first output.
+#
+# Commands:
+#   status              the current movie, playlist and player state
+#   next                skip to the next movie
+#   previous            go back to the previous movie
+#   jump <n|name>       play entry n (starting at 0) or the movie with the file
+#                       name (or path) of the playlist
+#   pause, resume       pause and resume the player
+#   reload              build the playlist again
+#   volume <millibels>  set the volume, of the current movie too if the player
+#                       can change it while playing (like mpv), otherwise from
+#                       the next movie on ("applied" in the response tells)
+#
+# reload builds the playlists of all outputs again, as they share the scan.
+#
+# The server runs an asyncio event loop in a background thread, so any number
+# of clients can be connected without affecting playback.  Commands are passed
+# to the main loop of the video looper, which runs them between its other work
+# and wakes up for them through the file descriptor of the server.
+#
+# Run this module to send a command from the command line:
+#
+#   python3 -m Pi_Video_Looper.control [--socket path] [--output name] command [args ...]
+
+DEFAULT_SOCKET = '/run/video_looper.sock'
+COMMANDS = ('status', 'next', 'previous', 'jump', 'pause', 'resume', 'reload', 'volume')
+# Longest accepted command line.
+MAX_LINE = 64 * 1024
+
+
+def parse_request(line):
+    """Parse a command line (bytes) into the command, its list of arguments
+    and the name of the output (None for the first output).  Raises
+    ValueError if it is malformed.
+    """
+    text = line.decode('utf-8').strip()
+    if text.startswith('{'):
+        request = json.loads(text)
+        if not isinstance(request, dict) or not isinstance(request.get('command'), str):
+            raise ValueError('expected {"command": ..., "args": [...]}')
+        args = request.get('args', [])
+        if not isinstance(args, list):
+            args = [args]
+        command = request['command']
+        output = request.get('output')
+        if output is not None and not isinstance(output, str):
+            raise ValueError('output must be the name of an output')
+    else:
+        parts = text.split(None, 1)
+        if not parts:
+            raise ValueError('empty command')
+        command = parts[0]
+        # Everything after the command is one argument, so file names with
+        # spaces work.
+        args = parts[1:]
+        output = None
+    command = command.lower()
+    if command not in COMMANDS:
+        raise ValueError('unknown command: {0}'.format(command))
+    return command, args, output
+
+
+class ControlServer:
+
+    def __init__(self, path=DEFAULT_SOCKET):
+        """Create the control server listening on a UNIX domain socket at
+        path.  A socket left behind by a previous run is replaced.  Raises
+        OSError if the socket can't be created.
+        """
+        self._path = path
+        # Requests waiting for the main loop as (command, args, output,
+        # future).
+        self._requests = collections.deque()
+        self._notify_r, self._notify_w = os.pipe()
+        os.set_blocking(self._notify_r, False)
+        os.set_blocking(self._notify_w, False)
+        try:
+            if stat.S_ISSOCK(os.stat(path).st_mode):
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._server = self._loop.run_until_complete(
+                asyncio.start_unix_server(self._handle_client, path=path, limit=MAX_LINE))
+        except OSError:
+            self._loop.close()
+            raise
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def fileno(self):
+        """Return a file descriptor that becomes readable when commands are
+        waiting to be handled.
+        """
+        return self._notify_r
+
+    def _notify(self):
+        try:
+            os.write(self._notify_w, b'x')
+        except BlockingIOError:
+            pass
+
+    async def _handle_client(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    command, args, output = parse_request(line)
+                except ValueError as e:
+                    response = {'ok': False, 'error': str(e)}
+                else:
+                    future = self._loop.create_future()
+                    self._requests.append((command, args, output, future))
+                    self._notify()
+                    response = await future
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            # ValueError is raised for lines longer than MAX_LINE.
+            pass
+        except asyncio.CancelledError:
+            # The server is shut down.
+            pass
+        finally:
+            writer.close()
+
+    def _respond(self, future, response):
+        if not future.done():
+            future.set_result(response)
+
+    def handle(self, handler):
+        """Run handler(command, args, output) for every waiting command and
+        send the dict it returns to the client.  Must be called from the main loop.
+        Exceptions raised by the handler are sent as errors, so every client
+        gets an answer and a bad command can't stop the main loop.
+        """
+        try:
+            while os.read(self._notify_r, 512):
+                pass
+        except BlockingIOError:
+            pass
+        while self._requests:
+            command, args, output, future = self._requests.popleft()
+            try:
+                response = dict(handler(command, args, output) or {})
+                response['ok'] = True
+            except Exception as e:
+                response = {'ok': False, 'error': str(e) or type(e).__name__}
+            self._loop.call_soon_threadsafe(self._respond, future, response)
+
+    async def _shutdown(self):
+        self._server.close()
+        tasks = [x for x in asyncio.all_tasks() if x is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._loop.stop()
+
+    def close(self):
+        """Stop the server, disconnect all clients and remove the socket."""
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop)
+        self._thread.join()
+        self._loop.close()
+        try:
+            os.remove(self._path)
+        except FileNotFoundError:
+            pass
+        os.close(self._notify_r)
+        os.close(self._notify_w)
+
+
+def send_command(command, args=(), path=DEFAULT_SOCKET, timeout=10, output=None):
+    """Send a command for output (None for the first output) to the control
+    server at path and return its response as a dict.  Raises OSError if the
+    server can't be reached.
+    """
+    request = {'command': command, 'args': list(args)}
+    if output is not None:
+        request['output'] = output
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout)
+        s.connect(path)
+        s.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        data = b''
+        while not data.endswith(b'\n'):
+            chunk = s.recv(4096)
+            if not chunk:
+                raise ConnectionError('connection closed by the video looper')
+            data += chunk
+    return json.loads(data.decode('utf-8'))
+
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(prog='python3 -m Pi_Video_Looper.control',
+                                     description='Control a running video looper.')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help='path of the control socket')
+    parser.add_argument('--output', help='name of the output (default the first one)')
+    parser.add_argument('command', choices=COMMANDS)
+    parser.add_argument('args', nargs='*')
+    options = parser.parse_args(argv)
+    # Pass the arguments as one, like a text command.
+    args = [' '.join(options.args)] if options.args else []
+    try:
+        response = send_command(options.command, args, options.socket, output=options.output)
+    except OSError as e:
+        print('Failed to connect to {0}: {1}'.format(options.socket, e), file=sys.stderr)
+        return 2
+    if not response.pop('ok', False):
+        print(response.get('error', 'failed'), file=sys.stderr)
+        return 1
+    for key, value in sorted(response.items()):
+        print('{0}: {1}'.format(key, value))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
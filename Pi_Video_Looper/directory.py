@@ -1,6 +1,23 @@
 # Copyright 2019 bitconnect
 # Author: Tobias Perschon
 # License: GNU GPLv2, see LICENSE.txt
+import os
+import time
+
+from .inotify import InotifyWatcher, IN_CLOSE_WRITE, IN_MOVED_FROM, \
+                     IN_MOVED_TO, IN_DELETE, IN_DELETE_SELF, IN_MOVE_SELF, \
+                     IN_Q_OVERFLOW, IN_IGNORED, IN_ONLYDIR, IN_ISDIR
+
+# Files are only picked up once they are closed after writing or moved into
+# the directory, so half copied files are never added.
+_WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE | \
+              IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+# Events after which the directory has to be read again completely.
+_RESCAN_MASK = IN_DELETE_SELF | IN_MOVE_SELF | IN_Q_OVERFLOW | IN_IGNORED
+# Seconds between tries to watch the directory while it doesn't exist.
+WATCH_RETRY_INTERVAL = 5.0
+
+
 class DirectoryReader:
 
     def __init__(self, config):
@@ -8,22 +25,106 @@ class DirectoryReader:
         directory on disk.
         """
         self._load_config(config)
+        self._added = set()
+        self._removed = set()
+        self._rescan = False
+        self._deadline = None
+        # When to try again to watch the directory, None while it's watched.
+        self._next_watch = None
+        try:
+            self._watcher = InotifyWatcher()
+        except OSError:
+            # No inotify, behave like a directory that never changes.
+            self._watcher = None
+        else:
+            self._watch()
 
     def _load_config(self, config):
         self._path = config.get('directory', 'path')
+        self._debounce = config.getfloat('directory', 'debounce', fallback=1.0)
+
+    def _watch(self):
+        """Watch the directory, or try again later if it doesn't exist (yet).
+        Returns true if it is watched.
+        """
+        try:
+            self._watcher.add_watch(self._path, _WATCH_MASK)
+        except OSError:
+            self._next_watch = time.monotonic() + WATCH_RETRY_INTERVAL
+            return False
+        self._next_watch = None
+        return True
 
     def search_paths(self):
         """Return a list of paths to search for files."""
         return [self._path]
 
     def is_changed(self):
-        """Return true if the file search paths have changed."""
-        # For now just return false and assume the path never changes.  In the
-        # future it might be interesting to watch for file changes and return
-        # true if new files are added/removed from the directory.  This is 
-        # called in a tight loop of the main program so it needs to be fast and
-        # not resource intensive.
-        return False
+        """Return true if files were added to or removed from the directory.
+        Changes are collected until no new events arrived for the debounce
+        time so that copying many files at once results in one update.
+        """
+        if self._watcher is None:
+            return False
+        events = self._watcher.read_events()
+        for wd, mask, cookie, name in events:
+            if mask & _RESCAN_MASK:
+                self._rescan = True
+            elif mask & IN_ISDIR:
+                continue
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                self._removed.discard(name)
+                self._added.add(name)
+            elif mask & (IN_DELETE | IN_MOVED_FROM):
+                self._added.discard(name)
+                self._removed.add(name)
+        if self._next_watch is not None and time.monotonic() >= self._next_watch and self._watch():
+            # The directory was created, search it.
+            self._rescan = True
+            self._deadline = None
+            return True
+        if events:
+            self._deadline = time.monotonic() + self._debounce
+        if self._deadline is None or time.monotonic() < self._deadline:
+            return False
+        self._deadline = None
+        return self._rescan or bool(self._added or self._removed)
+
+    def get_changes(self):
+        """Return a tuple of lists with the paths of files added and removed
+        since the last call, or None if the directory has to be searched again
+        completely.
+        """
+        if self._rescan:
+            changes = None
+            # The watch is gone if the directory was removed or moved, watch
+            # it again in case it was recreated (or once it is).
+            self._watch()
+        else:
+            changes = ([os.path.join(self._path, x) for x in sorted(self._added)],
+                       [os.path.join(self._path, x) for x in sorted(self._removed)])
+        self._added.clear()
+        self._removed.clear()
+        self._rescan = False
+        return changes
+
+    def wakeup_fds(self):
+        """Return a list of file descriptors that become readable when
+        is_changed should be checked, in this case the inotify instance.
+        """
+        if self._watcher is None:
+            return []
+        return [self._watcher.fileno()]
+
+    def wakeup_timeout(self):
+        """Return the seconds until is_changed should be checked again even
+        without new events, or None.  Used to end the debounce time and to try
+        again to watch a directory that doesn't exist.
+        """
+        times = [x for x in (self._deadline, self._next_watch) if x is not None]
+        if not times:
+            return None
+        return max(0, min(times) - time.monotonic())
 
     def idle_message(self):
         """Return a message to display when idle and no files are found."""
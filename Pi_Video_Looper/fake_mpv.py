@@ -0,0 +1,220 @@
+# Copyright 2019 bitconnect
+# Author: Tobias Perschon
+# License: GNU GPLv2, see LICENSE.txt
+import asyncio
+import json
+import os
+import sys
+import time
+
+# Stand-in for mpv that speaks the part of its JSON IPC protocol the mpv
+# player uses (see ipc.py), for the benchmarks and for trying the looper with
+# the mpv player without mpv or a display.  It takes the command line of mpv
+# and ignores everything but the socket:
+#
+#   python3 -m Pi_Video_Looper.fake_mpv --idle=yes --input-ipc-server=/tmp/mpv.sock [--fake-duration=1]
+#
+# "Playing" a file takes the fake duration (default 1 second or the
+# FAKE_DURATION environment variable) and sends the events mpv sends when it
+# starts and ends a file.  Set command = python3 -m Pi_Video_Looper.fake_mpv in
+# the [mpv] section to use it.
+
+DEFAULT_DURATION = 1.0
+
+
+class FakeMPV:
+
+    def __init__(self, duration=DEFAULT_DURATION):
+        self._duration = duration
+        self._writers = set()
+        self._properties = {'pause': False, 'volume': 100.0, 'loop-file': 'no'}
+        self._entry = None
+        self._next_entry = 0
+        self._path = None
+        # Position of the current file when it was (re)started or paused and
+        # when that was (None while paused).
+        self._position = 0.0
+        self._started = None
+        self._timer = None
+        self._quit = asyncio.Event()
+
+    def _send(self, message):
+        data = json.dumps(message).encode('utf-8') + b'\n'
+        for writer in list(self._writers):
+            writer.write(data)
+
+    def _event(self, name, **kwargs):
+        message = {'event': name}
+        message.update(kwargs)
+        self._send(message)
+
+    def _time_pos(self):
+        if self._started is None:
+            return self._position
+        return self._position + time.monotonic() - self._started
+
+    def _schedule_end(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._entry is not None and self._started is not None:
+            remaining = max(0.0, self._duration - self._time_pos())
+            self._timer = asyncio.get_running_loop().call_later(remaining, self._file_ended)
+
+    def _file_ended(self):
+        self._timer = None
+        if self._properties['loop-file'] in ('inf', 'yes'):
+            self._position, self._started = 0.0, time.monotonic()
+            self._event('playback-restart')
+            self._schedule_end()
+        else:
+            self._end_file('eof')
+
+    def _end_file(self, reason):
+        if self._entry is None:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._event('end-file', reason=reason, playlist_entry_id=self._entry)
+        self._entry = None
+        self._path = None
+
+    def _loadfile(self, path, mode='replace'):
+        self._end_file('stop')
+        self._next_entry += 1
+        self._entry = self._next_entry
+        self._path = path
+        self._position = 0.0
+        self._started = None if self._properties['pause'] else time.monotonic()
+        self._event('start-file', playlist_entry_id=self._entry)
+        self._event('file-loaded')
+        self._event('playback-restart')
+        self._schedule_end()
+        return {'playlist_entry_id': self._entry}
+
+    def _set_property(self, name, value):
+        if name not in self._properties:
+            raise ValueError('property not found')
+        if name == 'pause' and value != self._properties['pause']:
+            if value:
+                self._position, self._started = self._time_pos(), None
+            elif self._entry is not None:
+                self._started = time.monotonic()
+        self._properties[name] = value
+        self._schedule_end()
+
+    def _get_property(self, name):
+        if name == 'time-pos':
+            if self._entry is None:
+                raise ValueError('property unavailable')
+            return self._time_pos()
+        if name == 'idle-active':
+            return self._entry is None
+        if name == 'path':
+            return self._path
+        if name not in self._properties:
+            raise ValueError('property not found')
+        return self._properties[name]
+
+    def _seek(self, seconds, flags='relative'):
+        if self._entry is None:
+            raise ValueError('error running command')
+        position = float(seconds) if flags.startswith('absolute') else self._time_pos() + float(seconds)
+        self._position = max(0.0, position)
+        if self._started is not None:
+            self._started = time.monotonic()
+        self._event('playback-restart')
+        self._schedule_end()
+
+    def run_command(self, args):
+        """Run a command and return its data.  Raises ValueError with the
+        error mpv would answer with.
+        """
+        if not args:
+            raise ValueError('invalid parameter')
+        name, args = args[0], args[1:]
+        try:
+            if name == 'loadfile':
+                return self._loadfile(*args)
+            if name == 'stop':
+                self._end_file('stop')
+                self._event('idle')
+                return None
+            if name == 'seek':
+                return self._seek(*args)
+            if name == 'get_property':
+                return self._get_property(*args)
+            if name == 'set_property':
+                return self._set_property(*args)
+            if name == 'quit':
+                self._end_file('quit')
+                self._quit.set()
+                return None
+        except TypeError:
+            raise ValueError('invalid parameter')
+        raise ValueError('invalid parameter')
+
+    async def _handle_client(self, reader, writer):
+        self._writers.add(writer)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line.decode('utf-8'))
+                    command = request['command']
+                except (ValueError, KeyError, TypeError):
+                    writer.write(b'{"error": "invalid parameter"}\n')
+                    continue
+                response = {'error': 'success'}
+                try:
+                    response['data'] = self.run_command(command)
+                except ValueError as e:
+                    response['error'] = str(e)
+                if 'request_id' in request:
+                    response['request_id'] = request['request_id']
+                writer.write(json.dumps(response).encode('utf-8') + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        except asyncio.CancelledError:
+            # The server is shut down.
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def serve(self, path):
+        """Listen on the UNIX domain socket at path until quit."""
+        server = await asyncio.start_unix_server(self._handle_client, path=path)
+        async with server:
+            await self._quit.wait()
+            for writer in list(self._writers):
+                await writer.drain()
+
+
+def main(argv):
+    path = None
+    duration = float(os.environ.get('FAKE_DURATION', DEFAULT_DURATION))
+    for arg in argv:
+        if arg.startswith('--input-ipc-server='):
+            path = arg.split('=', 1)[1]
+        elif arg.startswith('--fake-duration='):
+            duration = float(arg.split('=', 1)[1])
+    if path is None:
+        print('fake_mpv needs --input-ipc-server=<path>', file=sys.stderr)
+        return 2
+    try:
+        asyncio.run(FakeMPV(duration).serve(path))
+    finally:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,141 @@
+# Copyright 2019 bitconnect
+# Author: Tobias Perschon
+# License: GNU GPLv2, see LICENSE.txt
+import os
+import signal
+import time
+
+from . import player_process
+
+# Stand-in video player for running the looper without a Raspberry Pi, used
+# by the benchmarks.  "Playing" a movie runs sleep for the configured duration
+# in a child process, so the main loop is woken up by SIGCHLD just like with a
+# real player.  Before the first frame the player sleeps for the configured
+# load time, a prepared player holds its first frame by stopping itself after
+# loading.  The player records how long it took from the end of one movie
+# until the first frame of the next one, and when every movie was started.
+
+
+class FakePlayer(player_process.StandbyPlayer):
+
+    def __init__(self, config):
+        """Create an instance of a video player that pretends to play every
+        movie for a fixed duration.
+        """
+        super().__init__()
+        # Time at which the current movie ends if it isn't stopped.
+        self._end_time = None
+        self._paused_at = None
+        # Time at which the first frame of the last started player shows.
+        self._first_frame = None
+        self._switch_latencies = []
+        self._played = []
+        self._start_times = []
+        self._load_config(config)
+
+    def _load_config(self, config):
+        self._extensions = config.get('fake_player', 'extensions', fallback='avi, mov, mkv, mp4, m4v, h264') \
+                                 .translate(str.maketrans('', '', ' \t\r\n.')) \
+                                 .split(',')
+        self._duration = config.getfloat('fake_player', 'duration', fallback=1.0)
+        self._load_time = config.getfloat('fake_player', 'load_time', fallback=0.0)
+
+    def supported_extensions(self):
+        """Return list of supported file extensions."""
+        return self._extensions
+
+    def _build_args(self, movie, loop, vol):
+        """Return the command line that stands in for playing movie.  The
+        movie, loop and volume are only part of it so play can tell if a
+        prepared player is for the same movie.
+        """
+        duration = 1000000 if loop <= -1 else self._duration
+        return ['sleep', str(duration), movie, str(loop), str(vol)]
+
+    def _spawn(self, args):
+        # sleep ignores all arguments after the duration, but is given them by
+        # sh so they show up in the process list.
+        process = player_process.spawn(['sh', '-c', 'sleep "$1"; exec sleep "$2"', 'fake_player',
+                                        str(self._load_time)] + args[1:])
+        self._first_frame = time.monotonic() + self._load_time
+        return process
+
+    def _spawn_standby(self, args):
+        # A prepared player stops itself once it is loaded.
+        return player_process.spawn(['sh', '-c', 'sleep "$1"; kill -STOP $$; exec sleep "$2"', 'fake_player',
+                                     str(self._load_time)] + args[1:])
+
+    def _hold(self, process, cancel):
+        try:
+            info = os.waitid(os.P_PID, process.pid, os.WSTOPPED | os.WEXITED | os.WNOWAIT)
+        except ChildProcessError:
+            return False
+        return info is not None and info.si_code == os.CLD_STOPPED and not cancel.is_set()
+
+    def _show(self, process):
+        player_process.signal_group(process, signal.SIGCONT)
+        self._first_frame = time.monotonic()
+
+    def play(self, movie, loop=0, vol=0):
+        """Pretend to play the provided movie."""
+        end_time = self._end_time
+        ended = end_time is not None and self._process is not None and not self.is_playing()
+        exit_time = self._exit_time
+        super().play(movie, loop, vol)
+        if ended:
+            self._switch_latencies.append(max(0.0, self._first_frame - end_time))
+        # The gap isn't known for a real player that was started from
+        # scratch, but it is for this one.
+        self._transition_gap = self._first_frame - exit_time if exit_time is not None else None
+        self._end_time = self._first_frame + float(self._build_args(movie, loop, vol)[1])
+        self._played.append(movie)
+        self._start_times.append(self._first_frame)
+
+    def stop(self, block_timeout_sec=0):
+        """Stop the fake player."""
+        super().stop(block_timeout_sec)
+        # A stopped movie didn't end by itself, there is no switch to measure.
+        self._end_time = None
+        self._paused_at = None
+
+    def pause(self):
+        """Pause the fake player, the end of the movie moves by the time it
+        is paused.
+        """
+        if self._process is not None and self._process.poll() is None and self._paused_at is None:
+            player_process.signal_group(self._process, signal.SIGSTOP)
+            self._paused_at = time.monotonic()
+
+    def resume(self):
+        """Resume the fake player after pause."""
+        if self._paused_at is not None:
+            if self._end_time is not None:
+                self._end_time += time.monotonic() - self._paused_at
+            self._paused_at = None
+            if self._process is not None:
+                player_process.signal_group(self._process, signal.SIGCONT)
+
+    def switch_latencies(self):
+        """Return the list of seconds from the end of a movie until the first
+        frame of the next one.
+        """
+        return self._switch_latencies
+
+    def played(self):
+        """Return the list of movies played so far."""
+        return self._played
+
+    def start_times(self):
+        """Return the list of times (monotonic) the first frames of the
+        played movies showed.
+        """
+        return self._start_times
+
+    @staticmethod
+    def can_loop_count():
+        return False
+
+
+def create_player(config):
+    """Create new fake video player for benchmarks."""
+    return FakePlayer(config)
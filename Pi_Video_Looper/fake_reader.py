@@ -0,0 +1,98 @@
+# Copyright 2019 bitconnect
+# Author: Tobias Perschon
+# License: GNU GPLv2, see LICENSE.txt
+import errno
+import os
+import struct
+
+# Stand-in file reader for running the looper without a Raspberry Pi, used by
+# the benchmarks.  It fills a directory with the configured number of small
+# but valid MP4 files.  They are hard links to a few files, so even hundreds
+# of thousands of movies take almost no space.
+
+
+def mp4_box(kind, *children):
+    """Return a MP4 box of the provided type containing children."""
+    payload = b''.join(children)
+    return struct.pack('>I4s', 8 + len(payload), kind) + payload
+
+
+def write_mp4(filename, duration, width=1920, height=1080, truncate=False):
+    """Write a small MP4 file with a single H264 video track and the provided
+    duration (in seconds).  If truncate is true the end of the file is cut
+    off like in a broken copy.
+    """
+    mvhd = mp4_box(b'mvhd', struct.pack('>4xIIII', 0, 0, 1000, int(duration * 1000)), bytes(80))
+    tkhd = mp4_box(b'tkhd', bytes(76), struct.pack('>II', width << 16, height << 16))
+    hdlr = mp4_box(b'hdlr', bytes(8), b'vide', bytes(13))
+    stsd = mp4_box(b'stsd', struct.pack('>4xI', 1), mp4_box(b'avc1', bytes(78)))
+    moov = mp4_box(b'moov', mvhd, mp4_box(b'trak', tkhd, mp4_box(
+        b'mdia', hdlr, mp4_box(b'minf', mp4_box(b'stbl', stsd)))))
+    data = mp4_box(b'ftyp', b'isom', bytes(4)) + moov + mp4_box(b'mdat', bytes(4096))
+    with open(filename, 'wb') as f:
+        f.write(data[:-100] if truncate else data)
+
+
+def create_movies(path, count, duration=1.0):
+    """Make sure path contains exactly count movies named movie_000000.mp4 and
+    so on.
+    """
+    os.makedirs(path, exist_ok=True)
+    wanted = set('movie_{0:06d}.mp4'.format(i) for i in range(count))
+    existing = set(x for x in os.listdir(path) if x.startswith('movie_'))
+    for name in existing - wanted:
+        os.remove(os.path.join(path, name))
+    sources = 0
+    source = None
+    for name in sorted(wanted - existing):
+        while True:
+            if source is None:
+                # Filesystems limit the number of links of a file, start
+                # with a new file when the limit is reached.
+                source = os.path.join(path, '.source_{0}.mp4'.format(sources))
+                sources += 1
+                if not os.path.exists(source):
+                    write_mp4(source, duration)
+            try:
+                os.link(source, os.path.join(path, name))
+                break
+            except OSError as e:
+                if e.errno != errno.EMLINK:
+                    raise
+                source = None
+
+
+class FakeReader:
+
+    def __init__(self, config):
+        """Create an instance of a file reader that provides a directory with
+        a fixed number of generated movies.
+        """
+        self._load_config(config)
+        create_movies(self._path, self._files, self._duration)
+
+    def _load_config(self, config):
+        self._path = config.get('fake_reader', 'path', fallback='/tmp/video_looper_fake')
+        self._files = config.getint('fake_reader', 'files', fallback=10)
+        self._duration = config.getfloat('fake_reader', 'duration', fallback=1.0)
+
+    def search_paths(self):
+        """Return a list of paths to search for files."""
+        return [self._path]
+
+    def is_changed(self):
+        """The generated movies never change."""
+        return False
+
+    def wakeup_fds(self):
+        """There is nothing to wait for, the reader never changes."""
+        return []
+
+    def idle_message(self):
+        """Return a message to display when idle and no files are found."""
+        return 'No files found in {0}'.format(self._path)
+
+
+def create_file_reader(config, screen):
+    """Create new file reader for benchmarks."""
+    return FakeReader(config)
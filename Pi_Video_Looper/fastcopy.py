@@ -0,0 +1,101 @@
+# Copyright 2019 bitconnect
+# Author: Tobias Perschon
+# License: GNU GPLv2, see LICENSE.txt
+import errno
+import os
+import time
+
+# Chunk sizes used by the copy loop.  Chunks start small so the first progress
+# update comes quickly and grow while a single call takes less than
+# CHUNK_TARGET_SEC, so the number of calls stays small on fast devices.
+CHUNK_MIN = 1024 * 1024
+CHUNK_MAX = 64 * 1024 * 1024
+CHUNK_TARGET_SEC = 0.25
+# Buffer size of the read/write fallback.
+BUFFER_SIZE = 1024 * 1024
+
+# Errors that mean the kernel can't copy between these two files and the next
+# method has to be used.
+_UNSUPPORTED = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                errno.ENOTSUP, errno.EBADF)
+
+
+def _copy_file_range(infd, outfd, count):
+    return os.copy_file_range(infd, outfd, count)
+
+
+def _sendfile(infd, outfd, count):
+    return os.sendfile(outfd, infd, None, count)
+
+
+def _kernel_copy(func, infd, outfd, callback, copied):
+    """Copy with func until the end of the input.  Returns the total number of
+    bytes copied.  Raises OSError with one of the _UNSUPPORTED error numbers if
+    nothing could be copied with func.
+    """
+    chunk = CHUNK_MIN
+    while True:
+        start = time.monotonic()
+        n = func(infd, outfd, chunk)
+        if n == 0:
+            return copied
+        copied += n
+        if callback is not None:
+            callback(copied)
+        if chunk < CHUNK_MAX and time.monotonic() - start < CHUNK_TARGET_SEC:
+            chunk *= 2
+
+
+def _buffer_copy(fsrc, fdst, callback, copied, digest=None):
+    """Copy with a large reusable buffer, updating digest with the data if
+    provided.  Returns the total number of bytes copied.
+    """
+    buf = bytearray(BUFFER_SIZE)
+    view = memoryview(buf)
+    while True:
+        n = fsrc.readinto(buf)
+        if not n:
+            return copied
+        if digest is not None:
+            # hashlib releases the GIL for big updates, so a copy in a
+            # background thread doesn't hold up the main loop.
+            digest.update(view[:n])
+        fdst.write(view[:n])
+        copied += n
+        if callback is not None:
+            callback(copied)
+
+
+def copyfileobj(fsrc, fdst, callback=None, digest=None):
+    """Copy the content of the binary file object fsrc from its current
+    position to fdst at its current position.  The copy is done inside the
+    kernel with copy_file_range or sendfile where possible and falls back to
+    a read/write loop with a big buffer.  callback is called with the number
+    of bytes this call copied so far after every chunk.  If digest (a hashlib
+    object) is provided it is updated with the copied data in the same pass,
+    the data then has to pass through the process so the read/write loop is
+    used.  Returns the number of bytes copied.
+    """
+    fdst.flush()
+    if digest is not None:
+        return _buffer_copy(fsrc, fdst, callback, 0, digest)
+    infd = fsrc.fileno()
+    outfd = fdst.fileno()
+    # The files may not be at their start, like when resuming a copy.
+    in_start = fsrc.tell()
+    out_start = fdst.tell()
+    copied = 0
+    for func in (_copy_file_range, _sendfile):
+        if func is _copy_file_range and not hasattr(os, 'copy_file_range'):
+            continue
+        try:
+            return _kernel_copy(func, infd, outfd, callback, copied)
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED:
+                raise
+            # A method may fail on the first call only, continue where it
+            # stopped.
+            copied = os.lseek(infd, 0, os.SEEK_CUR) - in_start
+            fsrc.seek(in_start + copied)
+            fdst.seek(out_start + copied)
+    return _buffer_copy(fsrc, fdst, callback, copied)
@@ -0,0 +1,25 @@
+# Copyright 2019 bitconnect
+# Author: Tobias Perschon
+# License: GNU GPLv2, see LICENSE.txt
+
+# Display backend used when nothing needs the display (no on screen display,
+# background image or keyboard control).  It has the interface of OSDRenderer
+# in osd.py but does nothing, so pygame is never imported or initialized.
+
+
+class HeadlessRenderer:
+
+    def blank(self):
+        pass
+
+    def text(self, message, size):
+        return None
+
+    def draw(self, labels):
+        pass
+
+    def escape_pressed(self):
+        return False
+
+    def close(self):
+        pass
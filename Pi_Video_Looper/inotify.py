@@ -0,0 +1,81 @@
+# Copyright 2019 bitconnect
+# Author: Tobias Perschon
+# License: GNU GPLv2, see LICENSE.txt
+import ctypes
+import ctypes.util
+import os
+import struct
+
+# Event masks from <sys/inotify.h>.
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM  = 0x00000040
+IN_MOVED_TO    = 0x00000080
+IN_CREATE      = 0x00000100
+IN_DELETE      = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF   = 0x00000800
+IN_Q_OVERFLOW  = 0x00004000
+IN_IGNORED     = 0x00008000
+IN_ONLYDIR     = 0x01000000
+IN_ISDIR       = 0x40000000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC  = 0o2000000
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifyWatcher:
+    """Thin wrapper around the linux inotify api.  The kernel queues events on
+    a file descriptor which can be waited on with select, so nothing has to be
+    polled.
+    """
+
+    def __init__(self):
+        """Create a new inotify instance.  Raises OSError if inotify is not
+        available.
+        """
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                                 use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+
+    def add_watch(self, path, mask):
+        """Watch path for the events in mask and return the watch descriptor."""
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def fileno(self):
+        """Return the inotify file descriptor, it is readable when events are
+        queued.
+        """
+        return self._fd
+
+    def read_events(self):
+        """Return a list of (wd, mask, cookie, name) tuples for all queued
+        events.  Returns an empty list if nothing is queued.
+        """
+        events = []
+        while True:
+            try:
+                buf = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return events
+            offset = 0
+            while offset < len(buf):
+                wd, mask, cookie, length = _EVENT_HEADER.unpack_from(buf, offset)
+                offset += _EVENT_HEADER.size
+                name = buf[offset:offset + length].rstrip(b'\0')
+                offset += length
+                events.append((wd, mask, cookie, os.fsdecode(name)))
+
+    def close(self):
+        """Close the inotify file descriptor, which removes all watches."""
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
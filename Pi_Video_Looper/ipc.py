@@ -0,0 +1,171 @@
+# Copyright 2019 bitconnect
+# Author: Tobias Perschon
+# License: GNU GPLv2, see LICENSE.txt
+import collections
+import json
+import socket
+import threading
+import time
+
+# Client of the JSON IPC protocol of mpv (--input-ipc-server), used to control
+# a player process that keeps running from one movie to the next.  Every
+# message is one line of JSON on a UNIX domain socket.  Commands are sent as
+#
+#   {"command": ["loadfile", "/home/pi/video/ad.mp4", "replace"], "request_id": 7}
+#
+# and answered with {"request_id": 7, "error": "success", "data": ...}.  The
+# player also sends events at any time, like {"event": "end-file", "reason":
+# "eof", "playlist_entry_id": 3} when a movie ended.
+#
+# A thread reads everything the player sends, so a command only waits for its
+# own answer and events are collected until the main loop asks for them.  The
+# optional on_event callback is called from that thread when events arrive (or
+# the connection was closed), the players use it to wake up the main loop.
+
+# Seconds to wait for the answer to a command.
+COMMAND_TIMEOUT = 5.0
+# Seconds to wait for the socket of a player that was just started.
+CONNECT_TIMEOUT = 5.0
+CONNECT_INTERVAL = 0.02
+
+
+class IPCClient:
+
+    def __init__(self, path, on_event=None, timeout=COMMAND_TIMEOUT):
+        """Connect to the JSON IPC server listening on the UNIX domain socket
+        at path.  Raises OSError if it can't be reached.
+        """
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._socket.connect(path)
+        except OSError:
+            self._socket.close()
+            raise
+        self._on_event = on_event
+        self._timeout = timeout
+        self._condition = threading.Condition()
+        self._send_lock = threading.Lock()
+        # Answers by request_id that the commands didn't pick up yet.
+        self._answers = {}
+        self._events = collections.deque()
+        self._next_id = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        try:
+            with self._socket.makefile('rb') as reader:
+                for line in reader:
+                    try:
+                        message = json.loads(line.decode('utf-8'))
+                    except ValueError:
+                        continue
+                    if not isinstance(message, dict):
+                        continue
+                    if 'event' in message:
+                        with self._condition:
+                            self._events.append(message)
+                            self._condition.notify_all()
+                        if self._on_event is not None:
+                            self._on_event()
+                    elif 'request_id' in message:
+                        with self._condition:
+                            self._answers[message['request_id']] = message
+                            self._condition.notify_all()
+        except OSError:
+            pass
+        finally:
+            with self._condition:
+                self._closed = True
+                self._condition.notify_all()
+            if self._on_event is not None:
+                self._on_event()
+
+    def connected(self):
+        """Return false once the connection was closed."""
+        return not self._closed
+
+    def command(self, *args):
+        """Send a command and return the data of its answer.  Raises
+        ValueError if the player rejected the command and OSError if the
+        connection failed or no answer came in time.
+        """
+        return self.commands([args])[0]
+
+    def commands(self, commands):
+        """Send a list of commands (lists of arguments) at once and return the
+        list of the data of their answers, which takes one round trip instead
+        of one per command.  Raises like command for the first command that
+        failed.
+        """
+        with self._condition:
+            if self._closed:
+                raise ConnectionError('connection to the player closed')
+            ids = list(range(self._next_id + 1, self._next_id + 1 + len(commands)))
+            self._next_id += len(commands)
+        data = b''.join(json.dumps({'command': list(args), 'request_id': request_id}).encode('utf-8') + b'\n'
+                        for request_id, args in zip(ids, commands))
+        with self._send_lock:
+            self._socket.sendall(data)
+        with self._condition:
+            if not self._condition.wait_for(lambda: all(x in self._answers for x in ids) or self._closed,
+                                            self._timeout):
+                raise TimeoutError('no answer to {0}'.format(commands[-1][0]))
+            answers = [self._answers.pop(x, None) for x in ids]
+        results = []
+        for args, answer in zip(commands, answers):
+            if answer is None:
+                raise ConnectionError('connection to the player closed')
+            error = answer.get('error', 'success')
+            if error != 'success':
+                raise ValueError('{0}: {1}'.format(args[0], error))
+            results.append(answer.get('data'))
+        return results
+
+    def get_property(self, name):
+        """Return the value of a property of the player."""
+        return self.command('get_property', name)
+
+    def set_property(self, name, value):
+        """Set a property of the player."""
+        self.command('set_property', name, value)
+
+    def events(self):
+        """Return the list of events received since the last call."""
+        with self._condition:
+            events = list(self._events)
+            self._events.clear()
+        return events
+
+    def wait_events(self, timeout):
+        """Wait up to timeout seconds for events and return them like
+        events.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._events or self._closed, timeout)
+        return self.events()
+
+    def close(self):
+        """Close the connection and wait for the reader thread to end."""
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._thread.join()
+        self._socket.close()
+
+
+def connect(path, process=None, timeout=CONNECT_TIMEOUT, **kwargs):
+    """Connect to the IPC server of a player that was just started and may
+    not listen yet.  Tries until timeout seconds passed or process (if
+    provided) exited.  Raises OSError if it can't connect.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return IPCClient(path, **kwargs)
+        except (FileNotFoundError, ConnectionRefusedError):
+            if time.monotonic() >= deadline or (process is not None and process.poll() is not None):
+                raise
+        time.sleep(CONNECT_INTERVAL)
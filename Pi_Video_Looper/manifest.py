@@ -0,0 +1,126 @@
+# Copyright 2019 bitconnect
+# Author: Tobias Perschon
+# License: GNU GPLv2, see LICENSE.txt
+import hashlib
+import json
+import os
+
+# Name of the manifest file inside the target directory.  It starts with a dot
+# so it is never picked up as a movie.
+MANIFEST_NAME = '.video_looper_manifest.json'
+
+
+def update_digest(digest, f, buffer_size=1024 * 1024):
+    """Update digest with the rest of the content of the binary file object
+    f.
+    """
+    buf = bytearray(buffer_size)
+    view = memoryview(buf)
+    while True:
+        n = f.readinto(buf)
+        if not n:
+            return
+        digest.update(view[:n])
+
+
+def file_hash(path):
+    """Return the hex encoded sha256 digest of the content of a file."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        update_digest(digest, f)
+    return digest.hexdigest()
+
+
+def read_checksums(path):
+    """Read a checksum list in the format of sha256sum ("<digest>  <name>" or
+    "<digest> *<name>" per line) and return a dict of file name to hex
+    digest.  Lines that don't match the format are ignored.
+    """
+    checksums = {}
+    with open(path, 'r', errors='replace') as f:
+        for line in f:
+            digest, _, name = line.strip().partition(' ')
+            name = name.lstrip(' *')
+            if len(digest) == 64 and name and all(x in '0123456789abcdefABCDEF' for x in digest):
+                checksums[os.path.basename(name)] = digest.lower()
+    return checksums
+
+
+def temp_path(path):
+    """Return the hidden temporary file name used while copying to path."""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, '.{0}.part'.format(name))
+
+
+class CopyManifest:
+    """Record of the files copied into a directory.  Every entry is keyed by
+    file name and stores size and modification time of the source file (and
+    optionally its sha256 digest), so a later copy can skip files that didn't
+    change.  Entries of copies that were interrupted are marked as partial
+    so they can be resumed.
+    """
+
+    def __init__(self, directory):
+        """Load the manifest of the provided directory.  A missing or broken
+        manifest file results in an empty manifest.
+        """
+        self._path = os.path.join(directory, MANIFEST_NAME)
+        self._entries = {}
+        try:
+            with open(self._path, 'r') as f:
+                self._entries = json.load(f).get('files', {})
+        except (OSError, ValueError, AttributeError):
+            self._entries = {}
+
+    def get(self, name):
+        """Return the entry for a file name or None."""
+        return self._entries.get(name)
+
+    def names(self):
+        """Return the names of all files in the manifest."""
+        return list(self._entries)
+
+    def matches(self, name, st):
+        """Return true if the finished entry for name was copied from a source
+        with the size and modification time of the provided stat result.
+        """
+        entry = self._entries.get(name)
+        return entry is not None and not entry.get('partial', False) \
+            and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns
+
+    def can_resume(self, name, st):
+        """Return true if there is an interrupted copy of name from a source
+        with the size and modification time of the provided stat result.
+        """
+        entry = self._entries.get(name)
+        return entry is not None and entry.get('partial', False) \
+            and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns
+
+    def set_partial(self, name, st):
+        """Record that copying name from a source with the provided stat result
+        has started.
+        """
+        self._entries[name] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+                               'partial': True}
+
+    def set_done(self, name, st, digest=None):
+        """Record that name was completely copied from a source with the
+        provided stat result and optional sha256 digest.
+        """
+        entry = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+        if digest is not None:
+            entry['sha256'] = digest
+        self._entries[name] = entry
+
+    def remove(self, name):
+        """Remove the entry for name if there is one."""
+        self._entries.pop(name, None)
+
+    def save(self):
+        """Write the manifest, replacing the old file atomically."""
+        tmp = temp_path(self._path)
+        with open(tmp, 'w') as f:
+            json.dump({'files': self._entries}, f, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path)
@@ -0,0 +1,473 @@
+# Copyright 2019 bitconnect
+# Author: Tobias Perschon
+# License: GNU GPLv2, see LICENSE.txt
+import io
+import json
+import os
+import shutil
+import struct
+import subprocess
+
+from .manifest import temp_path
+
+# Metadata of movie files (duration, resolution, codec and whether the file can
+# be parsed at all) read from the container headers.  MP4/MOV, Matroska/WebM
+# and raw H264 streams are recognized by a small parser, other formats can
+# optionally be probed with ffprobe.  The results are kept in a persistent
+# index keyed by path, size and modification time so a file is only read once.
+
+# Version of the index file format, an index with another version is ignored.
+INDEX_VERSION = 1
+# Header boxes or elements bigger than this are not read into memory.
+MAX_HEADER_SIZE = 64 * 1024 * 1024
+# Seconds to wait for ffprobe.
+PROBE_TIMEOUT = 10
+
+# Types of boxes that can appear at the top level of a MP4/MOV file.
+_MP4_TOP_LEVEL = (b'ftyp', b'moov', b'mdat', b'free', b'skip', b'wide', b'pnot', b'uuid')
+_EBML_MAGIC = b'\x1a\x45\xdf\xa3'
+
+# Matroska element ids.
+_MKV_DOCTYPE = 0x4282
+_MKV_SEGMENT = 0x18538067
+_MKV_INFO = 0x1549A966
+_MKV_TIMECODE_SCALE = 0x2AD7B1
+_MKV_DURATION = 0x4489
+_MKV_TRACKS = 0x1654AE6B
+_MKV_TRACK_ENTRY = 0xAE
+_MKV_TRACK_TYPE = 0x83
+_MKV_CODEC_ID = 0x86
+_MKV_VIDEO = 0xE0
+_MKV_PIXEL_WIDTH = 0xB0
+_MKV_PIXEL_HEIGHT = 0xBA
+_MKV_CLUSTER = 0x1F43B675
+
+# Codec names as used by ffprobe for the codec identifiers of the containers.
+_CODEC_NAMES = {
+    'avc1': 'h264', 'avc3': 'h264', 'V_MPEG4/ISO/AVC': 'h264',
+    'hvc1': 'hevc', 'hev1': 'hevc', 'V_MPEGH/ISO/HEVC': 'hevc',
+    'mp4v': 'mpeg4', 'V_MPEG4/ISO/SP': 'mpeg4', 'V_MPEG4/ISO/ASP': 'mpeg4',
+    'V_MPEG2': 'mpeg2video', 'V_MPEG1': 'mpeg1video',
+    'V_VP8': 'vp8', 'V_VP9': 'vp9', 'vp09': 'vp9', 'av01': 'av1', 'V_AV1': 'av1',
+    'V_MJPEG': 'mjpeg', 'jpeg': 'mjpeg',
+}
+
+
+class MediaInfo:
+    """Metadata of a movie file.  Valid is true if the container could be
+    parsed, false if the file is broken and None if the format is unknown.
+    Duration is in seconds, any value that couldn't be determined is None.
+    """
+
+    FIELDS = ('container', 'valid', 'duration', 'width', 'height', 'codec', 'error')
+
+    def __init__(self, container=None, valid=None, duration=None, width=None,
+                 height=None, codec=None, error=None):
+        self.container = container
+        self.valid = valid
+        self.duration = duration
+        self.width = width
+        self.height = height
+        self.codec = codec
+        self.error = error
+
+    def to_dict(self):
+        """Return the values that are set as dict."""
+        return dict((x, getattr(self, x)) for x in self.FIELDS if getattr(self, x) is not None)
+
+    @classmethod
+    def from_dict(cls, values):
+        """Create an instance from a dict returned by to_dict."""
+        return cls(**dict((x, values.get(x)) for x in cls.FIELDS))
+
+    def __repr__(self):
+        return 'MediaInfo({0})'.format(', '.join('{0}={1!r}'.format(x, y)
+                                                 for x, y in self.to_dict().items()))
+
+
+def _codec_name(code):
+    return _CODEC_NAMES.get(code, code.lower())
+
+
+def _mp4_boxes(data, offset, end):
+    """Yield type, payload start and end of the boxes in data[offset:end]."""
+    while offset + 8 <= end:
+        size, kind = struct.unpack_from('>I4s', data, offset)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from('>Q', data, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        if size < header or offset + size > end:
+            raise ValueError('invalid size of {0} box'.format(kind.decode('latin-1')))
+        yield kind, offset + header, offset + size
+        offset += size
+
+
+def _mp4_find(data, start, end, path):
+    """Return payload start and end of the first box at path (a list of box
+    types) below data[start:end], or None.
+    """
+    for kind, box_start, box_end in _mp4_boxes(data, start, end):
+        if kind == path[0]:
+            if len(path) == 1:
+                return box_start, box_end
+            return _mp4_find(data, box_start, box_end, path[1:])
+    return None
+
+
+def _parse_mp4_track(data, start, end, info):
+    """Take resolution and codec from the first video track."""
+    hdlr = _mp4_find(data, start, end, [b'mdia', b'hdlr'])
+    if info.codec is not None or hdlr is None or data[hdlr[0] + 8:hdlr[0] + 12] != b'vide':
+        return
+    tkhd = _mp4_find(data, start, end, [b'tkhd'])
+    if tkhd is not None:
+        # Width and height are 16.16 fixed point values at the end of tkhd.
+        width, height = struct.unpack_from('>II', data, tkhd[1] - 8)
+        info.width = width >> 16
+        info.height = height >> 16
+    stsd = _mp4_find(data, start, end, [b'mdia', b'minf', b'stbl', b'stsd'])
+    if stsd is not None and stsd[1] - stsd[0] >= 16:
+        # The format of the first sample description is the codec.
+        info.codec = _codec_name(data[stsd[0] + 12:stsd[0] + 16].decode('latin-1'))
+
+
+def _parse_mp4(f, file_size):
+    """Parse a MP4/MOV file.  Raises ValueError if the file is broken, which
+    is when the moov or mdat box is missing or cut short.  Bytes after the
+    last box that don't form a complete box are ignored, players do too.
+    """
+    info = MediaInfo(container='mp4', valid=True)
+    moov = None
+    has_moov = False
+    has_mdat = False
+    offset = 0
+    while offset < file_size:
+        f.seek(offset)
+        header = f.read(16)
+        if len(header) < 8:
+            # Trailing bytes.
+            break
+        size, kind = struct.unpack_from('>I4s', header)
+        header_size = 8
+        if size == 1:
+            if len(header) < 16:
+                break
+            size = struct.unpack_from('>Q', header, 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = file_size - offset
+        if size < header_size or offset + size > file_size:
+            if kind in (b'moov', b'mdat'):
+                raise ValueError('{0} box is {1}'.format(kind.decode('latin-1'),
+                                                         'truncated' if size >= header_size else 'invalid'))
+            # Trailing bytes or a cut off box that isn't needed to play.
+            break
+        if kind == b'moov':
+            has_moov = True
+            # A moov box this big is fine but not read into memory, the
+            # details stay unknown.
+            if size <= MAX_HEADER_SIZE:
+                f.seek(offset + header_size)
+                moov = f.read(size - header_size)
+        elif kind == b'mdat':
+            has_mdat = True
+        offset += size
+    if not has_moov:
+        raise ValueError('no moov box')
+    if not has_mdat:
+        raise ValueError('no mdat box')
+    if moov is None:
+        return info
+    tracks = 0
+    for kind, start, end in _mp4_boxes(moov, 0, len(moov)):
+        if kind == b'mvhd':
+            if moov[start] == 1:
+                timescale, duration = struct.unpack_from('>IQ', moov, start + 20)
+                unknown = 0xFFFFFFFFFFFFFFFF
+            else:
+                timescale, duration = struct.unpack_from('>II', moov, start + 12)
+                unknown = 0xFFFFFFFF
+            if timescale > 0 and duration != unknown:
+                info.duration = duration / timescale
+        elif kind == b'trak':
+            tracks += 1
+            _parse_mp4_track(moov, start, end, info)
+    if tracks == 0:
+        raise ValueError('no tracks')
+    return info
+
+
+def _ebml_number(f, keep_marker):
+    """Read a variable length EBML number.  Element ids keep their length
+    marker, sizes don't.  Returns the value and whether all value bits are set
+    (an unknown size).
+    """
+    first = f.read(1)
+    if not first:
+        raise ValueError('truncated element')
+    value = first[0]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not value & mask:
+        mask >>= 1
+        length += 1
+    if length > 8:
+        raise ValueError('invalid element number')
+    if not keep_marker:
+        value &= mask - 1
+    rest = f.read(length - 1)
+    if len(rest) < length - 1:
+        raise ValueError('truncated element')
+    for x in rest:
+        value = (value << 8) | x
+    return value, not keep_marker and value == (1 << (7 * length)) - 1
+
+
+def _ebml_elements(f, end):
+    """Yield id, size and data start of the elements up to end.  The caller
+    reads the data, the next element is found from the returned size.  A size
+    of None means the size is unknown and ends the iteration.
+    """
+    offset = f.tell()
+    while offset < end:
+        f.seek(offset)
+        element_id, _ = _ebml_number(f, True)
+        size, unknown = _ebml_number(f, False)
+        start = f.tell()
+        if unknown:
+            yield element_id, None, start
+            return
+        if start + size > end:
+            raise ValueError('file is truncated')
+        yield element_id, size, start
+        offset = start + size
+
+
+def _ebml_read(f, size):
+    if size > MAX_HEADER_SIZE:
+        raise ValueError('element too large')
+    return f.read(size)
+
+
+def _ebml_uint(data):
+    return int.from_bytes(data, 'big')
+
+
+def _parse_mkv_tracks(data, info):
+    tracks = 0
+    f = io.BytesIO(data)
+    for element_id, size, start in _ebml_elements(f, len(data)):
+        if element_id != _MKV_TRACK_ENTRY or size is None:
+            continue
+        tracks += 1
+        entry = {}
+        video = {}
+        for child_id, child_size, child_start in _ebml_elements(f, start + size):
+            if child_size is None:
+                break
+            if child_id == _MKV_VIDEO:
+                for video_id, video_size, _ in _ebml_elements(f, child_start + child_size):
+                    if video_size is None:
+                        break
+                    video[video_id] = f.read(video_size)
+            else:
+                entry[child_id] = f.read(child_size)
+        if info.codec is None and _ebml_uint(entry.get(_MKV_TRACK_TYPE, b'')) == 1:
+            codec = entry.get(_MKV_CODEC_ID, b'').rstrip(b'\0').decode('ascii', 'replace')
+            info.codec = _codec_name(codec) if codec else None
+            if _MKV_PIXEL_WIDTH in video and _MKV_PIXEL_HEIGHT in video:
+                info.width = _ebml_uint(video[_MKV_PIXEL_WIDTH])
+                info.height = _ebml_uint(video[_MKV_PIXEL_HEIGHT])
+        f.seek(start + size)
+    return tracks
+
+
+def _parse_mkv(f, file_size):
+    """Parse a Matroska/WebM file.  Raises ValueError if the file is broken."""
+    info = MediaInfo(container='matroska', valid=True)
+    elements = _ebml_elements(f, file_size)
+    element_id, size, start = next(elements)
+    if size is None:
+        raise ValueError('invalid EBML header')
+    header = io.BytesIO(_ebml_read(f, size))
+    for child_id, child_size, _ in _ebml_elements(header, size):
+        if child_size is None:
+            break
+        if child_id == _MKV_DOCTYPE:
+            info.container = header.read(child_size).rstrip(b'\0').decode('ascii', 'replace')
+    if info.container not in ('matroska', 'webm'):
+        raise ValueError('unsupported document type {0}'.format(info.container))
+    element_id, size, start = next(elements, (None, None, None))
+    if element_id != _MKV_SEGMENT:
+        raise ValueError('no segment')
+    segment_end = file_size if size is None else start + size
+    f.seek(start)
+    timecode_scale = 1000000
+    duration = None
+    tracks = 0
+    for element_id, size, start in _ebml_elements(f, segment_end):
+        # Everything needed is in front of the first cluster.
+        if element_id == _MKV_CLUSTER or size is None:
+            break
+        if element_id == _MKV_INFO:
+            data = _ebml_read(f, size)
+            segment_info = io.BytesIO(data)
+            for child_id, child_size, _ in _ebml_elements(segment_info, size):
+                if child_size is None:
+                    break
+                value = segment_info.read(child_size)
+                if child_id == _MKV_TIMECODE_SCALE:
+                    timecode_scale = _ebml_uint(value)
+                elif child_id == _MKV_DURATION and child_size in (4, 8):
+                    duration = struct.unpack('>f' if child_size == 4 else '>d', value)[0]
+        elif element_id == _MKV_TRACKS:
+            tracks += _parse_mkv_tracks(_ebml_read(f, size), info)
+    if tracks == 0:
+        raise ValueError('no tracks')
+    if duration is not None:
+        info.duration = duration * timecode_scale / 1e9
+    return info
+
+
+def _probe(filename):
+    """Return a MediaInfo with the values ffprobe reports for a file, or None
+    if ffprobe isn't available.
+    """
+    try:
+        output = subprocess.check_output(['ffprobe', '-v', 'error', '-print_format', 'json',
+                                          '-show_format', '-show_streams', filename],
+                                         stderr=subprocess.DEVNULL, timeout=PROBE_TIMEOUT)
+        data = json.loads(output.decode('utf-8', 'replace'))
+    except subprocess.CalledProcessError:
+        return MediaInfo(valid=False, error='ffprobe failed')
+    except (OSError, subprocess.TimeoutExpired, ValueError):
+        return None
+    fmt = data.get('format', {})
+    info = MediaInfo(container=fmt.get('format_name'), valid=True)
+    try:
+        info.duration = float(fmt['duration'])
+    except (KeyError, ValueError):
+        pass
+    streams = data.get('streams', [])
+    if not streams:
+        info.valid = False
+        info.error = 'no streams'
+    for stream in streams:
+        if stream.get('codec_type') == 'video':
+            info.codec = stream.get('codec_name')
+            info.width = stream.get('width')
+            info.height = stream.get('height')
+            break
+    return info
+
+
+def read_info(filename, probe=False):
+    """Read the metadata of a movie file.  Formats the parser doesn't know are
+    probed with ffprobe if probe is true (and ffprobe is installed).  Returns
+    None if the file couldn't be read.
+    """
+    try:
+        with open(filename, 'rb') as f:
+            file_size = os.fstat(f.fileno()).st_size
+            if file_size == 0:
+                return MediaInfo(valid=False, error='empty file')
+            head = f.read(12)
+            f.seek(0)
+            if head.startswith(_EBML_MAGIC):
+                parser = _parse_mkv
+            elif head[4:8] in _MP4_TOP_LEVEL:
+                parser = _parse_mp4
+            elif head.startswith(b'\x00\x00\x00\x01') or head.startswith(b'\x00\x00\x01'):
+                # A raw H264 stream (as played by hello_video) has no header.
+                return MediaInfo(container='h264', valid=True, codec='h264')
+            else:
+                parser = None
+            if parser is not None:
+                try:
+                    return parser(f, file_size)
+                except (ValueError, struct.error, IndexError) as e:
+                    return MediaInfo(valid=False, error=str(e) or 'invalid header')
+    except OSError:
+        return None
+    if probe:
+        info = _probe(filename)
+        if info is not None:
+            return info
+    return MediaInfo()
+
+
+class MetadataIndex:
+    """Persistent index of the metadata of movie files.  Entries are keyed by
+    path and are only used while size and modification time of the file match,
+    so only new or changed files are read.
+    """
+
+    def __init__(self, path=None, probe=False):
+        """Load the index from path.  Without a path the index is only kept in
+        memory.  If probe is true formats the parser doesn't know are probed
+        with ffprobe.
+        """
+        self._path = path
+        self._probe = probe and shutil.which('ffprobe') is not None
+        self._entries = {}
+        self._dirty = False
+        if path:
+            try:
+                with open(path, 'r') as f:
+                    data = json.load(f)
+                if data.get('version') == INDEX_VERSION:
+                    self._entries = data.get('files', {})
+            except (OSError, ValueError, AttributeError):
+                self._entries = {}
+
+    def get(self, filename):
+        """Return the MediaInfo of a file, reading it if the index has no
+        current entry.  Returns None if the file couldn't be read.
+        """
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        entry = self._entries.get(filename)
+        if entry is not None and entry.get('size') == st.st_size \
+                and entry.get('mtime_ns') == st.st_mtime_ns:
+            return MediaInfo.from_dict(entry)
+        info = read_info(filename, self._probe)
+        if info is not None:
+            entry = info.to_dict()
+            entry['size'] = st.st_size
+            entry['mtime_ns'] = st.st_mtime_ns
+            self._entries[filename] = entry
+            self._dirty = True
+        return info
+
+    def prune(self, paths, filenames):
+        """Drop the entries of files in the provided directories that are not
+        in filenames anymore.  Entries of other directories (like a USB drive
+        that isn't attached right now) are kept.
+        """
+        directories = set(x.rstrip('/') for x in paths)
+        filenames = set(filenames)
+        for filename in list(self._entries):
+            if os.path.dirname(filename) in directories and filename not in filenames:
+                del self._entries[filename]
+                self._dirty = True
+
+    def save(self):
+        """Write the index if it changed.  The index is only a cache, errors
+        (like a read-only filesystem) are ignored.
+        """
+        if not self._path or not self._dirty:
+            return
+        tmp = temp_path(self._path)
+        try:
+            os.makedirs(os.path.dirname(self._path) or '.', exist_ok=True)
+            with open(tmp, 'w') as f:
+                json.dump({'version': INDEX_VERSION, 'files': self._entries}, f, sort_keys=True)
+            os.replace(tmp, self._path)
+            self._dirty = False
+        except OSError:
+            pass
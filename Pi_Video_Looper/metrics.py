@@ -0,0 +1,309 @@
+# Copyright 2019 bitconnect
+# Author: Tobias Perschon
+# License: GNU GPLv2, see LICENSE.txt
+import bisect
+import os
+import threading
+import time
+
+# Counters and histograms of what the video looper does, for monitoring many
+# players.  The metrics are module level objects the looper, players and file
+# readers record to directly, recording is a dict or list update and never
+# blocks.  They can be exported in the Prometheus text format by a small HTTP
+# server listening on localhost and/or a stats file that is rewritten
+# periodically (for node_exporter's textfile collector or a cron job), see the
+# [metrics] section of the ini file.
+
+# Upper bounds (in seconds) of the histogram buckets for latencies.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Upper bounds (in seconds) of the histogram buckets for playlist builds.
+BUILD_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0)
+# Maximum number of label values of a metric.  Further values are counted as
+# "other" so a stick with thousands of broken files can't use up the memory.
+MAX_LABEL_VALUES = 500
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+
+class Counter:
+    """Value that only goes up, optionally split by the value of one label.
+    Like for a Gauge a function can provide the value of a counter without a
+    label.
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name, help, label=None, function=None):
+        self.name = name
+        self.help = help
+        self.label = label
+        self._function = function
+        self._values = {} if label is not None else {None: 0}
+
+    def inc(self, amount=1, label_value=None):
+        values = self._values
+        if label_value in values:
+            values[label_value] += amount
+        elif len(values) < MAX_LABEL_VALUES:
+            values[label_value] = amount
+        else:
+            values['other'] = values.get('other', 0) + amount
+
+    def value(self, label_value=None):
+        if self._function is not None:
+            return self._function()
+        return self._values.get(label_value, 0)
+
+    def samples(self):
+        """Yield (name, labels, value) of every sample of the metric."""
+        if self._function is not None:
+            yield self.name, {}, self._function()
+            return
+        for label_value, value in list(self._values.items()):
+            labels = {} if label_value is None else {self.label: label_value}
+            yield self.name, labels, value
+
+
+class Gauge:
+    """Value that can go up and down.  If a function is provided it is called
+    to get the value when the metrics are exported, so recording costs
+    nothing.  The function can return None if the value is unknown.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, help, function=None):
+        self.name = name
+        self.help = help
+        self._function = function
+        self._value = 0
+
+    def set(self, value):
+        self._value = value
+
+    def value(self):
+        return self._function() if self._function is not None else self._value
+
+    def samples(self):
+        value = self.value()
+        if value is not None:
+            yield self.name, {}, value
+
+
+class Histogram:
+    """Distribution of observed values in buckets with fixed upper bounds."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self._buckets = tuple(sorted(buckets))
+        # Count of every bucket plus one for values above the last bound.
+        self._counts = [0] * (len(self._buckets) + 1)
+        self._sum = 0.0
+
+    def observe(self, value):
+        self._counts[bisect.bisect_left(self._buckets, value)] += 1
+        self._sum += value
+
+    def count(self):
+        return sum(self._counts)
+
+    def samples(self):
+        counts = list(self._counts)
+        total = 0
+        for bound, count in zip(self._buckets + (float('inf'),), counts):
+            total += count
+            yield self.name + '_bucket', {'le': _format(float(bound))}, total
+        yield self.name + '_sum', {}, self._sum
+        yield self.name + '_count', {}, total
+
+
+class Registry:
+    """Collection of metrics that are exported together."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Return all metrics in the Prometheus text format."""
+        lines = []
+        for metric in self._metrics:
+            lines.append('# HELP {0} {1}'.format(metric.name, metric.help))
+            lines.append('# TYPE {0} {1}'.format(metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                if labels:
+                    name += '{' + ','.join('{0}="{1}"'.format(k, _escape(v))
+                                           for k, v in labels.items()) + '}'
+                lines.append('{0} {1}'.format(name, _format(value)))
+        return '\n'.join(lines) + '\n'
+
+
+def _resident_memory():
+    """Return the resident memory of the process in bytes, or None if it
+    can't be read.
+    """
+    try:
+        with open('/proc/self/statm', 'rb') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+_start_time = time.time()
+
+REGISTRY = Registry()
+
+PLAYER_SPAWN = REGISTRY.register(Histogram(
+    'video_looper_player_spawn_seconds', 'Time it took to start a player process.'))
+PLAYER_STOP = REGISTRY.register(Histogram(
+    'video_looper_player_stop_seconds', 'Time it took a stopped player process to exit.'))
+TRANSITION_GAP = REGISTRY.register(Histogram(
+    'video_looper_transition_gap_seconds', 'Time between the end of a movie and the first frame of the prepared next one (gapless playback).'))
+SYNC_SKEW = REGISTRY.register(Histogram(
+    'video_looper_sync_skew_seconds', 'Difference between the planned and the actual start of synchronized movies.'))
+SYNC_DELAY = REGISTRY.register(Gauge(
+    'video_looper_sync_round_trip_seconds', 'Round trip delay to the sync leader the clock offset is estimated with.'))
+PLAYER_CRASHES = REGISTRY.register(Counter(
+    'video_looper_player_crashes_total', 'Number of times a player exited with an error, by movie.', 'file'))
+MOVIES_PLAYED = REGISTRY.register(Counter(
+    'video_looper_movies_played_total', 'Number of movies started.'))
+PLAYLIST_BUILD = REGISTRY.register(Histogram(
+    'video_looper_playlist_build_seconds', 'Time it took to build the playlist.', BUILD_BUCKETS))
+PLAYLIST_MOVIES = REGISTRY.register(Gauge(
+    'video_looper_playlist_movies', 'Number of movies in the playlist.'))
+COPY_BYTES = REGISTRY.register(Counter(
+    'video_looper_copy_bytes_total', 'Bytes copied from USB drives.'))
+COPY_SECONDS = REGISTRY.register(Counter(
+    'video_looper_copy_seconds_total', 'Time spent copying from USB drives.'))
+COPY_FILES = REGISTRY.register(Counter(
+    'video_looper_copy_files_total', 'Number of files copied from USB drives.'))
+COPY_QUARANTINED = REGISTRY.register(Counter(
+    'video_looper_copy_quarantined_total', 'Number of copied files that failed verification.'))
+PREFETCH_BYTES = REGISTRY.register(Counter(
+    'video_looper_prefetch_bytes_total', 'Bytes of upcoming movies requested to be loaded into the page cache.'))
+LOOP_WAKEUPS = REGISTRY.register(Counter(
+    'video_looper_loop_wakeups_total', 'Number of times the main loop woke up.'))
+RESIDENT_MEMORY = REGISTRY.register(Gauge(
+    'video_looper_resident_memory_bytes', 'Resident memory of the video looper.', _resident_memory))
+CPU_SECONDS = REGISTRY.register(Counter(
+    'video_looper_cpu_seconds_total', 'Cpu time used by the video looper.', function=time.process_time))
+START_TIME = REGISTRY.register(Gauge(
+    'video_looper_start_time_seconds', 'Time the video looper was started (unix time).', lambda: _start_time))
+
+
+def _handler_class():
+    """Return the request handler of the HTTP server.  http.server is only
+    imported when the server is enabled, it takes a while to import.
+    """
+    from http.server import BaseHTTPRequestHandler
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = self.server.registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class MetricsServer:
+    """HTTP server exporting the metrics in a background thread."""
+
+    def __init__(self, address, port, registry=REGISTRY):
+        from http.server import HTTPServer
+        self._server = HTTPServer((address, port), _handler_class())
+        self._server.registry = registry
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def port(self):
+        return self._server.server_address[1]
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class StatsFileWriter:
+    """Rewrites a file with the metrics every interval seconds in a background
+    thread.  The file is replaced atomically so readers never see a partially
+    written file.
+    """
+
+    def __init__(self, path, interval, registry=REGISTRY):
+        self._path = path
+        self._interval = interval
+        self._registry = registry
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self):
+        tmp = '{0}.tmp'.format(self._path)
+        with open(tmp, 'w') as f:
+            f.write(self._registry.render())
+        os.replace(tmp, self._path)
+
+    def _run(self):
+        while True:
+            try:
+                self.write()
+            except OSError:
+                pass
+            if self._stopped.wait(self._interval):
+                return
+
+    def close(self):
+        self._stopped.set()
+        self._thread.join()
+        try:
+            self.write()
+        except OSError:
+            pass
+
+
+def start_exporters(config, log=print):
+    """Start the exporters enabled in the [metrics] section of the config and
+    return them as a list.  If the HTTP port can't be used the error is
+    passed to log and the other exporters are started anyway.
+    """
+    exporters = []
+    port = config.getint('metrics', 'http_port', fallback=0)
+    if port > 0:
+        address = config.get('metrics', 'http_address', fallback='127.0.0.1')
+        try:
+            exporters.append(MetricsServer(address, port))
+        except OSError as e:
+            log('Failed to start metrics server on {0}:{1}: {2}'.format(address, port, e))
+    path = config.get('metrics', 'stats_file', fallback='')
+    if path:
+        exporters.append(StatsFileWriter(path, config.getfloat('metrics', 'stats_interval', fallback=15.0)))
+    return exporters
@@ -1,16 +1,28 @@
 # Copyright 2019 bitconnect
 # Author: Tobias Perschon
 # License: GNU GPLv2, see LICENSE.txt
+import bisect
 import random
+from array import array
+
+from .picker import UniformPicker
 
 class Movie:
     """Representation of a movie"""
 
-    def __init__(self, filename: str, repeats: int = 1):
-        """Create a playlist from the provided list of movies."""
+    # Playlists can have a lot of movies, slots keep every instance small.
+    __slots__ = ('filename', 'repeats', 'volume', 'playcount', 'info')
+
+    def __init__(self, filename: str, repeats: int = 1, volume: int = None):
+        """Create a movie.  Volume is the volume to play it with (in
+        millibels) or None to use the volume of its directory.
+        """
         self.filename = filename
         self.repeats = int(repeats)
+        self.volume = volume
         self.playcount = 0
+        # MediaInfo from the metadata index, None until it was looked up.
+        self.info = None
 
     def was_played(self):
         if self.repeats > 1:
@@ -39,9 +51,30 @@ class Playlist:
 
     def __init__(self, movies, is_random):
         """Create a playlist from the provided list of movies."""
+        # All movies and the movies that are played (a subset of them while a
+        # filter is set).
+        self._all = movies
         self._movies = movies
+        self._filter = None
         self._index = None
         self._is_random = is_random
+        # Picks the movies in random order, the default picks every movie with
+        # the same probability.
+        self._picker = UniformPicker(random.Random()) if is_random else None
+        # Incremented whenever the played movies change.
+        self._version = 0
+
+    def set_picker(self, picker):
+        """Set the picker used to pick movies in random order."""
+        self._picker = picker
+
+    def version(self):
+        """Return a number that changes whenever the played movies change."""
+        return self._version
+
+    def movies(self):
+        """Return the list of movies that are played."""
+        return self._movies
 
     def get_next(self) -> Movie:
         """Get the next movie in the playlist. Will loop to start of playlist
@@ -52,7 +85,7 @@ class Playlist:
             return None
         # Start Random movie
         if self._is_random:
-            self._index = random.randrange(0, self.length())
+            return self._picker.pick(self)
         else:
             # Start at the first movie and increment through them in order.
             if self._index is None:
@@ -63,8 +96,309 @@ class Playlist:
             if self._index >= self.length():
                 self._index = 0
 
-        return self._movies[self._index]
+        return self._entry(self._index)
+
+    def _entry(self, i):
+        return self._movies[i]
+
+    def add(self, movie):
+        """Insert a movie into the sorted playlist without changing which
+        movie is played next.  Movies that are already in the playlist are
+        ignored.
+        """
+        i = bisect.bisect_left(self._all, movie)
+        if i < len(self._all) and self._all[i] == movie:
+            return
+        self._all.insert(i, movie)
+        self._version += 1
+        if self._movies is not self._all:
+            if not self._filter(movie):
+                return
+            i = bisect.bisect_left(self._movies, movie)
+            self._movies.insert(i, movie)
+        if self._index is not None and i <= self._index:
+            self._index += 1
+
+    def remove(self, filename):
+        """Remove the movie with the provided file name from the sorted
+        playlist without changing which movie is played next.
+        """
+        i = bisect.bisect_left(self._all, Movie(filename))
+        if i == len(self._all) or self._all[i].filename != filename:
+            return
+        del self._all[i]
+        self._version += 1
+        if self._movies is not self._all:
+            i = bisect.bisect_left(self._movies, Movie(filename))
+            if i == len(self._movies) or self._movies[i].filename != filename:
+                return
+            del self._movies[i]
+        # If the current movie was removed step back so that get_next returns
+        # the movie that followed it.
+        if self._index is not None and i <= self._index:
+            self._index -= 1
+
+    def set_filter(self, predicate):
+        """Only play the movies for which predicate returns true, or all movies
+        if predicate is None.  Playback continues with the first played movie
+        following the current one.
+        """
+        current = None
+        if self._index is not None and 0 <= self._index < len(self._movies):
+            current = self._movies[self._index]
+        self._filter = predicate
+        self._version += 1
+        if predicate is None:
+            self._movies = self._all
+        else:
+            self._movies = [x for x in self._all if predicate(x)]
+        if current is not None:
+            i = bisect.bisect_left(self._movies, current)
+            if i == len(self._movies) or self._movies[i] != current:
+                # Step back so get_next returns the movie after the position
+                # the current one would have.
+                i -= 1
+            self._index = i
+
+    def seek(self, movie):
+        """Make the provided movie the current one, so that get_next returns
+        the movie after it.  Returns false if the movie isn't in the playlist.
+        """
+        i = bisect.bisect_left(self._movies, movie)
+        if i == len(self._movies) or self._movies[i] != movie:
+            return False
+        self._index = i
+        return True
+
+    def peek(self, count):
+        """Return the movies of the next count entries without advancing, or
+        an empty list if the movies are picked in random order.
+        """
+        if self._is_random or not self._movies:
+            return []
+        current = -1 if self._index is None else self._index
+        length = self.length()
+        return [self._entry((current + i) % length) for i in range(1, min(count, length) + 1)]
+
+    def position(self):
+        """Return the index of the current entry, or None if there is none or
+        the movies are picked in random order.
+        """
+        return None if self._is_random else self._index
+
+    def jump(self, i):
+        """Make entry i the current one and return its movie.  Raises
+        IndexError if there is no such entry.
+        """
+        if not 0 <= i < self.length():
+            raise IndexError('no playlist entry {0}'.format(i))
+        self._index = i
+        return self._entry(i)
+
+    def __contains__(self, movie):
+        i = bisect.bisect_left(self._movies, movie)
+        return i < len(self._movies) and self._movies[i] == movie
 
     def length(self):
-        """Return the number of movies in the playlist."""
+        """Return the number of movies that are played."""
         return len(self._movies)
+
+
+class OrderedPlaylist(Playlist):
+    """Playlist that plays movies in a fixed order, like the order of a
+    playlist file.  Every movie is stored once and the order is an array of
+    indices into them, so an entry costs only 4 bytes even if a playlist
+    repeats the same few movies many times.  Movies that are not in the
+    playlist can't be added.
+
+    The movies are taken from a table (see playlist_file.MovieTable) that
+    creates a Movie when it is needed.  The optional accept function that
+    leaves out movies (like missing files) is only called for a movie when it
+    is about to be played, so loading a big playlist doesn't check every file.
+    """
+
+    def __init__(self, table, order, is_random, accept=None):
+        """Create a playlist from a table of distinct movies and an array of
+        indices into that table with the order to play them in.
+        """
+        self._table = table
+        self._accept = accept
+        # Movies that were created, by index.
+        self._cache = {}
+        # For every movie 0 if it wasn't checked by accept yet, 1 if it was
+        # accepted and 2 if it was left out or removed.
+        self._state = bytearray(len(table))
+        # Flag for every movie if it passes the filter, None without filter.
+        self._allowed = None
+        super().__init__(order, is_random)
+
+    def _select(self):
+        """Return the entries of the order whose movie passes the filter."""
+        if self._allowed is None:
+            return self._all
+        allowed = self._allowed
+        return array('I', (x for x in self._all if allowed[x]))
+
+    def _ids(self, filename):
+        """Return the indices of the movies with the provided file name that
+        are played.
+        """
+        allowed = self._allowed
+        return set(i for i in self._table.find(filename)
+                   if self._state[i] != 2 and (allowed is None or allowed[i]))
+
+    def _position(self):
+        """Return the position of the current entry in the unfiltered order."""
+        if self._index is None or self._index < 0 or self._movies is self._all:
+            return self._index
+        count = -1
+        for position, x in enumerate(self._all):
+            if self._allowed[x]:
+                count += 1
+                if count == self._index:
+                    return position
+        return len(self._all) - 1
+
+    def _movie(self, x):
+        """Return the movie with index x, creating it on first use."""
+        movie = self._cache.get(x)
+        if movie is None:
+            movie = self._cache[x] = self._table.movie(x)
+        return movie
+
+    def _accepted(self, x):
+        """Return true if the movie with index x can be played, checking it
+        with accept the first time.
+        """
+        if not self._state[x]:
+            self._state[x] = 1 if self._accept is None or self._accept(self._movie(x)) else 2
+        return self._state[x] == 1
+
+    def _drop(self, ids):
+        """Remove all entries of the movies with the provided indices without
+        changing which movie is played next.
+        """
+        if self._index is not None and self._index >= 0:
+            self._index -= sum(1 for x in self._movies[:self._index + 1] if x in ids)
+        self._all = array('I', (x for x in self._all if x not in ids))
+        self._movies = self._select()
+        self._version += 1
+        for i in ids:
+            self._state[i] = 2
+            self._cache.pop(i, None)
+
+    def _check_current(self):
+        """Return the movie of the current entry if it can be played.
+        Otherwise the movies that can't be played are left out up to the next
+        entry that can, which becomes the current one.  Returns None if no
+        movie is left.
+        """
+        count = len(self._movies)
+        rejected = set()
+        for i in range(count):
+            x = self._movies[(self._index + i) % count]
+            if x in rejected:
+                continue
+            if self._accepted(x):
+                break
+            rejected.add(x)
+        if rejected:
+            # Leaving out the entries steps back to the entry before the
+            # current one, the one after it is the movie found.
+            self._drop(rejected)
+            if not self._movies:
+                self._index = None
+                return None
+            self._index = (self._index + 1) % len(self._movies)
+        return self._entry(self._index)
+
+    def _entry(self, i):
+        return self._movie(self._movies[i])
+
+    def get_next(self) -> Movie:
+        movie = super().get_next()
+        if movie is None or self._is_random:
+            # The pickers only see checked movies, see movies.
+            return movie
+        return self._check_current()
+
+    def movies(self):
+        """Return the list of distinct movies that are played.  The movies
+        that weren't checked yet are checked first.
+        """
+        ids = sorted(set(self._movies))
+        rejected = set(x for x in ids if not self._accepted(x))
+        if rejected:
+            self._drop(rejected)
+        return [self._movie(x) for x in ids if x not in rejected]
+
+    def add(self, movie):
+        """Movies that are not part of the playlist file are not played."""
+        pass
+
+    def remove(self, filename):
+        """Remove all entries of the movie with the provided file name without
+        changing which movie is played next.
+        """
+        ids = set(i for i in self._table.find(filename) if self._state[i] != 2)
+        if ids:
+            self._drop(ids)
+
+    def set_filter(self, predicate):
+        """Only play the movies for which predicate returns true, or all movies
+        if predicate is None.  Playback continues with the first played entry
+        following the current one.
+        """
+        position = self._position()
+        self._filter = predicate
+        self._version += 1
+        if predicate is None:
+            self._allowed = None
+        else:
+            # Movies that weren't created yet are only created for the
+            # predicate, they don't need to be kept.
+            self._allowed = bytearray(self._state[i] != 2 and predicate(self._cache.get(i) or self._table.movie(i))
+                                      for i in range(len(self._table)))
+        self._movies = self._select()
+        if position is not None:
+            allowed = self._allowed
+            self._index = sum(1 for x in self._all[:position + 1]
+                              if allowed is None or allowed[x]) - 1
+
+    def seek(self, movie):
+        """Make the first entry of the provided movie the current one.  Returns
+        false if the movie isn't in the playlist.
+        """
+        ids = self._ids(movie.filename)
+        if ids:
+            for position, x in enumerate(self._movies):
+                if x in ids:
+                    self._index = position
+                    return True
+        return False
+
+    def peek(self, count):
+        """Return the movies of the next count entries that can be played
+        without advancing, or an empty list if the movies are picked in
+        random order.
+        """
+        if self._is_random or not self._movies:
+            return []
+        current = -1 if self._index is None else self._index
+        length = self.length()
+        ids = [self._movies[(current + i) % length] for i in range(1, min(count, length) + 1)]
+        return [self._movie(x) for x in ids if self._accepted(x)]
+
+    def jump(self, i):
+        """Make entry i the current one and return its movie, or the movie of
+        the next entry that can be played.  Raises IndexError if there is no
+        such entry.
+        """
+        super().jump(i)
+        movie = self._check_current()
+        if movie is None:
+            raise IndexError('no playlist entry {0}'.format(i))
+        return movie
+
+    def __contains__(self, movie):
+        return len(self._ids(movie.filename)) > 0
@@ -0,0 +1,244 @@
+# Copyright 2019 bitconnect
+# Author: Tobias Perschon
+# License: GNU GPLv2, see LICENSE.txt
+import os
+import shutil
+import tempfile
+import time
+
+from . import ipc, metrics, player_process
+
+# Video player that keeps one mpv process running for all movies instead of
+# starting a player for every movie.  mpv is started once in idle mode and
+# every movie is loaded over its JSON IPC socket (see ipc.py), which saves
+# starting the process and setting up the decoder and display at every
+# transition, so there is no black frame between the movies.  The end of a
+# movie is reported by an event on the socket, which wakes up the main loop
+# through the file descriptor of wakeup_fds (the process doesn't exit, so
+# there is no SIGCHLD).  If mpv exits anyway it is started again for the next
+# movie.
+
+# Seconds mpv gets to quit when the looper exits before it is killed.
+QUIT_TIMEOUT = 2.0
+
+
+def millibels_to_volume(vol):
+    """Return the mpv volume for a volume in millibels (like the --vol of
+    omxplayer).  mpv uses percent on a cubic scale.
+    """
+    return 100.0 * 10 ** (vol / 6000.0)
+
+
+class MPVPlayer:
+
+    def __init__(self, config):
+        """Create an instance of a video player that plays all movies with one
+        mpv process running in the background.
+        """
+        self._process = None
+        self._client = None
+        # Private directory of the socket if none is configured.
+        self._socket_dir = None
+        self._movie = None
+        # Playlist entry of mpv the current movie is played as.
+        self._entry = None
+        self._playing = False
+        self._stopping = False
+        self._stop_latency = None
+        self._notify_r, self._notify_w = os.pipe()
+        os.set_blocking(self._notify_r, False)
+        os.set_blocking(self._notify_w, False)
+        self._load_config(config)
+
+    def _load_config(self, config):
+        self._extensions = config.get('mpv', 'extensions', fallback='avi, mov, mkv, mp4, m4v') \
+                                 .translate(str.maketrans('', '', ' \t\r\n.')) \
+                                 .split(',')
+        self._command = config.get('mpv', 'command', fallback='mpv').split()
+        self._extra_args = config.get('mpv', 'extra_args', fallback='').split()
+        self._socket_path = config.get('mpv', 'socket', fallback='')
+
+    def supported_extensions(self):
+        """Return list of supported file extensions."""
+        return self._extensions
+
+    def _notify(self):
+        """Wake up the main loop, called by the thread of the IPC client."""
+        try:
+            os.write(self._notify_w, b'x')
+        except BlockingIOError:
+            pass
+
+    def _start(self):
+        """Start mpv and connect to it unless it is running already."""
+        if self._process is not None and self._process.poll() is None \
+                and self._client is not None and self._client.connected():
+            return
+        self._shutdown()
+        path = self._socket_path
+        if not path:
+            self._socket_dir = tempfile.mkdtemp(prefix='video_looper_mpv_')
+            path = os.path.join(self._socket_dir, 'socket')
+        args = self._command + ['--idle=yes', '--input-ipc-server=' + path, '--no-terminal']
+        self._process = player_process.spawn(args + self._extra_args)
+        self._client = ipc.connect(path, self._process, on_event=self._notify)
+
+    def _shutdown(self):
+        """Stop mpv and close the connection to it."""
+        if self._client is not None:
+            if self._process is not None and self._process.poll() is None:
+                try:
+                    self._client.command('quit')
+                except (OSError, ValueError):
+                    pass
+            self._client.close()
+            self._client = None
+        if self._process is not None:
+            if not player_process.wait_for_exit(self._process, QUIT_TIMEOUT):
+                player_process.stop(self._process, QUIT_TIMEOUT)
+            self._process = None
+        if self._socket_dir is not None:
+            shutil.rmtree(self._socket_dir, ignore_errors=True)
+            self._socket_dir = None
+        self._playing = False
+
+    def _load(self, movie, loop, vol):
+        # Events of the previous movie don't matter anymore.
+        self._client.events()
+        data = self._client.commands([['set_property', 'loop-file', 'inf' if loop <= -1 else 'no'],
+                                      ['set_property', 'volume', millibels_to_volume(vol)],
+                                      ['set_property', 'pause', False],
+                                      ['loadfile', movie, 'replace']])[-1]
+        # Versions of mpv before 0.33 don't return the playlist entry.
+        self._entry = data.get('playlist_entry_id') if isinstance(data, dict) else None
+
+    def play(self, movie, loop=0, vol=0):
+        """Play the provided movie file, optionally looping it repeatedly."""
+        self._start()
+        try:
+            self._load(movie, loop, vol)
+        except OSError:
+            # mpv exited since the last movie, start it again.
+            self._shutdown()
+            self._start()
+            self._load(movie, loop, vol)
+        self._movie = movie
+        self._playing = True
+
+    def _handle_events(self, events):
+        """Notice the end of the current movie in the events of mpv."""
+        for event in events:
+            if event.get('event') != 'end-file':
+                continue
+            entry = event.get('playlist_entry_id')
+            if self._entry is not None and entry is not None and entry != self._entry:
+                # A movie that was replaced by the current one.
+                continue
+            reason = event.get('reason')
+            if self._entry is None and reason == 'stop' and not self._stopping:
+                continue
+            self._playing = False
+            if reason == 'error':
+                metrics.PLAYER_CRASHES.inc(1, self._movie)
+
+    def is_playing(self):
+        """Return true if a movie is playing, false otherwise."""
+        try:
+            while os.read(self._notify_r, 512):
+                pass
+        except BlockingIOError:
+            pass
+        if not self._playing:
+            return False
+        if self._process.poll() is not None or not self._client.connected():
+            # mpv exited while playing.
+            self._playing = False
+            player_process.record_exit(self._process, self._movie)
+            return False
+        self._handle_events(self._client.events())
+        return self._playing
+
+    def stop(self, block_timeout_sec=0):
+        """Stop the current movie, mpv keeps running.  block_timeout_sec is
+        how many seconds to block waiting for the movie to end before moving
+        on.
+        """
+        if not self.is_playing():
+            return
+        start = time.monotonic()
+        self._stopping = True
+        try:
+            self._client.command('stop')
+            deadline = start + block_timeout_sec
+            while self._playing and self._client.connected():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._handle_events(self._client.wait_events(remaining))
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._stopping = False
+        if not self._playing:
+            self._stop_latency = time.monotonic() - start
+            metrics.PLAYER_STOP.observe(self._stop_latency)
+        self._playing = False
+
+    def pause(self):
+        """Pause playback."""
+        if self.is_playing():
+            self._client.set_property('pause', True)
+
+    def resume(self):
+        """Resume playback after pause."""
+        if self.is_playing():
+            self._client.set_property('pause', False)
+
+    def seek(self, seconds):
+        """Continue the current movie at the provided position in seconds."""
+        if self.is_playing():
+            self._client.command('seek', seconds, 'absolute')
+
+    def set_volume(self, vol):
+        """Change the volume (in millibels) of the current movie."""
+        if self.is_playing():
+            self._client.set_property('volume', millibels_to_volume(vol))
+
+    def position(self):
+        """Return the position in seconds of the current movie, or None if
+        nothing is playing.
+        """
+        if not self.is_playing():
+            return None
+        try:
+            return self._client.get_property('time-pos')
+        except (OSError, ValueError):
+            # The movie isn't loaded completely yet.
+            return None
+
+    def wakeup_fds(self):
+        """Return a list of file descriptors that become readable when
+        is_playing should be checked, like when a movie ended.
+        """
+        return [self._notify_r]
+
+    def last_stop_latency(self):
+        """Return the seconds the last stop took until the movie ended, or
+        None if no movie was stopped yet.
+        """
+        return self._stop_latency
+
+    def close(self):
+        """Quit mpv, the player can't be used anymore."""
+        self._shutdown()
+        os.close(self._notify_r)
+        os.close(self._notify_w)
+
+    @staticmethod
+    def can_loop_count():
+        return False
+
+
+def create_player(config):
+    """Create new video player based on mpv."""
+    return MPVPlayer(config)
@@ -1,18 +1,40 @@
 # Copyright 2019 bitconnect
 # Author: Tobias Perschon
 # License: GNU GPLv2, see LICENSE.txt
+import getpass
+import itertools
 import os
 import subprocess
 import time
 
+from . import player_process
 
-class OMXPlayer:
+# In gapless mode the player of the next movie is started before the current
+# one ends, invisible (--alpha 0) and with its own D-Bus name.  Once omxplayer
+# answers on D-Bus the movie is loaded, it is paused and sent back to its first
+# frame.  When the current movie ended it is made visible and continued, so the
+# gap between the movies doesn't include the start of omxplayer.  The omxplayer
+# script writes the address of its D-Bus session bus to DBUS_ADDRESS_FILE.
+
+DBUS_ADDRESS_FILE = '/tmp/omxplayerdbus.{0}'
+DBUS_PATH = '/org/mpris/MediaPlayer2'
+DBUS_PLAYER = 'org.mpris.MediaPlayer2.Player'
+# Seconds a standby player gets to load its movie, and how often it is asked
+# whether it is ready.
+HOLD_TIMEOUT = 10.0
+HOLD_INTERVAL = 0.05
+
+
+class OMXPlayer(player_process.StandbyPlayer):
 
     def __init__(self, config):
         """Create an instance of a video player that runs omxplayer in the
         background.
         """
-        self._process = None
+        super().__init__()
+        # D-Bus names of the standby players by process id.
+        self._dbus_names = {}
+        self._standby_ids = itertools.count()
         self._load_config(config)
 
     def _load_config(self, config):
@@ -27,48 +49,58 @@ class OMXPlayer:
         """Return list of supported file extensions."""
         return self._extensions
 
-    def play(self, movie, loop=0, vol=0):
-        """Play the provided movied file, optionally looping it repeatedly."""
-        self.stop(3)  # Up to 3 second delay to let the old player stop.
-        # Assemble list of arguments.
+    def _build_args(self, movie, loop, vol):
+        """Return the omxplayer command line for the provided movie."""
         args = ['omxplayer']
         args.extend(['-o', self._sound])  # Add sound arguments.
         args.extend(self._extra_args)     # Add extra arguments from config.
-        if vol is not 0:
+        if vol != 0:
             args.extend(['--vol', str(vol)])
         if loop <= -1:
             args.append('--loop')         # Add loop parameter if necessary.
         args.append(movie)                # Add movie file path.
-        # Run omxplayer process and direct standard output to /dev/null.
-        self._process = subprocess.Popen(args,
-                                         stdout=open(os.devnull, 'wb'),
-                                         close_fds=True)
-
-    def is_playing(self):
-        """Return true if the video player is running, false otherwise."""
-        if self._process is None:
-            return False
-        self._process.poll()
-        return self._process.returncode is None
+        return args
 
-    def stop(self, block_timeout_sec=0):
-        """Stop the video player.  block_timeout_sec is how many seconds to
-        block waiting for the player to stop before moving on.
+    def _dbus(self, name, method, *args):
+        """Call a method of the omxplayer with the D-Bus name name.  Returns
+        false if it failed, like when the player isn't ready yet.
         """
-        # Stop the player if it's running.
-        if self._process is not None and self._process.returncode is None:
-            # There are a couple processes used by omxplayer, so kill both
-            # with a pkill command.
-            subprocess.call(['pkill', '-9', 'omxplayer'])
-        # If a blocking timeout was specified, wait up to that amount of time
-        # for the process to stop.
-        start = time.time()
-        while self._process is not None and self._process.returncode is None:
-            if (time.time() - start) >= block_timeout_sec:
-                break
-            time.sleep(0)
-        # Let the process be garbage collected.
-        self._process = None
+        try:
+            with open(DBUS_ADDRESS_FILE.format(getpass.getuser())) as f:
+                address = f.read().strip()
+        except OSError:
+            return False
+        env = dict(os.environ, DBUS_SESSION_BUS_ADDRESS=address)
+        try:
+            return subprocess.run(['dbus-send', '--print-reply', '--session', '--reply-timeout=500',
+                                   '--dest=' + name, DBUS_PATH, '{0}.{1}'.format(DBUS_PLAYER, method)] + list(args),
+                                  env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                  timeout=2).returncode == 0
+        except (OSError, subprocess.TimeoutExpired):
+            return False
+
+    def _spawn_standby(self, args):
+        name = 'org.mpris.MediaPlayer2.omxplayer.standby{0}_{1}'.format(os.getpid(), next(self._standby_ids))
+        process = player_process.spawn(args[:1] + ['--alpha', '0', '--dbus_name', name] + args[1:])
+        self._dbus_names = {process.pid: name}
+        return process
+
+    def _hold(self, process, cancel):
+        name = self._dbus_names.get(process.pid)
+        deadline = time.monotonic() + HOLD_TIMEOUT
+        # omxplayer answers on D-Bus once it opened the movie and set up the
+        # decoder.
+        while not self._dbus(name, 'Pause'):
+            if cancel.wait(HOLD_INTERVAL) or time.monotonic() >= deadline or process.poll() is not None:
+                return False
+        # It may have played a few frames before it was paused.
+        self._dbus(name, 'SetPosition', 'objpath:/not/used', 'int64:0')
+        return not cancel.is_set()
+
+    def _show(self, process):
+        name = self._dbus_names.pop(process.pid, None)
+        self._dbus(name, 'SetAlpha', 'objpath:/not/used', 'int64:255')
+        self._dbus(name, 'Play')
 
     @staticmethod
     def can_loop_count():
@@ -0,0 +1,115 @@
+# Copyright 2019 bitconnect
+# Author: Tobias Perschon
+# License: GNU GPLv2, see LICENSE.txt
+from collections import OrderedDict
+
+import pygame
+
+# Display backend that draws the on screen display (countdown, idle and other
+# messages) with pygame.  The video looper only imports this module (and with it
+# pygame) if something needs the display, otherwise headless.py is used.
+#
+# The background (color and optional image) is composed once into a surface in
+# the pixel format of the display, so clearing the screen is a plain copy
+# instead of a scale and format conversion of the image every time.  Rendered
+# text is kept in a small LRU cache and only the parts of the screen that
+# changed are updated on the display.
+
+# Number of rendered texts kept in the cache.  The countdown needs one per
+# second plus its message, the rest are idle and status messages.
+TEXT_CACHE_SIZE = 32
+
+
+def open_display():
+    """Initialize pygame and return the surface of a fullscreen window."""
+    pygame.display.init()
+    pygame.font.init()
+    pygame.mouse.set_visible(False)
+    return pygame.display.set_mode((0, 0), pygame.FULLSCREEN | pygame.NOFRAME)
+
+
+def load_image(path):
+    """Load an image file and return it as a surface."""
+    return pygame.image.load(path)
+
+
+class OSDRenderer:
+
+    def __init__(self, screen, bgcolor, fgcolor, bgimage=None, cache_size=TEXT_CACHE_SIZE):
+        """Create a renderer drawing to screen with the provided colors.
+        bgimage is an optional image surface that is scaled to the size of
+        the screen and drawn on top of the background color.
+        """
+        self._screen = screen
+        # Fonts by size, loaded when they are used first.
+        self._fonts = {}
+        self._bgcolor = bgcolor
+        self._fgcolor = fgcolor
+        self._background = None
+        if bgimage is not None:
+            self._background = pygame.Surface(screen.get_size()).convert()
+            self._background.fill(bgcolor)
+            self._background.blit(pygame.transform.scale(bgimage, screen.get_size()), (0, 0))
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        # Rects of the screen that were drawn on since it was cleared.
+        self._dirty = []
+
+    def _restore(self, rect):
+        """Draw the background in rect of the screen."""
+        if self._background is not None:
+            self._screen.blit(self._background, rect, rect)
+        else:
+            self._screen.fill(self._bgcolor, rect)
+
+    def blank(self):
+        """Clear the whole screen to the background."""
+        self._restore(self._screen.get_rect())
+        self._dirty = []
+        pygame.display.update()
+
+    def _font(self, size):
+        font = self._fonts.get(size)
+        if font is None:
+            font = self._fonts[size] = pygame.font.Font(None, size)
+        return font
+
+    def text(self, message, size):
+        """Return a surface of message rendered with the default font at
+        size in the foreground color on the background color.  Surfaces are
+        cached.
+        """
+        key = (message, size)
+        surface = self._cache.get(key)
+        if surface is not None:
+            self._cache.move_to_end(key)
+            return surface
+        surface = self._font(size).render(message, True, self._fgcolor, self._bgcolor).convert()
+        self._cache[key] = surface
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return surface
+
+    def draw(self, labels):
+        """Replace what was drawn since the screen was cleared with labels, a
+        list of (surface, (x, y)) tuples.  Only the changed parts of the
+        screen are updated on the display.
+        """
+        for rect in self._dirty:
+            self._restore(rect)
+        rects = [self._screen.blit(surface, pos) for surface, pos in labels]
+        pygame.display.update(self._dirty + rects)
+        self._dirty = rects
+
+    def escape_pressed(self):
+        """Handle the pending pygame events and return true if the ESC key was
+        pressed.
+        """
+        pressed = False
+        for event in pygame.event.get():
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+                pressed = True
+        return pressed
+
+    def close(self):
+        pygame.quit()
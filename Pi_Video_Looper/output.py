@@ -0,0 +1,172 @@
+# Copyright 2019 bitconnect
+# Author: Tobias Perschon
+# License: GNU GPLv2, see LICENSE.txt
+import collections
+import configparser
+import fnmatch
+import os
+import re
+
+from .model import Movie
+
+# One video output of the video looper.  Every output has its own player,
+# playlist and playback state, while the file reader, the movie scanner, the
+# metadata index and the display are shared by all outputs of the looper.
+#
+# Outputs are configured with the outputs option of the [video_looper] section
+# and one [output:<name>] section per output.  These options of the section
+# replace the ones of the [video_looper] section for the output:
+OUTPUT_LOOPER_OPTIONS = ('video_player', 'is_random', 'random_mode', 'random_seed',
+                         'playlist', 'wait_time', 'gapless', 'gapless_preload')
+# These options only exist in the output section: movies (file name patterns of
+# the movies the output plays) and volume (the volume in millibels the movies
+# are played with, instead of the sound_vol_file).
+OUTPUT_OPTIONS = ('movies', 'volume')
+# All other options replace the options of the section of the video player
+# (like extra_args of [omxplayer]).
+
+SECTION_PREFIX = 'output:'
+# Name of the only output if no outputs are configured.
+DEFAULT_OUTPUT = 'default'
+# Number of played movies remembered for the previous command of the control
+# server.
+HISTORY_LENGTH = 100
+
+
+def output_names(config):
+    """Return the names of the configured outputs, or None if the looper has
+    a single output configured by the [video_looper] section.  Raises
+    ValueError if the section of an output is missing.
+    """
+    names = [x.strip() for x in config.get('video_looper', 'outputs', fallback='').split(',')]
+    names = [x for x in names if x]
+    if not names:
+        return None
+    for name in names:
+        if not config.has_section(SECTION_PREFIX + name):
+            raise ValueError('missing [{0}{1}] section of output {1}'.format(SECTION_PREFIX, name))
+    if len(set(names)) != len(names):
+        raise ValueError('outputs are listed more than once')
+    return names
+
+
+def output_config(config, name):
+    """Return a copy of config with the options of the [output:name] section
+    applied to the [video_looper] section and the section of the video
+    player.
+    """
+    section = SECTION_PREFIX + name
+    merged = configparser.ConfigParser()
+    merged.read_dict({x: dict(config.items(x, raw=True)) for x in config.sections()})
+    options = [(k, v) for k, v in config.items(section, raw=True) if k not in config.defaults()]
+    for key, value in options:
+        if key in OUTPUT_LOOPER_OPTIONS:
+            merged.set('video_looper', key, value)
+    player_section = merged.get('video_looper', 'video_player')
+    if not merged.has_section(player_section):
+        merged.add_section(player_section)
+    for key, value in options:
+        if key not in OUTPUT_LOOPER_OPTIONS and key not in OUTPUT_OPTIONS:
+            merged.set(player_section, key, value)
+    return merged
+
+
+def movie_filter(patterns):
+    """Return a function that is true for movie file names matching one of
+    the comma separated shell style patterns (case is ignored), or None if
+    there are no patterns.
+    """
+    patterns = [x.strip().lower() for x in patterns.split(',') if x.strip()]
+    if not patterns:
+        return None
+    regex = re.compile('|'.join(fnmatch.translate(x) for x in patterns))
+    return lambda filename: regex.match(os.path.basename(filename).lower()) is not None
+
+
+class Output:
+
+    def __init__(self, name, config, player, picker, shared_movies=True):
+        """Create an output playing with player.  config is the configuration
+        of the output, picker picks the movies in random order (None unless
+        is_random is set).  If shared_movies is false the output plays its
+        own copies of the movies of the scanner, so the playcounts of
+        outputs playing the same movies don't mix.
+        """
+        self.name = name
+        self.player = player
+        self.picker = picker
+        self.is_random = config.getboolean('video_looper', 'is_random')
+        self.wait_time = config.getint('video_looper', 'wait_time')
+        self.gapless = config.getboolean('video_looper', 'gapless', fallback=False) \
+            and hasattr(player, 'prepare')
+        self.gapless_preload = config.getfloat('video_looper', 'gapless_preload', fallback=3.0)
+        self.playlist_file = config.get('video_looper', 'playlist', fallback='')
+        self.using_playlist_file = False
+        section = SECTION_PREFIX + name
+        self._accepts = movie_filter(config.get(section, 'movies', fallback=''))
+        volume = config.get(section, 'volume', fallback='')
+        # Volume set by the output config or the control server, None to use
+        # the volume of the sound_vol_file.
+        self.volume = int(float(volume)) if volume else None
+        self._shared_movies = shared_movies
+        self._movies = {}
+        # Prefix of the console messages about this output.
+        self.prefix = '' if name == DEFAULT_OUTPUT else '[{0}] '.format(name)
+        # Playback state driven by the main loop.
+        self.playlist = None
+        self.movie = None
+        # Movie played next in gapless mode, and the time (monotonic) at which
+        # the player prepares it or None if it did already.
+        self.upcoming = None
+        self.prepare_at = None
+        self.history = collections.deque(maxlen=HISTORY_LENGTH)
+        self.paused = False
+        # Names of the active schedule windows and their movie filter.
+        self.schedule_segment = None
+        # Used for not waiting the first time.
+        self.first_start = True
+        # Time (monotonic) until which the output waits between movies.
+        self.wait_until = None
+        # (movie, seq, at) of a synchronized start that is due (see sync.py).
+        self.sync_start = None
+
+    def accepts(self, filename):
+        """Return true if the output plays the movie file."""
+        return self._accepts is None or self._accepts(filename)
+
+    def movies(self, movies):
+        """Return the list of the scanned movies the output plays, which may
+        be the list of the scanner itself.
+        """
+        if self._shared_movies:
+            if self._accepts is None:
+                return movies
+            return [x for x in movies if self.accepts(x.filename)]
+        own = {}
+        for x in movies:
+            if self.accepts(x.filename):
+                own[x.filename] = self._own_movie(x)
+        self._movies = own
+        return list(own.values())
+
+    def movie_for(self, movie):
+        """Return the movie the output plays for a new movie of the scanner,
+        or None if it doesn't play it.
+        """
+        if not self.accepts(movie.filename):
+            return None
+        if self._shared_movies:
+            return movie
+        own = self._movies[movie.filename] = self._own_movie(movie)
+        return own
+
+    def forget(self, filename):
+        """Drop the copy of a movie that was removed."""
+        self._movies.pop(filename, None)
+
+    def _own_movie(self, movie):
+        own = self._movies.get(movie.filename)
+        if own is None:
+            own = Movie(movie.filename, movie.repeats, movie.volume)
+            own.info = movie.info
+        return own
@@ -0,0 +1,159 @@
+# Copyright 2019 bitconnect
+# Author: Tobias Perschon
+# License: GNU GPLv2, see LICENSE.txt
+import random
+
+# Ways to pick the next movie of a playlist in random order.  A picker is kept
+# by the video looper and attached to every playlist it builds, so its state
+# (like the movies already played in the current cycle) survives rebuilds of
+# the playlist.  Pickers only look at the movies of a playlist again after it
+# changed, picking a movie doesn't depend on the size of the playlist.
+
+RANDOM_MODES = ('uniform', 'shuffle', 'weighted')
+
+
+class _Picker:
+    """Base class of the pickers that caches the movies of the playlist."""
+
+    def __init__(self, rng):
+        self._rng = rng
+        self._playlist = None
+        self._version = None
+        self._movies = []
+
+    def _update(self, playlist):
+        """Refresh the cached movies if the playlist changed.  Returns true if
+        it did.
+        """
+        if playlist is self._playlist and playlist.version() == self._version:
+            return False
+        self._playlist = playlist
+        self._version = playlist.version()
+        self._movies = playlist.movies()
+        self._changed()
+        return True
+
+    def _changed(self):
+        pass
+
+    def invalidate(self):
+        """Make the picker look at the movies again on the next pick."""
+        self._playlist = None
+
+
+class UniformPicker(_Picker):
+    """Picks every movie with the same probability, independent of what was
+    played before.
+    """
+
+    def pick(self, playlist):
+        self._update(playlist)
+        return self._movies[self._rng.randrange(len(self._movies))]
+
+
+class ShuffleBag(_Picker):
+    """Plays every movie exactly once per cycle in random order.  The last
+    movie of a cycle is never the first one of the next cycle.  Movies added
+    during a cycle are played in the same cycle, movies played before a
+    rebuild of the playlist are not played again in the same cycle.
+    """
+
+    def __init__(self, rng):
+        super().__init__(rng)
+        # Movies of the current cycle, the first remaining ones are not
+        # played yet.
+        self._bag = []
+        self._remaining = 0
+        # File names of the movies played in the current cycle.
+        self._played = set()
+        self._last = None
+
+    def _changed(self):
+        played = self._played
+        self._bag = [x for x in self._movies if x.filename not in played]
+        self._remaining = len(self._bag)
+
+    def pick(self, playlist):
+        self._update(playlist)
+        if self._remaining == 0:
+            # Start a new cycle.
+            self._played.clear()
+            self._bag = list(self._movies)
+            self._remaining = len(self._bag)
+            j = self._rng.randrange(self._remaining)
+            if self._remaining > 1 and self._bag[j].filename == self._last:
+                # Don't play the same movie twice in a row.
+                j = (j + 1 + self._rng.randrange(self._remaining - 1)) % self._remaining
+        else:
+            j = self._rng.randrange(self._remaining)
+        # One step of a Fisher-Yates shuffle: move the picked movie behind the
+        # remaining ones.
+        self._remaining -= 1
+        bag = self._bag
+        bag[j], bag[self._remaining] = bag[self._remaining], bag[j]
+        movie = bag[self._remaining]
+        self._played.add(movie.filename)
+        self._last = movie.filename
+        return movie
+
+
+class WeightedPicker(_Picker):
+    """Picks movies with a probability proportional to their weight using an
+    alias table (Vose's method), which is built once when the playlist
+    changes.
+    """
+
+    def __init__(self, rng, weight):
+        """Create a picker, weight is a function returning the weight of a
+        movie (a number >= 0).
+        """
+        super().__init__(rng)
+        self._weight = weight
+        self._probability = []
+        self._alias = []
+
+    def _changed(self):
+        n = len(self._movies)
+        weights = [max(0.0, float(self._weight(x))) for x in self._movies]
+        total = sum(weights)
+        if total <= 0:
+            weights = [1.0] * n
+            total = float(n)
+        scaled = [x * n / total for x in weights]
+        self._probability = [1.0] * n
+        self._alias = list(range(n))
+        small = [i for i, x in enumerate(scaled) if x < 1.0]
+        large = [i for i, x in enumerate(scaled) if x >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            self._probability[s] = scaled[s]
+            self._alias[s] = l
+            scaled[l] = scaled[l] + scaled[s] - 1.0
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+        # What is left has a probability of 1 (up to rounding errors).
+
+    def pick(self, playlist):
+        self._update(playlist)
+        i = self._rng.randrange(len(self._movies))
+        if self._rng.random() >= self._probability[i]:
+            i = self._alias[i]
+        return self._movies[i]
+
+
+def create_picker(mode, seed=None, weight=None):
+    """Create the picker for a random mode (one of RANDOM_MODES).  Seed makes
+    the order reproducible, weight is the function returning the weight of a
+    movie for the weighted mode.  Raises ValueError for an unknown mode.
+    """
+    rng = random.Random(seed)
+    if mode == 'uniform':
+        return UniformPicker(rng)
+    if mode == 'shuffle':
+        return ShuffleBag(rng)
+    if mode == 'weighted':
+        return WeightedPicker(rng, weight or (lambda movie: 1))
+    raise ValueError('unknown random mode: {0}'.format(mode))
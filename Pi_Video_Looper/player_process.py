@@ -0,0 +1,267 @@
+# Copyright 2019 bitconnect
+# Author: Tobias Perschon
+# License: GNU GPLv2, see LICENSE.txt
+import os
+import select
+import signal
+import subprocess
+import threading
+import time
+
+from . import metrics
+
+# Helpers shared by the video players to run the player program in its own
+# process group and stop it again.  Signalling the group reaches all processes
+# of a player (omxplayer is a shell script running omxplayer.bin) without
+# touching players that were started by someone else.
+# ProcessPlayer is the base class of the players that start the player
+# program for every movie, StandbyPlayer adds gapless playback.
+
+# How long a player gets to exit after SIGTERM before it is killed.
+STOP_GRACE_SEC = 0.5
+
+
+def spawn(args):
+    """Start a player process in a new session (and process group) with
+    standard output directed to /dev/null.
+    """
+    start = time.monotonic()
+    process = subprocess.Popen(args,
+                               stdout=subprocess.DEVNULL,
+                               close_fds=True,
+                               start_new_session=True)
+    metrics.PLAYER_SPAWN.observe(time.monotonic() - start)
+    return process
+
+
+def record_exit(process, movie):
+    """Count the exit of a player that ended by itself with an error as a
+    crash of the movie it played.
+    """
+    if process.returncode:
+        metrics.PLAYER_CRASHES.inc(1, movie)
+
+
+def signal_group(process, sig):
+    """Send a signal to the process group of a player.  Returns false if the
+    group doesn't exist anymore.
+    """
+    try:
+        os.killpg(process.pid, sig)
+        return True
+    except ProcessLookupError:
+        return False
+
+
+def wait_for_exit(process, timeout):
+    """Wait up to timeout seconds for a process to exit without polling.
+    Returns true if the process has exited.
+    """
+    if process.poll() is not None:
+        return True
+    if timeout <= 0:
+        return False
+    if hasattr(os, 'pidfd_open'):
+        try:
+            pidfd = os.pidfd_open(process.pid)
+        except OSError:
+            pidfd = None
+        if pidfd is not None:
+            try:
+                # The pidfd becomes readable when the process exits.
+                select.select([pidfd], [], [], timeout)
+            finally:
+                os.close(pidfd)
+            return process.poll() is not None
+    try:
+        process.wait(timeout)
+        return True
+    except subprocess.TimeoutExpired:
+        return False
+
+
+def stop(process, timeout, grace=STOP_GRACE_SEC):
+    """Stop a player process group.  The group is asked to exit with SIGTERM
+    and killed with SIGKILL if it is still running after the grace time.
+    Waits up to timeout seconds in total and returns the number of seconds it
+    took until the process exited, or None if it didn't exit in time.
+    """
+    start = time.monotonic()
+    if signal_group(process, signal.SIGTERM):
+        # A stopped (prepared) player only handles SIGTERM once continued.
+        signal_group(process, signal.SIGCONT)
+        if not wait_for_exit(process, min(grace, timeout)):
+            signal_group(process, signal.SIGKILL)
+    if wait_for_exit(process, timeout - (time.monotonic() - start)):
+        latency = time.monotonic() - start
+        metrics.PLAYER_STOP.observe(latency)
+        return latency
+    return None
+
+
+class ProcessPlayer:
+    """Base class of the video players that run a player program for every
+    movie.  Subclasses provide _build_args(movie, loop, vol) that returns the
+    command line for a movie.
+    """
+
+    def __init__(self):
+        self._process = None
+        # Movie played by the current process.
+        self._movie = None
+        self._exit_time = None
+        self._transition_gap = None
+        self._stop_latency = None
+
+    def _spawn(self, args):
+        """Start the player with the command line args."""
+        return spawn(args)
+
+    def play(self, movie, loop=0, vol=0):
+        """Play the provided movie file, optionally looping it repeatedly."""
+        self.stop(3)  # Up to 3 second delay to let the old player stop.
+        self._process = self._spawn(self._build_args(movie, loop, vol))
+        # When the first frame shows depends on how long the player takes
+        # to start, which isn't known.
+        self._transition_gap = None
+        self._exit_time = None
+        self._movie = movie
+
+    def last_transition_gap(self):
+        """Return the seconds between the exit of the previous player and the
+        first frame of the current movie for the last gapless transition, or
+        None.
+        """
+        return self._transition_gap
+
+    def is_playing(self):
+        """Return true if the video player is running, false otherwise."""
+        if self._process is None:
+            return False
+        self._process.poll()
+        if self._process.returncode is not None and self._exit_time is None:
+            self._exit_time = time.monotonic()
+            record_exit(self._process, self._movie)
+        return self._process.returncode is None
+
+    def stop(self, block_timeout_sec=0):
+        """Stop the video player.  block_timeout_sec is how many seconds to
+        block waiting for the player to stop before moving on.
+        """
+        # Stop the player if it's running.  All processes of the player are
+        # in its own process group, so the whole group is signalled.
+        if self._process is not None and self._process.poll() is None:
+            latency = stop(self._process, block_timeout_sec)
+            if latency is not None:
+                self._stop_latency = latency
+        elif self._process is not None:
+            # Make sure no process of the group is left behind.
+            signal_group(self._process, signal.SIGKILL)
+        # Let the process be garbage collected.
+        self._process = None
+
+    def pause(self):
+        """Pause playback by stopping (SIGSTOP) the player processes."""
+        if self._process is not None and self._process.poll() is None:
+            signal_group(self._process, signal.SIGSTOP)
+
+    def resume(self):
+        """Resume playback after pause."""
+        if self._process is not None and self._process.poll() is None:
+            signal_group(self._process, signal.SIGCONT)
+
+    def last_stop_latency(self):
+        """Return the seconds the last stop took until the player exited, or
+        None if no player was stopped yet.
+        """
+        return self._stop_latency
+
+
+class StandbyPlayer(ProcessPlayer):
+    """Process player that starts the player of the next movie ahead of time
+    for gapless playback.  The standby player loads its movie and holds the
+    first frame hidden until play is called with the same arguments, then it
+    is shown and continues right away.  Subclasses provide how:
+
+    - _spawn_standby(args) starts the standby player,
+    - _hold(process, cancel) waits in a background thread until the movie is
+      loaded, pauses it on its first frame and returns true (false if that
+      failed or the cancel event was set),
+    - _show(process) makes the held player visible and continues it.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._standby = None
+        self._standby_args = None
+        # Thread running _hold for the standby player, the event it sets
+        # once the player holds its first frame and the event that cancels it.
+        self._hold_thread = None
+        self._held = None
+        self._cancel = None
+
+    def _spawn_standby(self, args):
+        return spawn(args)
+
+    def _run_hold(self, process, held, cancel):
+        if self._hold(process, cancel):
+            held.set()
+
+    def prepare(self, movie, loop=0, vol=0):
+        """Start the player for the movie that is played next.  It loads the
+        movie in the background and waits on its first frame until play is
+        called with the same movie, loop and volume.
+        """
+        self._discard_standby()
+        self._standby_args = self._build_args(movie, loop, vol)
+        self._standby = self._spawn_standby(self._standby_args)
+        self._held = threading.Event()
+        self._cancel = threading.Event()
+        self._hold_thread = threading.Thread(target=self._run_hold, args=(self._standby, self._held, self._cancel),
+                                             daemon=True)
+        self._hold_thread.start()
+
+    def _discard_standby(self):
+        """Kill a prepared player that was not used."""
+        if self._standby is None:
+            return
+        self._cancel.set()
+        signal_group(self._standby, signal.SIGKILL)
+        self._hold_thread.join()
+        wait_for_exit(self._standby, 1)
+        self._standby = None
+
+    def play(self, movie, loop=0, vol=0):
+        """Play the provided movie file, optionally looping it repeatedly.  A
+        prepared player for the same movie is shown, if the previous movie
+        ended already.
+        """
+        args = self._build_args(movie, loop, vol)
+        if self._standby is None or self._standby_args != args or self.is_playing():
+            super().play(movie, loop, vol)
+            return
+        # The standby may still be loading if it was prepared late.
+        self._hold_thread.join()
+        standby = self._standby
+        self._standby = None
+        if not self._held.is_set() or standby.poll() is not None:
+            signal_group(standby, signal.SIGKILL)
+            wait_for_exit(standby, 1)
+            super().play(movie, loop, vol)
+            return
+        self._process = standby
+        self._show(standby)
+        if self._exit_time is not None:
+            self._transition_gap = time.monotonic() - self._exit_time
+        else:
+            self._transition_gap = None
+        self._exit_time = None
+        self._movie = movie
+
+    def stop(self, block_timeout_sec=0):
+        """Stop the video player and a prepared player.  block_timeout_sec is
+        how many seconds to block waiting for the player to stop before
+        moving on.
+        """
+        super().stop(block_timeout_sec)
+        self._discard_standby()
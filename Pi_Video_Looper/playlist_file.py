@@ -0,0 +1,187 @@
+# Copyright 2019 bitconnect
+# Author: Tobias Perschon
+# License: GNU GPLv2, see LICENSE.txt
+import json
+import os
+from array import array
+
+from .model import Movie, OrderedPlaylist
+from .scanner import repeats_from_name
+
+# Playlist files define the order movies are played in.  Two formats are
+# supported:
+#
+# - M3U (.m3u or .m3u8): one movie per line, lines starting with # are
+#   ignored.  The repeats are taken from the file name like for movies found
+#   in a directory.
+#
+# - JSON (.json): an array with one entry per movie.  An entry is either the
+#   file name or an object like {"file": "ad.mp4", "repeats": 2, "volume": -600}
+#   with optional repeats and volume (in millibels).
+#
+# Relative file names are relative to the directory of the playlist file.  Both
+# formats are read incrementally so the whole file never has to be in memory.
+
+# Number of characters read at once from JSON playlists.
+CHUNK_SIZE = 64 * 1024
+
+
+def _m3u_entries(f):
+    """Yield the file name of every entry of a M3U file."""
+    for line in f:
+        line = line.strip().lstrip('\ufeff')
+        if line and line[0] != '#':
+            yield line
+
+
+def _json_values(f, chunk_size=CHUNK_SIZE):
+    """Yield the values of the JSON array in file f one by one."""
+    decoder = json.JSONDecoder()
+    buf = ''
+    pos = 0
+    eof = False
+    started = False
+    while True:
+        # Skip white space and separators, reading more data if needed.
+        while True:
+            while pos < len(buf) and (buf[pos] in ' \t\r\n\ufeff' or (started and buf[pos] == ',')):
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            more = f.read(chunk_size)
+            buf = buf[pos:] + more
+            pos = 0
+            eof = not more
+        if pos == len(buf):
+            raise ValueError('unexpected end of playlist')
+        if not started:
+            if buf[pos] != '[':
+                raise ValueError('playlist must be a JSON array')
+            started = True
+            pos += 1
+            continue
+        if buf[pos] == ']':
+            return
+        try:
+            value, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            if eof:
+                raise
+            end = None
+        if end is not None and end < len(buf) and buf[end] not in ' \t\r\n,]':
+            # A number cut off by the end of the chunk is decoded as a valid
+            # but shorter number, the value must be followed by a separator.
+            if eof:
+                raise ValueError('invalid playlist at character {0}'.format(end))
+            end = None
+        if end is None or (end == len(buf) and not eof):
+            # The value continues in the next chunk.
+            more = f.read(chunk_size)
+            buf = buf[pos:] + more
+            pos = 0
+            eof = not more
+            continue
+        yield value
+        pos = end
+
+
+def _json_entries(f):
+    """Yield the file name of every entry of a JSON playlist, or a tuple of
+    file name, repeats and volume if the entry sets them.
+    """
+    for value in _json_values(f):
+        if isinstance(value, str):
+            yield value
+        elif isinstance(value, dict) and isinstance(value.get('file'), str) \
+                and isinstance(value.get('repeats', 1), int) \
+                and isinstance(value.get('volume', 0), (int, float)):
+            yield value['file'], value.get('repeats'), value.get('volume')
+        else:
+            raise ValueError('invalid playlist entry: {0!r}'.format(value))
+
+
+class MovieTable:
+    """The distinct movies of a playlist file.  A file name is stored as the
+    index of its directory (which many entries share) and its base name, and
+    the Movie is only created when the playlist needs it, which keeps big
+    playlists small and fast to load.
+    """
+
+    def __init__(self, dirs, dir_of, names, settings):
+        """Create a table from the list of directories (ending with a slash),
+        an array with the directory index of every movie, the list of their
+        base names and a dict with the repeats and volume of the movies
+        whose entries set them, by index.
+        """
+        self._dirs = dirs
+        self._dir_ids = dict((x, i) for i, x in enumerate(dirs))
+        self._dir_of = dir_of
+        self._names = names
+        self._settings = settings
+
+    def movie(self, i):
+        """Create the movie with index i.  Repeats default to the ones in the
+        file name.
+        """
+        name = self._names[i]
+        repeats, volume = self._settings.get(i, (None, None))
+        if repeats is None:
+            repeats = repeats_from_name(name)
+        return Movie(self._dirs[self._dir_of[i]] + name, repeats, volume)
+
+    def find(self, filename):
+        """Return the list of indices of the movies with a file name."""
+        k = filename.rfind('/') + 1
+        d = self._dir_ids.get(filename[:k])
+        if d is None:
+            return []
+        name = filename[k:]
+        dir_of = self._dir_of
+        return [i for i, x in enumerate(self._names) if x == name and dir_of[i] == d]
+
+    def __len__(self):
+        return len(self._names)
+
+
+def read_playlist_file(path, is_random, accept=None):
+    """Read a M3U or JSON playlist file and return an OrderedPlaylist.  Accept
+    is an optional function that returns false if a movie should be left out,
+    the playlist calls it once for every distinct movie when it is about to
+    be played.  Raises OSError or ValueError if the file can't be read.
+    """
+    prefix = os.path.dirname(os.path.abspath(path)).rstrip('/') + '/'
+    entries = _json_entries if path.lower().endswith('.json') else _m3u_entries
+    dirs = []
+    dir_of = array('I')
+    names = []
+    settings = {}
+    order = array('I')
+    # Index of the movie of every distinct entry.
+    ids = {}
+    # Index of the directory of the movies by the directory part of their
+    # entries.
+    dir_ids = {}
+    # This loop runs for every entry of playlists with hundreds of thousands
+    # of entries, the methods are looked up once.
+    add_dir, add_name, add_order = dir_of.append, names.append, order.append
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for entry in entries(f):
+            i = ids.get(entry)
+            if i is None:
+                if entry.__class__ is str:
+                    name, repeats, volume = entry, None, None
+                else:
+                    name, repeats, volume = entry
+                k = name.rfind('/') + 1
+                part = name[:k]
+                d = dir_ids.get(part)
+                if d is None:
+                    d = dir_ids[part] = len(dirs)
+                    dirs.append(part if part[:1] == '/' or '://' in part else prefix + part)
+                i = ids[entry] = len(names)
+                add_dir(d)
+                add_name(name[k:])
+                if repeats is not None or volume is not None:
+                    settings[i] = (repeats, None if volume is None else int(volume))
+            add_order(i)
+    return OrderedPlaylist(MovieTable(dirs, dir_of, names, settings), order, is_random, accept)
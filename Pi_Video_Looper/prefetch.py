@@ -0,0 +1,154 @@
+# Copyright 2019 bitconnect
+# Author: Tobias Perschon
+# License: GNU GPLv2, see LICENSE.txt
+import collections
+import os
+import threading
+
+from . import metrics
+
+# Loads the movies that are played next into the page cache while the current
+# one plays, so the player of the next movie doesn't wait for a slow USB stick
+# in its first seconds.  The looper passes the upcoming movies after every
+# movie start, a background thread then asks the kernel to read the start of
+# every file (or the whole file) with posix_fadvise(WILLNEED), which reads
+# asynchronously without copying anything into the process.  Where
+# posix_fadvise isn't available the thread reads the files itself.
+#
+# The amount of data prefetched is limited by a budget, files that were
+# prefetched recently count against it until newer ones push them out, so
+# they aren't read again every time the playlist wraps around.
+
+# Size of the reads of the fallback without posix_fadvise.
+READ_CHUNK_SIZE = 1024 * 1024
+# Nice value of the prefetch thread, so it doesn't compete with playback.
+THREAD_NICE = 19
+
+
+class Prefetcher:
+
+    def __init__(self, head_size, budget, whole=False):
+        """Create a prefetcher that loads the first head_size bytes of every
+        movie (or the whole movie if whole is true) and at most budget bytes
+        of all movies.
+        """
+        self._head_size = head_size
+        self._budget = budget
+        self._whole = whole
+        # Files prefetched recently as filename: (size, mtime, bytes), the
+        # oldest first.
+        self._warm = collections.OrderedDict()
+        self._warm_bytes = 0
+        self._pending = None
+        self._busy = False
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def prefetch(self, filenames):
+        """Prefetch the files in the order of the list, replacing the files
+        of the previous call that weren't prefetched yet.
+        """
+        with self._condition:
+            self._pending = list(filenames)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def wait(self, timeout=None):
+        """Wait until all files passed to prefetch were prefetched.  Returns
+        false on timeout.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: self._pending is None and not self._busy, timeout)
+
+    def _run(self):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), THREAD_NICE)
+        except (AttributeError, OSError):
+            pass
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending is not None or self._closed)
+                if self._closed:
+                    return
+                filenames = self._pending
+                self._pending = None
+                self._busy = True
+            try:
+                self._prefetch_files(filenames)
+            finally:
+                with self._condition:
+                    self._busy = False
+                    self._condition.notify_all()
+
+    def _superseded(self):
+        with self._condition:
+            return self._pending is not None or self._closed
+
+    def _prefetch_files(self, filenames):
+        left = self._budget
+        for filename in filenames:
+            if left <= 0 or self._superseded():
+                return
+            try:
+                st = os.stat(filename)
+            except OSError:
+                continue
+            amount = min(st.st_size if self._whole else min(st.st_size, self._head_size), left)
+            left -= amount
+            warm = self._warm.get(filename)
+            if warm is not None and warm[:2] == (st.st_size, st.st_mtime) and warm[2] >= amount:
+                self._warm.move_to_end(filename)
+                continue
+            try:
+                self._load(filename, amount)
+            except OSError:
+                continue
+            metrics.PREFETCH_BYTES.inc(amount)
+            self._remember(filename, (st.st_size, st.st_mtime, amount))
+
+    def _load(self, filename, amount):
+        """Get the first amount bytes of the file into the page cache."""
+        with open(filename, 'rb', buffering=0) as f:
+            if hasattr(os, 'posix_fadvise'):
+                os.posix_fadvise(f.fileno(), 0, amount, os.POSIX_FADV_WILLNEED)
+                return
+            buffer = bytearray(READ_CHUNK_SIZE)
+            while amount > 0 and not self._superseded():
+                n = f.readinto(buffer)
+                if not n:
+                    return
+                amount -= n
+
+    def _remember(self, filename, warm):
+        old = self._warm.pop(filename, None)
+        if old is not None:
+            self._warm_bytes -= old[2]
+        self._warm[filename] = warm
+        self._warm_bytes += warm[2]
+        # Forget the oldest files when the budget is used up, the kernel
+        # may have dropped them from the cache by now.
+        while self._warm_bytes > self._budget and len(self._warm) > 1:
+            self._warm_bytes -= self._warm.popitem(last=False)[1][2]
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def create_prefetcher(config):
+    """Create the prefetcher configured in the [video_looper] section, or
+    return None if prefetching is off.
+    """
+    mode = config.get('video_looper', 'prefetch', fallback='head').lower()
+    if mode == 'off':
+        return None
+    megabyte = 1024 * 1024
+    return Prefetcher(int(config.getfloat('video_looper', 'prefetch_size', fallback=16) * megabyte),
+                      int(config.getfloat('video_looper', 'prefetch_budget', fallback=256) * megabyte),
+                      whole=mode == 'all')
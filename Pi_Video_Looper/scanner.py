@@ -0,0 +1,226 @@
+# Copyright 2019 bitconnect
+# Author: Tobias Perschon
+# License: GNU GPLv2, see LICENSE.txt
+import operator
+import os
+import queue
+import re
+import threading
+
+from .model import Movie
+
+_REPEAT_RE = re.compile('_repeat_([0-9]*)x', flags=re.IGNORECASE)
+_WEIGHT_RE = re.compile('_weight_([0-9]*\\.?[0-9]*)x', flags=re.IGNORECASE)
+
+
+def repeats_from_name(name):
+    """Return the number of repeats set in a file name like movie_repeat_3x.mp4
+    (default 1).
+    """
+    if '_repeat_' not in name.lower():
+        return 1
+    repeatsetting = _REPEAT_RE.search(name)
+    if repeatsetting is not None and repeatsetting.group(1):
+        return int(repeatsetting.group(1))
+    return 1
+
+
+
+def weight_from_name(name):
+    """Return the weight for the weighted random mode set in a file name like
+    movie_weight_3x.mp4 (default 1).
+    """
+    if '_weight_' not in name.lower():
+        return 1
+    weightsetting = _WEIGHT_RE.search(name)
+    try:
+        return float(weightsetting.group(1))
+    except (AttributeError, ValueError):
+        return 1
+
+
+class MovieScanner:
+    """Finds movie files in directories.  Movies are cached by path, size and
+    modification time so that a rescan returns the same Movie objects (with
+    their playcount) for files that didn't change.
+    """
+
+    def __init__(self, extensions):
+        """Create a scanner for files with the provided list of extensions
+        (without the leading dot).
+        """
+        self._suffixes = tuple('.' + x.lower() for x in extensions if x)
+        self._cache = {}
+
+    def _new_movie(self, filename, name):
+        """Create a Movie with the repeat setting from the file name."""
+        return Movie(filename, repeats_from_name(name))
+
+    def create_movie(self, path, name):
+        """Return a Movie for file name in directory path, or None if it is not
+        a movie file or doesn't exist.
+        """
+        # Ignore hidden files (useful when file loaded on usb key from an OSX computer
+        if name[0] == '.' or not name.lower().endswith(self._suffixes):
+            return None
+        filename = '{0}/{1}'.format(path.rstrip('/'), name)
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        key = (filename, st.st_size, st.st_mtime_ns)
+        movie = self._cache.get(key)
+        if movie is None:
+            movie = self._new_movie(filename, name)
+            self._cache[key] = movie
+        return movie
+
+    def _scan_dir(self, path, old_cache, cache, movies, dirs=None):
+        """Append the movies in directory path to movies, taking them from
+        old_cache and adding them to cache.  If dirs is a list the paths of the
+        directories in path that aren't hidden are appended to it.
+        """
+        suffixes = self._suffixes
+        prefix = path.rstrip('/') + '/'
+        try:
+            entries = os.scandir(path)
+        except OSError:
+            return
+        with entries:
+            for entry in entries:
+                name = entry.name
+                # Ignore hidden files and directories.
+                if name[0] == '.':
+                    continue
+                # Ignore files with other extensions.
+                if not name.lower().endswith(suffixes):
+                    # Symbolic links to directories aren't followed, they
+                    # could form a loop.
+                    if dirs is not None and entry.is_dir(follow_symlinks=False):
+                        dirs.append(prefix + name)
+                    continue
+                try:
+                    if not entry.is_file():
+                        continue
+                    st = entry.stat()
+                except OSError:
+                    continue
+                filename = prefix + name
+                key = (filename, st.st_size, st.st_mtime_ns)
+                movie = old_cache.get(key)
+                if movie is None:
+                    movie = self._new_movie(filename, name)
+                cache[key] = movie
+                movies.append(movie)
+
+    def scan(self, paths):
+        """Return a list of all movies in the provided directories sorted by
+        file name.  Paths that don't exist or aren't directories are skipped.
+        Cache entries of files that weren't found anymore are dropped.
+        """
+        movies = []
+        cache = {}
+        old_cache = self._cache
+        for path in paths:
+            self._scan_dir(path, old_cache, cache, movies)
+        self._cache = cache
+        # Sorting by the file name string avoids calling Movie.__lt__.
+        movies.sort(key=operator.attrgetter('filename'))
+        return movies
+
+    def scan_tree(self, paths):
+        """Generator walking the provided directories and all directories in
+        them (except hidden ones).  Yields a tuple of the path of every
+        directory and the list of its movies sorted by file name.  The files of
+        a directory come before its subdirectories, which are walked in the
+        order of their names, so the order is the same every time.  The cache
+        is replaced like by scan once the walk is complete.
+        """
+        cache = {}
+        old_cache = self._cache
+        pending = list(reversed(paths))
+        while pending:
+            path = pending.pop()
+            movies = []
+            dirs = []
+            self._scan_dir(path, old_cache, cache, movies, dirs)
+            movies.sort(key=operator.attrgetter('filename'))
+            dirs.sort(reverse=True)
+            pending += dirs
+            yield path, movies
+        self._cache = cache
+
+
+class BackgroundScan:
+    """Walks directories with MovieScanner.scan_tree in a background thread,
+    so the movies found first can be played while the rest of a big tree is
+    still being searched.  The movies are passed to the main loop through a
+    queue, the file descriptor of fileno becomes readable when some are
+    waiting.
+    """
+
+    def __init__(self, scanner, paths):
+        """Start walking the provided paths with scanner."""
+        self._queue = queue.SimpleQueue()
+        self._closed = False
+        self._done = False
+        self._notify_r, self._notify_w = os.pipe()
+        os.set_blocking(self._notify_r, False)
+        os.set_blocking(self._notify_w, False)
+        self._thread = threading.Thread(target=self._run, args=(scanner, paths), daemon=True)
+        self._thread.start()
+
+    def fileno(self):
+        return self._notify_r
+
+    def _notify(self):
+        try:
+            os.write(self._notify_w, b'x')
+        except BlockingIOError:
+            pass
+
+    def _run(self, scanner, paths):
+        try:
+            for path, movies in scanner.scan_tree(paths):
+                if self._closed:
+                    # Leaving the loop closes the generator without replacing
+                    # the cache of the scanner.
+                    return
+                self._queue.put((path, movies))
+                if movies:
+                    self._notify()
+        finally:
+            # None marks the end of the walk.
+            self._queue.put(None)
+            self._notify()
+
+    def get(self):
+        """Return the list of directories walked and the list of movies found
+        since the last call (in the order found), and a flag that is true once
+        the walk is complete.
+        """
+        try:
+            while os.read(self._notify_r, 512):
+                pass
+        except BlockingIOError:
+            pass
+        directories = []
+        movies = []
+        while not self._done:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._done = True
+            else:
+                directories.append(item[0])
+                movies += item[1]
+        return directories, movies, self._done
+
+    def close(self):
+        """Stop the walk and wait for the thread to end."""
+        self._closed = True
+        self._thread.join()
+        os.close(self._notify_r)
+        os.close(self._notify_w)
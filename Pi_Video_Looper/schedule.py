@@ -0,0 +1,196 @@
+# Copyright 2019 bitconnect
+# Author: Tobias Perschon
+# License: GNU GPLv2, see LICENSE.txt
+import bisect
+import datetime
+import fnmatch
+import os
+import re
+import time
+
+# Time of day schedule (dayparting).  Every window of a schedule is written as
+#
+#   name = days start-end patterns
+#
+# like "morning = mon-fri 06:00-12:00 morning_*, news_*".  Days is a comma
+# separated list of days or day ranges (mon, tue, ... sun) or * for every day.
+# A window ending before it starts continues on the next day.  Patterns are
+# comma separated shell style patterns that are matched against the file names
+# of the movies (case is ignored).  While a window is active only the matching
+# movies are played, if windows overlap the movies of all of them are played.
+# Outside of all windows every movie is played.
+#
+# The week is split into segments at every start and end of a window when the
+# schedule is loaded, so finding the active windows is a binary search.
+
+DAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+DAY_SECONDS = 24 * 60 * 60
+WEEK_SECONDS = 7 * DAY_SECONDS
+
+
+def _parse_days(spec):
+    """Return the sorted list of day numbers (0 is monday) of a days spec."""
+    spec = spec.lower()
+    if spec in ('*', 'daily'):
+        return list(range(7))
+    days = set()
+    for item in spec.split(','):
+        first, _, last = item.strip().partition('-')
+        try:
+            first = DAYS.index(first[:3])
+            last = DAYS.index(last[:3]) if last else first
+        except ValueError:
+            raise ValueError('invalid days: {0}'.format(spec))
+        day = first
+        days.add(day)
+        while day != last:
+            day = (day + 1) % 7
+            days.add(day)
+    return sorted(days)
+
+
+def _parse_time(spec):
+    """Return the seconds since midnight of a HH:MM time."""
+    hours, _, minutes = spec.partition(':')
+    try:
+        seconds = int(hours) * 3600 + int(minutes or 0) * 60
+    except ValueError:
+        raise ValueError('invalid time: {0}'.format(spec))
+    if not 0 <= seconds <= DAY_SECONDS:
+        raise ValueError('invalid time: {0}'.format(spec))
+    return seconds
+
+
+def parse_window(spec):
+    """Parse a window spec into its list of days, start and end (seconds since
+    midnight) and the list of file name patterns.
+    """
+    parts = spec.split(None, 2)
+    if len(parts) != 3:
+        raise ValueError('expected "days start-end patterns": {0}'.format(spec))
+    days = _parse_days(parts[0])
+    start, _, end = parts[1].partition('-')
+    start = _parse_time(start)
+    end = _parse_time(end)
+    patterns = [x.strip() for x in parts[2].split(',') if x.strip()]
+    return days, start, end, patterns
+
+
+def week_seconds(now=None):
+    """Return the seconds since monday midnight (local time)."""
+    if now is None:
+        now = time.time()
+    t = time.localtime(now)
+    return t.tm_wday * DAY_SECONDS + t.tm_hour * 3600 + t.tm_min * 60 + t.tm_sec + now % 1
+
+
+class Schedule:
+    """Weekly schedule of the windows that select which movies are played."""
+
+    def __init__(self, windows):
+        """Create a schedule from a list of (name, spec) tuples.  Raises
+        ValueError if a spec can't be parsed.
+        """
+        self._patterns = {}
+        intervals = []
+        for name, spec in windows:
+            days, start, end, self._patterns[name] = parse_window(spec)
+            if end <= start:
+                end += DAY_SECONDS
+            for day in days:
+                begin = day * DAY_SECONDS + start
+                finish = day * DAY_SECONDS + end
+                if finish > WEEK_SECONDS:
+                    # Sunday night windows continue on monday.
+                    intervals.append((begin, WEEK_SECONDS, name))
+                    intervals.append((0, finish - WEEK_SECONDS, name))
+                else:
+                    intervals.append((begin, finish, name))
+        # Sweep over the starts and ends of all windows in time order and
+        # record the active windows after every boundary.
+        events = {}
+        for begin, finish, name in intervals:
+            events.setdefault(begin, []).append((name, 1))
+            events.setdefault(finish, []).append((name, -1))
+        events.setdefault(0, [])
+        events.pop(WEEK_SECONDS, None)
+        active = {}
+        # Start of every segment and the names of the windows active in it.
+        self._starts = []
+        self._segments = []
+        for start in sorted(events):
+            for name, count in events[start]:
+                active[name] = active.get(name, 0) + count
+                if active[name] == 0:
+                    del active[name]
+            names = tuple(sorted(active))
+            if self._segments and self._segments[-1] == names:
+                continue
+            self._starts.append(start)
+            self._segments.append(names)
+        # Functions matching the movies of a set of windows, created when the
+        # set becomes active.
+        self._predicates = {}
+
+    def _predicate(self, names):
+        """Return a function that is true for movies matching one of the
+        patterns of the windows, or None if there are no patterns (every movie
+        matches).
+        """
+        patterns = [y for x in names for y in self._patterns[x]]
+        if not patterns:
+            return None
+        regex = re.compile('|'.join(fnmatch.translate(x.lower()) for x in patterns))
+        return lambda movie: regex.match(os.path.basename(movie.filename).lower()) is not None
+
+    def lookup(self, now=None):
+        """Return the names of the windows active at time now (default the
+        current time) and the function matching their movies (None if every
+        movie is to be played).
+        """
+        names = self._segments[bisect.bisect_right(self._starts, week_seconds(now)) - 1]
+        if names not in self._predicates:
+            self._predicates[names] = self._predicate(names)
+        return names, self._predicates[names]
+
+    def seconds_until_change(self, now=None):
+        """Return the seconds until the active windows change next, or None if
+        they never change.
+        """
+        if len(self._starts) == 1:
+            return None
+        if now is None:
+            now = time.time()
+        t = week_seconds(now)
+        i = bisect.bisect_right(self._starts, t)
+        following = self._starts[i] if i < len(self._starts) else WEEK_SECONDS
+        # The boundaries are wall clock times, on days the clocks change for
+        # daylight saving time they are an hour more or less away than the
+        # difference of the week seconds.
+        today = datetime.datetime.fromtimestamp(now)
+        monday = datetime.datetime.combine(today.date() - datetime.timedelta(days=today.weekday()),
+                                           datetime.time())
+        boundary = monday + datetime.timedelta(seconds=following)
+        at = boundary.timestamp()
+        if at <= now:
+            # A time that occurs twice when the clocks go back, now is in
+            # the repeated hour.
+            at = boundary.replace(fold=1).timestamp()
+        return max(0.0, at - now)
+
+
+def read_schedule_file(path):
+    """Read the windows of a schedule file.  Every non empty line that doesn't
+    start with # is a window in the same format as in the ini file.
+    """
+    windows = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line[0] == '#':
+                continue
+            name, sep, spec = line.partition('=')
+            if not sep:
+                raise ValueError('expected "name = days start-end patterns": {0}'.format(line))
+            windows.append((name.strip(), spec.strip()))
+    return Schedule(windows)
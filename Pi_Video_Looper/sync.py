@@ -0,0 +1,316 @@
+# Copyright 2019 bitconnect
+# Author: Tobias Perschon
+# License: GNU GPLv2, see LICENSE.txt
+import collections
+import json
+import socket
+import time
+
+# Synchronized playback of several video loopers, like the Pis of a video
+# wall.  One looper is the leader: whenever its next movie is due it picks the
+# movie and sends it with a start time a little in the future to all
+# followers.  The followers prepare the player for the same movie right away
+# and all units start it at that time, the leader on its own clock and the
+# followers on their estimate of it.  Every movie start is synchronized again,
+# so the units can't drift apart over time.
+#
+# The clocks of the units don't have to be set.  Every follower estimates the
+# offset of the leader's clock to its own like NTP does: it sends its time t0
+# to the leader, the leader answers with the time it received the probe t1 and
+# sent the answer t2, and the follower notes when the answer arrived t3.  Then
+#
+#   offset = ((t1 - t0) + (t2 - t3)) / 2     delay = (t3 - t0) - (t2 - t1)
+#
+# The error of the offset is at most half the round trip delay, so of the last
+# few samples the one with the smallest delay is used.  Probes are sent every
+# probe_interval seconds, which also follows the drift of the clocks.
+#
+# All messages are small JSON objects in UDP datagrams:
+#
+#   follower -> leader  {"type": "probe", "t0": ...}
+#   leader -> follower  {"type": "probe", "t0": ..., "t1": ..., "t2": ...}
+#   leader -> follower  {"type": "play", "seq": 7, "index": 3, "file": "ad.mp4", "at": ...}
+#   follower -> leader  {"type": "started", "seq": 7, "skew": ...}
+#
+# The leader sends play messages to every follower that probed it recently.
+# index is the playlist entry of the movie (null in random order), file its
+# file name, which is used if the entry of the follower is a different movie.
+# started reports how many seconds after the planned time (negative if
+# before) the follower started the movie.  See the [sync] section of the ini
+# file for the configuration.
+
+DEFAULT_PORT = 10555
+# Number of clock samples the offset is estimated from.
+CLOCK_SAMPLES = 8
+# Interval of the first probes, so the offset is known soon after starting.
+FAST_PROBE_INTERVAL = 0.1
+# Seconds after which a follower that didn't probe or a leader that didn't
+# answer is considered gone.
+PEER_TIMEOUT = 5.0
+# Seconds a follower that was just started waits for the first movie of the
+# leader before it plays on its own.
+STARTUP_WAIT = 10.0
+MAX_DATAGRAM = 8192
+
+
+class ClockFilter:
+    """Estimate of the offset of a remote clock from the last samples of
+    probes, using the sample with the smallest round trip delay.
+    """
+
+    def __init__(self, size=CLOCK_SAMPLES):
+        self._samples = collections.deque(maxlen=size)
+
+    def add(self, t0, t1, t2, t3):
+        """Add the times of a probe: t0 sent and t3 answer received on the
+        local clock, t1 received and t2 answered on the remote clock.
+        """
+        delay = (t3 - t0) - (t2 - t1)
+        offset = ((t1 - t0) + (t2 - t3)) / 2
+        self._samples.append((max(0.0, delay), offset))
+
+    def full(self):
+        return len(self._samples) == self._samples.maxlen
+
+    def offset(self):
+        """Return the seconds to add to the local clock to get the remote
+        clock, or None if there are no samples.
+        """
+        if not self._samples:
+            return None
+        return min(self._samples)[1]
+
+    def delay(self):
+        """Return the round trip delay of the sample the offset is from."""
+        if not self._samples:
+            return None
+        return min(self._samples)[0]
+
+
+class _SyncSocket:
+
+    def __init__(self, address, clock):
+        self._clock = clock
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            self._socket.setblocking(False)
+            self._socket.bind(address)
+        except OSError:
+            self._socket.close()
+            raise
+
+    def fileno(self):
+        return self._socket.fileno()
+
+    def _send(self, message, address):
+        try:
+            self._socket.sendto(json.dumps(message).encode('utf-8'), address)
+        except OSError:
+            # Like an unreachable unit, the next probe or movie tries again.
+            pass
+
+    def _receive(self):
+        """Yield the messages waiting on the socket and their sender."""
+        while True:
+            try:
+                data, address = self._socket.recvfrom(MAX_DATAGRAM)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                # Like an ICMP error of a follower that is gone.
+                continue
+            try:
+                message = json.loads(data.decode('utf-8'))
+            except ValueError:
+                continue
+            if isinstance(message, dict):
+                yield message, address
+
+    def close(self):
+        self._socket.close()
+
+
+class SyncLeader(_SyncSocket):
+
+    role = 'leader'
+
+    def __init__(self, port=DEFAULT_PORT, address='', clock=time.monotonic):
+        """Create the leader listening for followers on the UDP port.  Raises
+        OSError if the port can't be used.
+        """
+        super().__init__((address, port), clock)
+        # Address of every follower and when it was heard last.
+        self._followers = {}
+        self._seq = 0
+
+    def remaining(self, at):
+        """Return the seconds until the time at of the leader's clock."""
+        return at - self._clock()
+
+    def timeout(self):
+        """The leader only has to wake up for messages."""
+        return None
+
+    def followers(self):
+        """Return the addresses of the followers heard from recently."""
+        now = self._clock()
+        for address, heard in list(self._followers.items()):
+            if now - heard > PEER_TIMEOUT:
+                del self._followers[address]
+        return list(self._followers)
+
+    def announce(self, index, filename, lead_time):
+        """Send the movie with playlist entry index and file name to all
+        followers, to be started lead_time seconds from now.  Returns the
+        sequence number of the start and its time.
+        """
+        self._seq += 1
+        at = self._clock() + lead_time
+        message = {'type': 'play', 'seq': self._seq, 'index': index, 'file': filename, 'at': at}
+        for address in self.followers():
+            self._send(message, address)
+        return self._seq, at
+
+    def started(self, seq, at):
+        """Return the seconds the leader started the movie after at."""
+        return self._clock() - at
+
+    def handle(self):
+        """Answer the waiting probes and return the started reports of the
+        followers as a list of (address, seq, skew) tuples.
+        """
+        reports = []
+        for message, address in self._receive():
+            t1 = self._clock()
+            kind = message.get('type')
+            if kind == 'probe' and isinstance(message.get('t0'), (int, float)):
+                self._followers[address] = t1
+                self._send({'type': 'probe', 't0': message['t0'], 't1': t1, 't2': self._clock()}, address)
+            elif kind == 'started' and isinstance(message.get('skew'), (int, float)):
+                self._followers[address] = t1
+                reports.append((address, message.get('seq'), message['skew']))
+        return reports
+
+
+class SyncFollower(_SyncSocket):
+
+    role = 'follower'
+
+    def __init__(self, leader, port=DEFAULT_PORT, probe_interval=1.0, clock=time.monotonic,
+                 startup_wait=STARTUP_WAIT):
+        """Create a follower of the leader at host name or address leader and
+        UDP port.  The follower waits up to startup_wait seconds for the
+        first movie of the leader before it plays on its own.
+        """
+        super().__init__(('', 0), clock)
+        self._leader = (leader, port)
+        self._probe_interval = probe_interval
+        self._filter = ClockFilter()
+        self._next_probe = 0.0
+        self._heard = None
+        # Local time (not the clock that estimates the leader's) until the
+        # follower waits for the first movie, None once it arrived.
+        self._wait_until = time.monotonic() + startup_wait
+
+    def offset(self):
+        """Return the estimated seconds to add to the local clock to get the
+        leader's clock, or None if it isn't known yet.
+        """
+        return self._filter.offset()
+
+    def delay(self):
+        """Return the round trip delay to the leader, or None."""
+        return self._filter.delay()
+
+    def leader_time(self):
+        """Return the estimated time of the leader's clock."""
+        return self._clock() + (self._filter.offset() or 0.0)
+
+    def remaining(self, at):
+        """Return the seconds until the time at of the leader's clock."""
+        return at - self.leader_time()
+
+    def following(self):
+        """Return true if the leader answers and its clock is known, that
+        is if movies are started by the leader.
+        """
+        return self._filter.offset() is not None and self._heard is not None \
+            and self._clock() - self._heard <= PEER_TIMEOUT
+
+    def waiting(self):
+        """Return true while the follower was just started and waits for the
+        first movie of the leader.
+        """
+        if self._wait_until is None:
+            return False
+        if time.monotonic() >= self._wait_until:
+            self._wait_until = None
+            return False
+        return True
+
+    def timeout(self):
+        """Return the seconds until the next probe is due or the follower
+        stops waiting for the leader.
+        """
+        timeout = max(0.0, self._next_probe - self._clock())
+        if self._wait_until is not None:
+            timeout = min(timeout, max(0.0, self._wait_until - time.monotonic()))
+        return timeout
+
+    def probe(self):
+        """Send a probe to the leader if one is due."""
+        now = self._clock()
+        if now < self._next_probe:
+            return
+        self._send({'type': 'probe', 't0': now}, self._leader)
+        interval = self._probe_interval if self._filter.full() else FAST_PROBE_INTERVAL
+        self._next_probe = now + interval
+
+    def started(self, seq, at):
+        """Report to the leader how many seconds after at the movie of start
+        seq was started and return them.
+        """
+        skew = self.leader_time() - at
+        self._send({'type': 'started', 'seq': seq, 'skew': skew}, self._leader)
+        return skew
+
+    def handle(self):
+        """Handle the answers to probes and return the play messages of the
+        leader.
+        """
+        plays = []
+        for message, address in self._receive():
+            t3 = self._clock()
+            kind = message.get('type')
+            try:
+                if kind == 'probe':
+                    self._filter.add(float(message['t0']), float(message['t1']), float(message['t2']), t3)
+                    self._heard = t3
+                elif kind == 'play':
+                    plays.append({'seq': int(message['seq']), 'index': message.get('index'),
+                                  'file': str(message['file']), 'at': float(message['at'])})
+                    self._heard = t3
+                    self._wait_until = None
+            except (KeyError, TypeError, ValueError):
+                continue
+        return plays
+
+
+def create_sync(config):
+    """Create the leader or follower configured in the [sync] section of the
+    config, or return None if synchronized playback is off.  Raises ValueError
+    if the configuration is invalid and OSError if the port can't be used.
+    """
+    role = config.get('sync', 'role', fallback='off').lower()
+    port = config.getint('sync', 'port', fallback=DEFAULT_PORT)
+    if role == 'off':
+        return None
+    if role == 'leader':
+        return SyncLeader(port, config.get('sync', 'address', fallback=''))
+    if role == 'follower':
+        leader = config.get('sync', 'leader', fallback='')
+        if not leader:
+            raise ValueError('a follower needs the address of the leader')
+        return SyncFollower(leader, port, config.getfloat('sync', 'probe_interval', fallback=1.0),
+                            startup_wait=config.getfloat('sync', 'startup_wait', fallback=STARTUP_WAIT))
+    raise ValueError('unknown role {0}'.format(role))
@@ -1,7 +1,7 @@
 # Copyright 2019 bitconnect
 # Author: Tobias Perschon
 # License: GNU GPLv2, see LICENSE.txt
-import glob
+import os
 
 from .usb_drive_mounter import USBDriveMounter
 
@@ -17,7 +17,9 @@ class USBDriveReader:
         self._mounter = USBDriveMounter(root=self._mount_path,
                                         readonly=self._readonly)
         self._mounter.start_monitor()
-
+        # Files found on every mounted drive, to know what to remove from the
+        # playlist when a drive is unplugged.
+        self._files = {}
 
     def _load_config(self, config):
         self._mount_path = config.get('usb_drive', 'mount_path')
@@ -28,7 +30,15 @@ class USBDriveReader:
         mounted USB drives.
         """
         self._mounter.mount_all()
-        return glob.glob(self._mount_path + '*')
+        paths = self._mounter.mounted_paths()
+        self._files = dict((path, self._list_files(path)) for path in paths)
+        return paths
+
+    def _list_files(self, path):
+        try:
+            return [os.path.join(path, x) for x in sorted(os.listdir(path))]
+        except OSError:
+            return []
 
     def is_changed(self):
         """Return true if the file search paths have changed, like when a new
@@ -36,6 +46,30 @@ class USBDriveReader:
         """
         return self._mounter.poll_changes()
 
+    def get_changes(self):
+        """Mount added drives and unmount removed ones and return a tuple of
+        lists with the paths of files added and removed.  Drives that stay
+        attached (and the movie playing from them) are not disturbed.
+        """
+        self._mounter.mount_all()
+        paths = self._mounter.mounted_paths()
+        added = []
+        removed = []
+        for path in list(self._files):
+            if path not in paths:
+                removed.extend(self._files.pop(path))
+        for path in paths:
+            if path not in self._files:
+                self._files[path] = self._list_files(path)
+                added.extend(self._files[path])
+        return (added, removed)
+
+    def wakeup_fds(self):
+        """Return a list of file descriptors that become readable when
+        is_changed should be checked, in this case the udev monitor.
+        """
+        return [self._mounter.fileno()]
+
     def idle_message(self):
         """Return a message to display when idle and no files are found."""
         return 'Insert USB drive with compatible movies.'
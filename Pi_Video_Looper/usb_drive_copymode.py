@@ -2,13 +2,70 @@
 # Author: Tobias Perschon
 # License: GNU GPLv2, see LICENSE.txt
 import glob
+import hashlib
 import os
 import shutil
-import re
 import pygame
+import threading
 import time
+from . import fastcopy, metrics
+from .manifest import CopyManifest, file_hash, read_checksums, temp_path, update_digest
 from .usb_drive_mounter import USBDriveMounter
 
+# The copy progress is drawn on the screen, so the video looper has to
+# initialize the display for this reader.
+NEEDS_DISPLAY = True
+# Maximum number of times per second the progress bar is redrawn while copying.
+PROGRESS_FPS = 10
+# How often the main loop is woken up to pick up the progress of a copy that
+# runs in the background.
+BACKGROUND_PROGRESS_INTERVAL = 1.0
+# Hidden directory in the video directory where copies that fail verification
+# are moved to, so they are never played but can still be looked at.
+QUARANTINE_DIR = '.quarantine'
+
+
+class CopyProgress:
+    """Aggregate progress of copying a number of files."""
+
+    def __init__(self, total):
+        """Create a progress tracker for copying total bytes."""
+        self.total = total
+        self.copied = 0
+        self._finished = 0
+        self._start = time.monotonic()
+
+    def update(self, copied):
+        """Set the number of bytes copied of the current file."""
+        self.copied = self._finished + copied
+
+    def file_done(self):
+        """Mark the current file as finished."""
+        self._finished = self.copied
+
+    def percent(self):
+        if self.total <= 0:
+            return 100.0
+        return min(100.0, 100.0 * self.copied / self.total)
+
+    def throughput(self):
+        """Return the average throughput in bytes per second."""
+        elapsed = time.monotonic() - self._start
+        return self.copied / elapsed if elapsed > 0 else 0.0
+
+    def eta(self):
+        """Return the estimated number of seconds left, or None if unknown."""
+        throughput = self.throughput()
+        if throughput <= 0:
+            return None
+        return max(0, self.total - self.copied) / throughput
+
+    def __str__(self):
+        eta = self.eta()
+        return '{0}% - {1:.1f} MB/s - {2}'.format(
+            int(round(self.percent())), self.throughput() / 1e6,
+            '{0}:{1:02d} left'.format(*divmod(int(eta), 60)) if eta is not None else '--:-- left')
+
 
 class USBDriveReaderCopy(object):
 
@@ -19,11 +76,21 @@ class USBDriveReaderCopy(object):
         """
         self._config = config
         self._screen = screen
+        self._progress = None
         self._load_config(config)
         self._pygame_init(config)
         self._mounter = USBDriveMounter(root=self._mount_path,
                                         readonly=self._readonly)
         self._mounter.start_monitor()
+        # State of copies running in the background.  The worker writes to the
+        # pipe to wake up the main loop when there is progress or it is done.
+        self._worker = None
+        self._worker_result = None
+        self._copy_pending = False
+        self._status = None
+        self._notify_r, self._notify_w = os.pipe()
+        os.set_blocking(self._notify_r, False)
+        os.set_blocking(self._notify_w, False)
 
         if not os.path.exists(self._target_path):
             os.makedirs(self._target_path)
@@ -57,17 +124,30 @@ class USBDriveReaderCopy(object):
         self._copy_mode = config.get('copymode', 'mode')
         self._copyloader = config.getboolean('copymode', 'copyloader')
         self._password = config.get('copymode', 'password')
+        self._sync_hash = config.getboolean('copymode', 'sync_hash', fallback=False)
+        self._background = config.getboolean('copymode', 'background', fallback=False)
+        self._verify = config.getboolean('copymode', 'verify', fallback=False)
+        self._checksum_file = config.get('copymode', 'checksum_file', fallback='SHA256SUMS')
+        # Expected sha256 digest of the files of the drives being copied that
+        # are listed in a checksum file, by source path.
+        self._checksums = {}
 
         #needs to be changed to a more generic approach to support other players
-        self._extensions = '|'.join(config.get(self._config.get('video_looper', 'video_player'), 'extensions') \
+        self._extensions = tuple('.' + x.lower() for x in config.get(self._config.get('video_looper', 'video_player'), 'extensions') \
                                  .translate(str.maketrans('','', ' \t\r\n.')) \
-                                 .split(','))
+                                 .split(',') if x)
 
-    def copy_files(self, paths):
-        self.clear_screen()
+    def _is_movie(self, name):
+        """Return true if name is a not hidden file with a supported extension."""
+        return name[0] != '.' and name.lower().endswith(self._extensions)
 
-        copy_mode = self._copy_mode
-        copy_mode_info = "(from config)"
+    def _plan_copy(self, paths, manifest):
+        """Return a list of (copy_mode, copy_mode_info, deletes, files,
+        loader_file_path) tuples describing what to do for every drive.
+        """
+        # Find all files first so progress can be shown for all of them.
+        jobs = []
+        self._checksums = {}
         for path in paths:
             if not os.path.exists(path) or not os.path.isdir(path):
                 continue
@@ -77,44 +157,242 @@ class USBDriveReaderCopy(object):
                 if not self.check_file_exists('{0}/{1}'.format(path.rstrip('/'), self._password)):
                     continue
 
-            #override copymode?
-            if self.check_file_exists('{0}/{1}'.format(path.rstrip('/'), 'replace')):
-                copy_mode = "replace"
-                copy_mode_info = "(overridden)"
-            if self.check_file_exists('{0}/{1}'.format(path.rstrip('/'), 'add')):
-                copy_mode = "add"
+            #override copymode? (only if exactly one override file exists)
+            copy_mode = self._copy_mode
+            copy_mode_info = "(from config)"
+            overrides = [x for x in ('replace', 'add', 'sync')
+                         if self.check_file_exists('{0}/{1}'.format(path.rstrip('/'), x))]
+            if len(overrides) == 1:
+                copy_mode = overrides[0]
                 copy_mode_info = "(overridden)"
-            if self.check_file_exists('{0}/{1}'.format(path.rstrip('/'), 'replace')) \
-                    and self.check_file_exists('{0}/{1}'.format(path.rstrip('/'), 'add')):
-                copy_mode = self._copy_mode
-                copy_mode_info = "(from config)"
 
-            #inform about copymode
-            self.draw_info_text("Mode: " + copy_mode + " " + copy_mode_info)
+            files = ['{0}/{1}'.format(path.rstrip('/'), x) for x in sorted(os.listdir(path)) if self._is_movie(x)]
+            self._load_checksums(path)
+
+            loader_file_path = None
+            if self._copyloader and os.path.exists('{0}/{1}'.format(path.rstrip('/'), 'loader.png')):
+                loader_file_path = '{0}/{1}'.format(path.rstrip('/'), 'loader.png')
 
+            jobs.append((copy_mode, copy_mode_info, files, loader_file_path))
+
+        # Work out what to delete and what to copy.  In sync mode only new or
+        # changed files are copied and only movies that were copied from a
+        # drive before (they are in the manifest) and are on none of the
+        # synced drives anymore are deleted.  Movies added by hand are kept.
+        synced = set(os.path.basename(src) for job in jobs if job[0] == 'sync' for src in job[2])
+        plans = []
+        for copy_mode, copy_mode_info, files, loader_file_path in jobs:
+            deletes = []
             if copy_mode == "replace":
                 # iterate over target path for deleting:
-                for x in os.listdir(self._target_path):
-                    if x[0] is not '.' and re.search('\.{0}$'.format(self._extensions), x, flags=re.IGNORECASE):
-                        os.remove('{0}/{1}'.format(self._target_path.rstrip('/'), x))
+                deletes = [x for x in os.listdir(self._target_path) if self._is_movie(x)]
+            elif copy_mode == "sync":
+                deletes = [x for x in manifest.names() if self._is_movie(x) and x not in synced
+                           and not manifest.get(x).get('partial', False)]
+                files = [src for src in files if not self._is_unchanged(src, manifest)]
+            plans.append((copy_mode, copy_mode_info, deletes, files, loader_file_path))
+        if synced:
+            # Drop interrupted copies of files that are gone from the drives.
+            for name in manifest.names():
+                entry = manifest.get(name)
+                if entry.get('partial', False) and name not in synced:
+                    self._remove_file(temp_path('{0}/{1}'.format(self._target_path.rstrip('/'), name)))
+                    manifest.remove(name)
+
+        total = sum(os.path.getsize(src) for plan in plans for src in plan[3] + [plan[4]] if src is not None)
+        self._progress = CopyProgress(total)
+        self._last_draw = 0
+        return plans
+
+    def _load_checksums(self, path):
+        """Remember the digests of the checksum file on the drive at path, if
+        there is one.
+        """
+        if not self._checksum_file:
+            return
+        try:
+            checksums = read_checksums('{0}/{1}'.format(path.rstrip('/'), self._checksum_file))
+        except OSError:
+            return
+        for name, digest in checksums.items():
+            self._checksums['{0}/{1}'.format(path.rstrip('/'), name)] = digest
+
+    def _check_copy(self, src, st, size, digest):
+        """Return why the copy of src with size bytes and the sha256 hash
+        object digest (None if not hashed) is bad, or None if it's fine.
+        """
+        if size != st.st_size:
+            return 'incomplete copy, {0} of {1} bytes'.format(size, st.st_size)
+        expected = self._checksums.get(src)
+        if expected is not None and digest is not None and digest.hexdigest() != expected:
+            return 'checksum mismatch'
+        return None
+
+    def _quarantine(self, tmp, dst, reason):
+        """Move the bad copy tmp of dst out of the video directory."""
+        metrics.COPY_QUARANTINED.inc()
+        quarantine = '{0}/{1}'.format(self._target_path.rstrip('/'), QUARANTINE_DIR)
+        try:
+            os.makedirs(quarantine, exist_ok=True)
+            os.replace(tmp, '{0}/{1}'.format(quarantine, os.path.basename(dst)))
+        except OSError:
+            # Like the loader image on another file system.
+            self._remove_file(tmp)
+        self._show_status('Quarantined {0}: {1}'.format(os.path.basename(dst), reason))
+
+    def _in_worker(self):
+        """Return true if called from the background copy thread."""
+        return self._worker is not None and threading.current_thread() is self._worker
+
+    def _show_status(self, message):
+        """Show a message about the copy: on the screen while copying in the
+        foreground, otherwise as status message for the main loop.
+        """
+        if self._in_worker():
+            self._status = message
+            self._notify()
+        else:
+            self.draw_info_text(message)
+
+    def copy_files(self, paths):
+        self.clear_screen()
+
+        manifest = CopyManifest(self._target_path)
+        plans = self._plan_copy(paths, manifest)
+
+        for copy_mode, copy_mode_info, deletes, files, loader_file_path in plans:
+            #inform about copymode
+            self.draw_info_text("Mode: " + copy_mode + " " + copy_mode_info)
+
+            for x in deletes:
+                self._remove_file('{0}/{1}'.format(self._target_path.rstrip('/'), x))
+                manifest.remove(x)
+            manifest.save()
 
             # iterate over source path for copying:
-            for x in os.listdir(path):
-                if x[0] is not '.' and re.search('\.{0}$'.format(self._extensions), x, flags=re.IGNORECASE):
-                    #copy file
-                    self.copy_with_progress('{0}/{1}'.format(path.rstrip('/'), x), '{0}/{1}'.format(self._target_path.rstrip('/'), x))
+            for src in files:
+                self.copy_with_progress(src, '{0}/{1}'.format(self._target_path.rstrip('/'), os.path.basename(src)), manifest=manifest)
 
             #copy loader image
-            if self._copyloader:
-                loader_file_path = '{0}/{1}'.format(path.rstrip('/'), 'loader.png')
-                if os.path.exists(loader_file_path):
-                    self.clear_screen()
-                    self.draw_info_text("Copying splashscreen file...")
-                    time.sleep(2)
-                    self.copy_with_progress(loader_file_path,'/home/pi/loader.png')
+            if loader_file_path is not None:
+                self.clear_screen()
+                self.draw_info_text("Copying splashscreen file...")
+                time.sleep(2)
+                self.copy_with_progress(loader_file_path,'/home/pi/loader.png')
+
+        self._progress = None
+
+    def _copy_files_background(self, paths):
+        """Copy files in a worker thread while the current playlist keeps
+        playing.  Everything is copied to temporary files first, only once all
+        copies are complete and verified the deletes and renames are done in
+        one go.  The paths that were added and removed are stored as the
+        result for get_changes.
+        """
+        added = []
+        removed = []
+        try:
+            manifest = CopyManifest(self._target_path)
+            plans = self._plan_copy(paths, manifest)
+            copied = []
+            for copy_mode, copy_mode_info, deletes, files, loader_file_path in plans:
+                self._status = 'Copying files in background, mode: ' + copy_mode + ' ' + copy_mode_info
+                for src in files:
+                    dst = '{0}/{1}'.format(self._target_path.rstrip('/'), os.path.basename(src))
+                    tmp, digest = self.copyfile(src, dst, manifest=manifest, commit=False)
+                    # Copies that failed verification are quarantined already.
+                    if tmp is not None:
+                        copied.append((src, dst, tmp, digest))
+                if loader_file_path is not None:
+                    self.copyfile(loader_file_path, '/home/pi/loader.png')
+            for copy_mode, copy_mode_info, deletes, files, loader_file_path in plans:
+                for x in deletes:
+                    path = '{0}/{1}'.format(self._target_path.rstrip('/'), x)
+                    self._remove_file(path)
+                    manifest.remove(x)
+                    removed.append(path)
+            for src, dst, tmp, digest in copied:
+                os.replace(tmp, dst)
+                if digest is None and self._sync_hash:
+                    digest = file_hash(src)
+                manifest.set_done(os.path.basename(dst), os.stat(src), digest)
+                added.append(dst)
+            manifest.save()
+            self._status = 'Copy finished: {0} added, {1} removed'.format(len(added), len(removed))
+            self._worker_result = (added, removed)
+        except OSError as e:
+            # Most likely the drive was removed, the temporary files are kept
+            # so a sync copy can be resumed.
+            self._status = 'Copy failed: {0}'.format(e)
+        finally:
+            self._progress = None
+            self._notify()
+
+    def _notify(self):
+        """Wake up the main loop from the copy worker."""
+        try:
+            os.write(self._notify_w, b'x')
+        except BlockingIOError:
+            pass
+
+    def _start_copy(self):
+        """Mount all drives and start copying in the background unless a copy
+        is already running.
+        """
+        if self._worker is not None:
+            return
+        self._mounter.mount_all()
+        self._worker = threading.Thread(target=self._copy_files_background,
+                                        args=(self._mounter.mounted_paths(),),
+                                        daemon=True)
+        self._worker.start()
+
+    def _is_unchanged(self, src, manifest):
+        """Return true if the copy of src in the target directory is up to
+        date according to the manifest.
+        """
+        name = os.path.basename(src)
+        st = os.stat(src)
+        try:
+            if os.path.getsize('{0}/{1}'.format(self._target_path.rstrip('/'), name)) != st.st_size:
+                return False
+        except OSError:
+            return False
+        if manifest.matches(name, st):
+            return True
+        # Size or modification time differ, if there is a hash the content
+        # might still be the same (e.g. the file was only touched).
+        entry = manifest.get(name)
+        if self._sync_hash and entry is not None and 'sha256' in entry \
+                and not entry.get('partial', False) and file_hash(src) == entry['sha256']:
+            manifest.set_done(name, st, entry['sha256'])
+            return True
+        return False
+
+    def _remove_file(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _on_copy_progress(self, copied):
+        """Update the copy progress and redraw the progress bar at most
+        PROGRESS_FPS times per second.
+        """
+        self._progress.update(copied)
+        now = time.monotonic()
+        if self._in_worker():
+            # Never draw from the worker thread, just let the main loop know.
+            if now - self._last_draw >= BACKGROUND_PROGRESS_INTERVAL:
+                self._last_draw = now
+                self._status = 'Copying: {0}'.format(self._progress)
+                self._notify()
+        elif now - self._last_draw >= 1.0 / PROGRESS_FPS:
+            self._last_draw = now
+            self.draw_copy_progress(self._progress.copied, self._progress.total)
 
     def draw_copy_progress(self, copied, total):
-        perc = 100 * copied / total
+        perc = min(100., 100 * copied / total) if total > 0 else 100.
         assert (isinstance(perc, float))
         assert (0. <= perc <= 100.)
 
@@ -129,7 +407,10 @@ class USBDriveReaderCopy(object):
         #progress
         pygame.draw.rect(self._screen, self._fgcolor, progressrect)
         #progress_text
-        self.draw_progress_text(str(int(round(perc)))+"%")
+        if self._progress is not None:
+            self.draw_progress_text(str(self._progress))
+        else:
+            self.draw_progress_text(str(int(round(perc)))+"%")
 
         pygame.display.update(self.borderrect)
 
@@ -156,12 +437,25 @@ class USBDriveReaderCopy(object):
     def check_file_exists(self,file):
         return (glob.glob(file + ".*") + glob.glob(file)) != []
 
-    def copyfile(self, src, dst, *, follow_symlinks=True):
+    def copyfile(self, src, dst, *, follow_symlinks=True, manifest=None, commit=True):
         """Copy data from src to dst.
 
         If follow_symlinks is not set and src is a symbolic link, a new
         symlink will be created instead of copying the file it points to.
 
+        The data is written to a hidden temporary file which is renamed to dst
+        when complete.  If a manifest is provided the copy is recorded in it
+        and an interrupted copy of the same source is resumed.  If commit is
+        false the temporary file is left in place and a tuple of its path and
+        the hex sha256 digest of the content (None if not hashed) is returned.
+
+        The content is hashed while it is copied if verify is set, the drive
+        has a checksum file listing src or the manifest needs the hash for
+        sync_hash, otherwise the data is copied inside the kernel.  A copy that is incomplete or
+        doesn't match the checksum file is moved to the quarantine directory
+        and None is returned instead of dst (or the path of the temporary
+        file).
+
         """
         if shutil._samefile(src, dst):
             raise shutil.SameFileError("{!r} and {!r} are the same file".format(src, dst))
@@ -180,40 +474,77 @@ class USBDriveReaderCopy(object):
         if not follow_symlinks and os.path.islink(src):
             os.symlink(os.readlink(src), dst)
         else:
-            size = os.stat(src).st_size
+            st = os.stat(src)
+            name = os.path.basename(dst)
+            tmp = temp_path(dst)
+            resume = manifest is not None and manifest.can_resume(name, st) \
+                and os.path.exists(tmp) and os.path.getsize(tmp) <= st.st_size
+            if manifest is not None and not resume:
+                manifest.set_partial(name, st)
+                manifest.save()
+            # Hash in the same pass as the copy, reading the files again
+            # afterwards would take as long as the copy itself.
+            hashed = self._verify or src in self._checksums or (manifest is not None and self._sync_hash)
+            digest = hashlib.sha256() if hashed else None
+            start = time.monotonic()
             with open(src, 'rb') as fsrc:
-                with open(dst, 'wb') as fdst:
-                    self.copyfileobj(fsrc, fdst, callback=self.draw_copy_progress, total=size)
+                with open(tmp, 'r+b' if resume else 'wb') as fdst:
+                    if digest is not None and resume:
+                        # The part copied before the copy was interrupted.
+                        update_digest(digest, fdst)
+                    offset = fdst.seek(0, os.SEEK_END)
+                    fsrc.seek(offset)
+                    fastcopy.copyfileobj(fsrc, fdst, callback=lambda copied: self._on_copy_progress(offset + copied) if self._progress is not None else None,
+                                         digest=digest)
+                    fdst.flush()
+                    os.fsync(fdst.fileno())
+                    size = fdst.tell()
+                    metrics.COPY_BYTES.inc(size - offset)
+            metrics.COPY_SECONDS.inc(time.monotonic() - start)
+            metrics.COPY_FILES.inc()
+            if self._progress is not None:
+                self._progress.file_done()
+            reason = self._check_copy(src, st, size, digest)
+            if reason is not None:
+                self._quarantine(tmp, dst, reason)
+                if manifest is not None:
+                    manifest.remove(name)
+                    manifest.save()
+                if not commit:
+                    return None, None
+                return None
+            os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns))
+            hexdigest = digest.hexdigest() if digest is not None else None
+            if not commit:
+                return tmp, hexdigest
+            os.replace(tmp, dst)
+            if manifest is not None:
+                if hexdigest is None and self._sync_hash:
+                    hexdigest = file_hash(src)
+                manifest.set_done(name, st, hexdigest)
+                manifest.save()
+            if self._progress is not None and \
+                    (self._worker is None or threading.current_thread() is not self._worker):
+                self.draw_copy_progress(self._progress.copied, self._progress.total)
         return dst
 
-    def copyfileobj(self, fsrc, fdst, callback, total, length=16 * 1024):
-        copied = 0
-        while True:
-            buf = fsrc.read(length)
-            if not buf:
-                break
-            fdst.write(buf)
-            copied += len(buf)
-            callback(copied, total=total)
-
-    def copy_with_progress(self, src, dst, *, follow_symlinks=True):
+    def copy_with_progress(self, src, dst, *, follow_symlinks=True, manifest=None):
         if os.path.isdir(dst):
             dst = os.path.join(dst, os.path.basename(src))
 
-        # clear screen before copying
-        self.clear_screen(False)
-
-        self.copyfile(src, dst, follow_symlinks=follow_symlinks)
         # shutil.copymode(src, dst)
-        return dst
+        return self.copyfile(src, dst, follow_symlinks=follow_symlinks, manifest=manifest)
 
     def search_paths(self):
         """Return a list of paths to search for files. Will return a list of all
         mounted USB drives.
         """
         if(self._mounter.has_nodes()):
-            self._mounter.mount_all()
-            self.copy_files(glob.glob(self._mount_path + '*'))
+            if self._background:
+                self._start_copy()
+            else:
+                self._mounter.mount_all()
+                self.copy_files(self._mounter.mounted_paths())
 
         return [self._target_path]
 
@@ -221,11 +552,53 @@ class USBDriveReaderCopy(object):
         """Return true if the file search paths have changed, like when a new
         USB drive is inserted.
         """
+        if self._background:
+            try:
+                while os.read(self._notify_r, 512):
+                    pass
+            except BlockingIOError:
+                pass
+            if self._worker is not None and not self._worker.is_alive():
+                self._worker.join()
+                self._worker = None
+                if self._worker_result is not None:
+                    return True
         if self._mounter.poll_changes() and self._mounter.has_nodes():
+            if self._background:
+                self._copy_pending = True
             return True
         else:
             return False
 
+    def get_changes(self):
+        """Return a tuple of lists with the paths of files added and removed by
+        a finished background copy, or None if the playlist has to be built
+        again completely.
+        """
+        if not self._background:
+            return None
+        changes = ([], [])
+        if self._worker_result is not None:
+            changes = self._worker_result
+            self._worker_result = None
+        if self._copy_pending and self._worker is None:
+            # Keep playing while the new files are copied.
+            self._copy_pending = False
+            self._start_copy()
+        return changes
+
+    def status_message(self):
+        """Return a message about a running or finished background copy, or
+        None.
+        """
+        return self._status
+
+    def wakeup_fds(self):
+        """Return a list of file descriptors that become readable when
+        is_changed should be checked, in this case the udev monitor.
+        """
+        return [self._mounter.fileno(), self._notify_r]
+
     def idle_message(self):
         """Return a message to display when idle and no files are found."""
         return 'Insert USB drive with compatible movies. Copy Mode: files will be copied to RPi.'
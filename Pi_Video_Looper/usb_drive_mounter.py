@@ -2,8 +2,9 @@
 # Author: Tobias Perschon
 # License: GNU GPLv2, see LICENSE.txt
 import glob
+import os
+import select
 import subprocess
-import time
 
 import pyudev
 
@@ -11,67 +12,158 @@ import pyudev
 class USBDriveMounter:
     """Service for automatically mounting attached USB drives."""
 
-    def __init__(self, root='/mnt/usbdrive', readonly=True):
+    def __init__(self, root='/mnt/usbdrive', readonly=True, runner=subprocess.check_call):
         """Create an instance of the USB drive mounter service.  Root is an
         optional parameter which specifies the location and file name prefix for
         mounted drives (a number will be appended to each mounted drive file
         name).  Readonly is a boolean that indicates if the drives should be
-        mounted as read-only or not (default false, writable).
+        mounted as read-only or not (default false, writable).  Runner is the
+        function used to run mount and umount, it is called with the argument
+        list and must raise an exception if the command fails.
         """
         self._root = root
         self._readonly = readonly
+        self._runner = runner
         self._context = pyudev.Context()
+        # Mounted drives by filesystem UUID (or device node if there is no
+        # UUID) and the mount point number used for every UUID, so a drive
+        # gets the same mount point again when it is plugged in again.
+        self._mounted = {}
+        self._numbers = {}
+        self._cleaned = False
+        # Attached USB drive partitions, seeded when the monitor is started and
+        # then kept up to date from monitor events.
+        self._drives = None
+
+    def _run(self, args):
+        """Run a command with the runner, returns false if it failed."""
+        try:
+            self._runner(args)
+            return True
+        except (subprocess.CalledProcessError, OSError):
+            return False
 
     def remove_all(self):
         """Unmount and remove mount points for all mounted drives."""
         for path in glob.glob(self._root + '*'):
-            subprocess.call(['umount', '-l', path])
-            subprocess.call(['rm', '-r', path])
+            self._run(['umount', '-l', path])
+            self._remove_mount_point(path)
+        self._mounted.clear()
+
+    def _remove_mount_point(self, path):
+        # Only remove empty directories, never the content of a drive that
+        # could not be unmounted.
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
+
+    def _list_drives(self):
+        """Return a dict of USB drive partitions keyed by filesystem UUID (or
+        device node) with the device node as value.
+        """
+        if self._drives is not None:
+            return dict(self._drives)
+        drives = {}
+        for device in self._context.list_devices(subsystem='block', DEVTYPE='partition'):
+            if device.get('ID_BUS') == 'usb':
+                drives[device.get('ID_FS_UUID') or device.device_node] = device.device_node
+        return drives
+
+    def _mount_point(self, key):
+        """Return the mount point for a drive.  A drive keeps its number as
+        long as it isn't taken by another drive.
+        """
+        used = set(self._numbers[x] for x in self._mounted)
+        number = self._numbers.get(key)
+        if number is None or number in used:
+            number = 0
+            while number in used:
+                number += 1
+            self._numbers[key] = number
+        return self._root + str(number)
+
+    def _mount(self, key, node):
+        path = self._mount_point(key)
+        os.makedirs(path, exist_ok=True)
+        args = ['mount']
+        if self._readonly:
+            args.append('-r')
+        args.extend([node, path])
+        if self._run(args):
+            self._mounted[key] = (node, path)
+        else:
+            self._remove_mount_point(path)
+
+    def _unmount(self, key):
+        node, path = self._mounted.pop(key)
+        self._run(['umount', '-l', path])
+        self._remove_mount_point(path)
 
     def mount_all(self):
-        """Mount all attached USB drives.  Readonly is a boolean that specifies
-        if the drives should be mounted read only (defaults to true).
+        """Mount all attached USB drives.  Only drives that were added since the
+        last call are mounted and only drives that were removed are unmounted,
+        drives that stay attached are not touched.  Returns the list of device
+        nodes of all attached drives.
         """
-        self.remove_all()
-        # Enumerate USB drive partitions by path like /dev/sda1, etc.
-        nodes = [x.device_node for x in self._context.list_devices(subsystem='block', 
-                                                                   DEVTYPE='partition')
-                 if 'ID_BUS' in x and x['ID_BUS'] == 'usb']
-        # Mount each drive under the mount root.
-        for i, node in enumerate(nodes):
-            path = self._root + str(i)
-            subprocess.call(['mkdir', path])
-            args = ['mount']
-            if self._readonly:
-                args.append('-r')
-            args.extend([node, path])
-            subprocess.check_call(args)
-
-        return nodes
+        if not self._cleaned:
+            # Get rid of mounts left behind by an earlier run.
+            self.remove_all()
+            self._cleaned = True
+        drives = self._list_drives()
+        for key in list(self._mounted):
+            if drives.get(key) != self._mounted[key][0]:
+                self._unmount(key)
+        for key, node in sorted(drives.items(), key=lambda x: x[1]):
+            if key not in self._mounted:
+                self._mount(key, node)
+
+        return list(drives.values())
+
+    def mounted_paths(self):
+        """Return the list of mount points of all mounted drives."""
+        return sorted(path for node, path in self._mounted.values())
 
     def has_nodes(self):
-        nodes = [x.device_node for x in self._context.list_devices(subsystem='block',
-                                                                   DEVTYPE='partition')
-                 if 'ID_BUS' in x and x['ID_BUS'] == 'usb']
-        return nodes != []
+        """Return true if at least one USB drive partition is attached."""
+        if self._drives is not None:
+            return len(self._drives) > 0
+        return len(self._list_drives()) > 0
 
     def start_monitor(self):
         """Initialize monitoring of USB drive changes."""
         self._monitor = pyudev.Monitor.from_netlink(self._context)
         self._monitor.filter_by('block', 'partition')
         self._monitor.start()
+        # Enumerate once after the monitor is started, so no event is missed.
+        # From now on the monitor events keep the set of drives up to date.
+        self._drives = None
+        self._drives = self._list_drives()
+
+    def fileno(self):
+        """Return the file descriptor of the udev monitor.  It becomes
+        readable when a drive change is waiting to be picked up by
+        poll_changes.
+        """
+        return self._monitor.fileno()
 
     def poll_changes(self):
-        """Check for changes to USB drives.  Returns true if there was a USB 
+        """Check for changes to USB drives.  Returns true if there was a USB
         drive change, otherwise false.
         """
         # Look for a drive change.
         device = self._monitor.poll(0)
-        # If a USB drive changed (added/remove) remount all drives.
-        if device is not None and device['ID_BUS'] == 'usb':
-            return True
-        # Else nothing changed.
-        return False
+        # Ignore everything but USB drives (ID_BUS is missing for some
+        # devices like SD cards or loop devices).
+        if device is None or device.get('ID_BUS') != 'usb':
+            return False
+        # Update the set of attached drives.
+        node = device.device_node
+        for key in [x for x in self._drives if self._drives[x] == node]:
+            del self._drives[key]
+        if device.action != 'remove':
+            self._drives[device.get('ID_FS_UUID') or node] = node
+        return True
 
 
 if __name__ == '__main__':
@@ -82,7 +174,8 @@ if __name__ == '__main__':
     drive_mounter.start_monitor()
     print ('Listening for USB drive changes (press Ctrl-C to quit)...')
     while True:
+        # Block until the monitor has an event instead of spinning.
+        select.select([drive_mounter.fileno()], [], [])
         if drive_mounter.poll_changes():
             print ('USB drives changed!')
             drive_mounter.mount_all()
-        time.sleep(0)
@@ -3,15 +3,27 @@
 # License: GNU GPLv2, see LICENSE.txt
 
 import configparser
+import fnmatch
+import glob
 import importlib
+import math
 import os
 import re
+import selectors
 import sys
 import signal
 import time
-import pygame
 
-from .model import Playlist, Movie
+from . import metrics
+from .headless import HeadlessRenderer
+from .metadata import MetadataIndex
+from .model import Playlist
+from .output import DEFAULT_OUTPUT, Output, output_config, output_names
+from .picker import create_picker
+from .prefetch import create_prefetcher
+from .playlist_file import read_playlist_file
+from .schedule import Schedule, parse_window, read_schedule_file
+from .scanner import BackgroundScan, MovieScanner, weight_from_name
 
 # Basic video looper architecure:
 #
@@ -36,6 +48,37 @@ from .model import Playlist, Movie
 # - Future file readers and video players can be provided and referenced in the
 #   config to extend the video player use to read from different file sources
 #   or use different video players.
+#
+# - The main loop does not poll.  It blocks in a selector on a wakeup pipe that
+#   receives signals (including SIGCHLD when the player process exits) and on
+#   the file descriptors a file reader returns from its optional wakeup_fds
+#   function.  Readers without wakeup_fds are polled periodically.
+#
+# - The looper can drive several outputs (see output.py), each with its own
+#   player, playlist and playback state.  They share the file reader, the movie
+#   scanner, the metadata index and the display, and the main loop steps all of
+#   them every time it wakes up.
+
+# SDL does not expose a file descriptor for its event queue, so with keyboard
+# control the main loop watches the input devices SDL reads the keys from and
+# pumps the pygame events when one of them becomes readable.  For a while after
+# that (the X server may pass keys on a bit later) and if no input device can be
+# opened the events are pumped every KEYBOARD_POLL_INTERVAL.  New devices are
+# looked for every KEYBOARD_RESCAN_INTERVAL.
+KEYBOARD_DEVICES = '/dev/input/event*'
+KEYBOARD_POLL_INTERVAL = 0.002
+KEYBOARD_ACTIVE_TIME = 0.1
+KEYBOARD_RESCAN_INTERVAL = 1.0
+# How often a file reader without a wakeup_fds function is asked is_changed.
+READER_POLL_INTERVAL = 0.1
+# Seconds before the start of a synchronized movie in which the main loop
+# sleeps instead of waiting in the selector, whose timeout is less exact.
+SYNC_SPIN_TIME = 0.005
+# Font sizes of the on screen display.
+SMALL_FONT_SIZE = 50
+BIG_FONT_SIZE = 250
+
+
 class VideoLooper:
 
     def __init__(self, config_path):
@@ -49,12 +92,17 @@ class VideoLooper:
         self._console_output = self._config.getboolean('video_looper', 'console_output')
         # Load other configuration values.
         self._osd = self._config.getboolean('video_looper', 'osd')
-        self._is_random = self._config.getboolean('video_looper', 'is_random')
+        # Weights of the weighted random mode, shared by all outputs.
+        self._weights_file = self._config.get('video_looper', 'weights_file', fallback='')
+        self._weights = []
         self._keyboard_control = self._config.getboolean('video_looper', 'keyboard_control')
         # Get seconds for countdown from config
         self._countdown_time = self._config.getint('video_looper', 'countdown_time')
-        # Get seconds for waittime bewteen files from config
-        self._wait_time = self._config.getint('video_looper', 'wait_time')
+        # Index of movie metadata, files that can't be played are skipped.
+        self._metadata = MetadataIndex(
+            self._config.get('video_looper', 'metadata_index', fallback='/var/cache/video_looper/metadata.json'),
+            probe=self._config.getboolean('video_looper', 'metadata_probe', fallback=False))
+        self._skip_unplayable = self._config.getboolean('video_looper', 'skip_unplayable', fallback=True)
         # Parse string of 3 comma separated values like "255, 255, 255" into
         # list of ints for colors.
         self._bgcolor = list(map(int, self._config.get('video_looper', 'bgcolor')
@@ -63,54 +111,276 @@ class VideoLooper:
         self._fgcolor = list(map(int, self._config.get('video_looper', 'fgcolor')
                                              .translate(str.maketrans('','', ','))
                                              .split()))
-        # Initialize pygame and display a blank screen.
-        pygame.display.init()
-        pygame.font.init()
-        pygame.mouse.set_visible(False)
-        self._screen = pygame.display.set_mode((0,0), pygame.FULLSCREEN | pygame.NOFRAME)
-        self._size = (pygame.display.Info().current_w, pygame.display.Info().current_h)
-        self._bgimage = self._load_bgimage()
+        # Initialize the display (if anything needs it) and display a blank
+        # screen.
+        reader_module = self._import_file_reader()
+        self._screen = None
+        self._renderer = HeadlessRenderer()
+        if self._needs_display(reader_module):
+            self._init_display()
         self._blank_screen()
-        # Load configured video player and file reader modules.
-        self._player = self._load_player()
-        self._reader = self._load_file_reader()
+        # Create the outputs with their video players and load the configured
+        # file reader module.  The reader, scanner and metadata index are
+        # shared by all outputs.
+        self._outputs = self._create_outputs()
+        self._reader = reader_module.create_file_reader(self._config, self._screen)
         # Load sound volume file name value
         self._sound_vol_file = self._config.get('omxplayer', 'sound_vol_file')
         # default value to 0 millibels (omxplayer)
         self._sound_vol = 0
+        # Load the time of day schedule from the ini file.  A schedule file
+        # next to the movies replaces it while it exists.
+        self._ini_schedule = None
+        self._schedule_file = ''
+        if self._config.has_section('schedule'):
+            self._schedule_file = self._config.get('schedule', 'file', fallback='')
+            windows = []
+            for name, spec in self._config.items('schedule'):
+                if name == 'file':
+                    continue
+                # Like a broken schedule file a broken window is left out.
+                try:
+                    parse_window(spec)
+                except ValueError as e:
+                    self._print('Ignoring schedule window {0}: {1}'.format(name, e))
+                    continue
+                windows.append((name, spec))
+            if windows:
+                self._ini_schedule = Schedule(windows)
+        self._schedule = self._ini_schedule
         # Set other static internal state.
-        self._extensions = '|'.join(self._player.supported_extensions())
-        self._small_font = pygame.font.Font(None, 50)
-        self._big_font   = pygame.font.Font(None, 250)
+        extensions = []
+        for output in self._outputs:
+            extensions += [x for x in output.player.supported_extensions() if x not in extensions]
+        self._scanner = MovieScanner(extensions)
+        # Search the directories in them too, in the background while the
+        # movies found first are already playing.
+        self._recursive_scan = self._config.getboolean('video_looper', 'recursive_scan', fallback=False)
+        self._scan = None
         self._running    = True
-        #used for not waiting the first time
-        self._firstStart = True
+        # Set up the wakeup pipe and selector the main loop blocks on.
+        self._init_event_loop()
+        # Export the metrics over HTTP or to a stats file if enabled.
+        self._exporters = metrics.start_exporters(self._config, self._print)
+        # Accept commands on the control socket if enabled.
+        self._control = self._start_control_server()
+        # Start movies together with other video loopers if enabled.
+        self._sync_lead_time = self._config.getfloat('sync', 'lead_time', fallback=0.5)
+        self._sync = self._start_sync()
+        # Load the upcoming movies into the page cache while playing.
+        self._prefetcher = create_prefetcher(self._config)
+        self._prefetch_lookahead = self._config.getint('video_looper', 'prefetch_lookahead', fallback=1)
+
+    def _create_outputs(self):
+        """Create the configured outputs, or a single output configured by
+        the [video_looper] section if there are none.
+        """
+        try:
+            names = output_names(self._config)
+        except ValueError as e:
+            raise RuntimeError('Invalid outputs configuration: {0}'.format(e))
+        if names is None:
+            return [self._create_output(DEFAULT_OUTPUT, self._config)]
+        # The first output plays the movies of the scanner, the others play
+        # copies with their own playcounts.
+        return [self._create_output(x, output_config(self._config, x), shared_movies=i == 0)
+                for i, x in enumerate(names)]
+
+    def _create_output(self, name, config, shared_movies=True):
+        """Create an output with the player and the random picker of its
+        configuration.
+        """
+        picker = None
+        if config.getboolean('video_looper', 'is_random'):
+            # How movies are picked in random order.  The picker is kept
+            # across playlist rebuilds.
+            picker = create_picker(config.get('video_looper', 'random_mode', fallback='uniform'),
+                                   config.get('video_looper', 'random_seed', fallback='') or None,
+                                   self._movie_weight)
+        return Output(name, config, self._load_player(config), picker, shared_movies)
+
+    def _init_event_loop(self):
+        """Create the selector used by the main loop and register the wakeup
+        pipe and any file descriptors provided by the file reader.
+        """
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        # Every signal with a python handler writes a byte to the wakeup pipe,
+        # this is how TERM/INT and the exit of the player process (SIGCHLD)
+        # interrupt the blocking wait.
+        signal.set_wakeup_fd(self._wakeup_w)
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        self._reader_polled = not hasattr(self._reader, 'wakeup_fds')
+        if not self._reader_polled:
+            for fd in self._reader.wakeup_fds():
+                self._selector.register(fd, selectors.EVENT_READ)
+        # Players that keep running between movies (like mpv) can't wake up
+        # the loop with SIGCHLD when a movie ends.
+        for output in self._outputs:
+            if hasattr(output.player, 'wakeup_fds'):
+                for fd in output.player.wakeup_fds():
+                    self._selector.register(fd, selectors.EVENT_READ)
+        # File descriptors of the watched input devices by path, the time
+        # (monotonic) until which the keyboard counts as in use and when the
+        # devices were looked for last.
+        self._keyboards = {}
+        self._keyboard_until = 0
+        self._keyboards_checked = None
+        if self._keyboard_control:
+            self._watch_keyboards()
+        # Counters to measure how often the main loop wakes up and how much
+        # cpu time it uses while doing so.
+        self._wakeups = 0
+        self._loop_start = time.monotonic()
+        self._cpu_start = time.process_time()
+
+    def _start_control_server(self):
+        """Start the control server if a socket is configured and register it
+        with the selector.  Returns None if there is no control server.
+        """
+        path = self._config.get('control', 'socket', fallback='')
+        if not path:
+            return None
+        from .control import ControlServer
+        try:
+            server = ControlServer(path)
+        except OSError as e:
+            self._print('Failed to start control server on {0}: {1}'.format(path, e))
+            return None
+        self._selector.register(server.fileno(), selectors.EVENT_READ)
+        return server
+
+    def _watch_keyboards(self):
+        """Register the input devices that aren't watched yet with the
+        selector, so a key press wakes up the main loop.  Every reader of an
+        input device gets all events, SDL still sees the keys.
+        """
+        for path in glob.glob(KEYBOARD_DEVICES):
+            if path in self._keyboards:
+                continue
+            try:
+                fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+            except OSError:
+                continue
+            self._keyboards[path] = fd
+            self._selector.register(fd, selectors.EVENT_READ, path)
+        self._keyboards_checked = time.monotonic()
+
+    def _read_keyboard(self, path):
+        """Drain the events of a watched input device, it is closed if it
+        was unplugged.
+        """
+        fd = self._keyboards[path]
+        try:
+            while os.read(fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        except OSError:
+            self._selector.unregister(fd)
+            os.close(fd)
+            del self._keyboards[path]
+        self._keyboard_until = time.monotonic() + KEYBOARD_ACTIVE_TIME
+
+    def _wait_for_events(self):
+        """Block until a signal arrives, a file reader descriptor or input
+        device becomes readable or the keyboard/reader poll interval has
+        passed.
+        """
+        timeouts = []
+        if self._keyboard_control:
+            if not self._keyboards or time.monotonic() < self._keyboard_until:
+                timeouts.append(KEYBOARD_POLL_INTERVAL)
+            else:
+                timeouts.append(max(0.0, self._keyboards_checked + KEYBOARD_RESCAN_INTERVAL - time.monotonic()))
+        if self._reader_polled:
+            timeouts.append(READER_POLL_INTERVAL)
+        elif hasattr(self._reader, 'wakeup_timeout'):
+            timeouts.append(self._reader.wakeup_timeout())
+        # Wake up when the active schedule windows change.
+        if self._schedule is not None:
+            timeouts.append(self._schedule.seconds_until_change())
+        # Wake up when an output is done waiting between movies.
+        now = time.monotonic()
+        timeouts += [max(0.0, x.wait_until - now) for x in self._outputs if x.wait_until is not None]
+        # Wake up when an output prepares the next movie for gapless playback.
+        timeouts += [max(0.0, x.prepare_at - now) for x in self._outputs
+                     if x.prepare_at is not None and x.upcoming is not None and not x.paused]
+        # Wake up for probes of the sync leader and synchronized starts.
+        if self._sync is not None:
+            timeouts.append(self._sync.timeout())
+            timeouts += [max(0.0, self._sync.remaining(x.sync_start[2]) - SYNC_SPIN_TIME)
+                         for x in self._outputs if x.sync_start is not None]
+        timeouts = [x for x in timeouts if x is not None]
+        timeout = min(timeouts) if timeouts else None
+        for key, mask in self._selector.select(timeout):
+            if key.fd == self._wakeup_r:
+                # Drain the pipe, the signal handlers did the actual work.
+                try:
+                    while os.read(self._wakeup_r, 512):
+                        pass
+                except BlockingIOError:
+                    pass
+            elif key.data is not None and self._keyboards.get(key.data) == key.fd:
+                self._read_keyboard(key.data)
+        self._wakeups += 1
+        metrics.LOOP_WAKEUPS.inc()
+
+    def _print_loop_stats(self):
+        """Print how many times the main loop woke up and the cpu it used."""
+        elapsed = time.monotonic() - self._loop_start
+        cpu = time.process_time() - self._cpu_start
+        self._print('Main loop: {0} wakeups, {1:.2f}s cpu in {2:.0f}s ({3:.2f}% cpu)'.format(
+            self._wakeups, cpu, elapsed, 100 * cpu / elapsed if elapsed > 0 else 0))
 
     def _print(self, message):
         """Print message to standard output if console output is enabled."""
         if self._console_output:
             print(message)
 
-    def _load_player(self):
-        """Load the configured video player and return an instance of it."""
-        module = self._config.get('video_looper', 'video_player')
-        return importlib.import_module('.' + module, 'Pi_Video_Looper').create_player(self._config)
+    def _load_player(self, config):
+        """Load the video player of config and return an instance of it."""
+        module = config.get('video_looper', 'video_player')
+        return importlib.import_module('.' + module, 'Pi_Video_Looper').create_player(config)
 
-    def _load_file_reader(self):
-        """Load the configured file reader and return an instance of it."""
+    def _import_file_reader(self):
+        """Import the configured file reader module and return it."""
         module = self._config.get('video_looper', 'file_reader')
-        return importlib.import_module('.' + module, 'Pi_Video_Looper').create_file_reader(self._config, self._screen)
+        return importlib.import_module('.' + module, 'Pi_Video_Looper')
+
+    def _needs_display(self, reader_module):
+        """Return true if pygame and the display have to be initialized: for
+        the on screen display, a background image, keyboard control or a file
+        reader that draws on the screen (like the copy progress of copymode).
+        """
+        if self._config.get('video_looper', 'display', fallback='auto').lower() == 'always':
+            return True
+        return self._osd or self._keyboard_control or bool(self._bgimage_path()) \
+            or getattr(reader_module, 'NEEDS_DISPLAY', False)
+
+    def _init_display(self):
+        """Initialize pygame and the renderer of the on screen display."""
+        from . import osd
+        self._screen = osd.open_display()
+        bgimage = None
+        imagepath = self._bgimage_path()
+        if imagepath:
+            self._print('Using ' + str(imagepath) + ' as a background')
+            bgimage = osd.load_image(imagepath)
+        self._renderer = osd.OSDRenderer(self._screen, self._bgcolor, self._fgcolor, bgimage)
 
-    def _load_bgimage(self):
-        """Load the configured background image and return an instance of it."""
-        image = None
+    def _bgimage_path(self):
+        """Return the path of the configured background image, or None if
+        there is none.
+        """
         if self._config.has_option('video_looper', 'bgimage'):
             imagepath = self._config.get('video_looper', 'bgimage')
             if imagepath != "" and os.path.isfile(imagepath):
-                self._print('Using ' + str(imagepath) + ' as a background')
-                image = pygame.image.load(imagepath)
-                image = pygame.transform.scale(image, self._size)
-        return image
+                return imagepath
+        return None
 
     def _is_number(iself, s):
         try:
@@ -119,55 +389,309 @@ class VideoLooper:
         except ValueError:
             return False
     
-    def _build_playlist(self):
+    def _load_sound_vol(self, path):
+        """Get the video volume from the file in the usb key"""
+        sound_vol_file_path = '{0}/{1}'.format(path.rstrip('/'), self._sound_vol_file)
+        if os.path.exists(sound_vol_file_path):
+            with open(sound_vol_file_path, 'r') as sound_file:
+                sound_vol_string = sound_file.readline()
+                if self._is_number(sound_vol_string):
+                    self._sound_vol = int(float(sound_vol_string))
+
+    def _load_schedule_file(self, path):
+        """Use the schedule file in path (if there is one) instead of the
+        schedule of the ini file.
+        """
+        if not self._schedule_file:
+            return
+        schedule_file_path = '{0}/{1}'.format(path.rstrip('/'), self._schedule_file)
+        if os.path.exists(schedule_file_path):
+            try:
+                self._schedule = read_schedule_file(schedule_file_path)
+            except (OSError, ValueError) as e:
+                self._print('Ignoring schedule file {0}: {1}'.format(schedule_file_path, e))
+
+    def _load_weights_file(self, path):
+        """Load the weights of the weighted random mode from the weights file
+        in path (if there is one).  Every line is "pattern = weight".
+        """
+        if not self._weights_file:
+            return
+        weights_file_path = '{0}/{1}'.format(path.rstrip('/'), self._weights_file)
+        if not os.path.exists(weights_file_path):
+            return
+        weights = []
+        try:
+            with open(weights_file_path, 'r') as weights_file:
+                for line in weights_file:
+                    line = line.strip()
+                    if not line or line[0] == '#':
+                        continue
+                    pattern, _, weight = line.rpartition('=')
+                    weights.append((re.compile(fnmatch.translate(pattern.strip().lower())), float(weight)))
+        except (OSError, ValueError) as e:
+            self._print('Ignoring weights file {0}: {1}'.format(weights_file_path, e))
+            return
+        self._weights = weights + self._weights
+
+    def _movie_weight(self, movie):
+        """Return the weight of a movie for the weighted random mode."""
+        name = os.path.basename(movie.filename)
+        for regex, weight in self._weights:
+            if regex.match(name.lower()):
+                return weight
+        return weight_from_name(name)
+
+    def _apply_schedule(self, output, force=False):
+        """Only play the movies of the active schedule windows on an output.
+        Returns true if the active windows changed.
+        """
+        segment = self._schedule.lookup() if self._schedule is not None else ((), None)
+        if segment == output.schedule_segment and not force:
+            return False
+        output.schedule_segment = segment
+        output.playlist.set_filter(segment[1])
+        self._update_playlist_metric()
+        if self._schedule is not None:
+            self._print('{0}Schedule: {1} active, {2} movies'.format(
+                output.prefix, ', '.join(segment[0]) or 'no window', output.playlist.length()))
+        return True
+
+    def _update_playlist_metric(self):
+        """Set the playlist size metric to the movies of all outputs."""
+        metrics.PLAYLIST_MOVIES.set(sum(x.playlist.length() for x in self._outputs if x.playlist is not None))
+
+    def _build_playlists(self):
         """Search all the file reader paths for movie files with the provided
-        extensions.
+        extensions and build the playlist of every output.  The paths are
+        only scanned once for all outputs.
         """
+        start = time.monotonic()
+        self._stop_scan()
         # Get list of paths to search from the file reader.
         paths = self._reader.search_paths()
-        # Enumerate all movie files inside those paths.
-        movies = []
+        movies = None
+        for output in self._outputs:
+            # Use the playlist file of the output if there is one.
+            playlist = None
+            playlist_path = self._find_playlist_file(output, paths)
+            if playlist_path is not None:
+                playlist = self._load_playlist_file(output, playlist_path)
+            output.using_playlist_file = playlist is not None
+            if playlist is None and self._recursive_scan:
+                # Start empty, _handle_scan adds the movies as they are
+                # found.
+                if self._scan is None:
+                    self._start_scan(paths, start)
+                playlist = Playlist([], output.is_random)
+            elif playlist is None:
+                if movies is None:
+                    # Enumerate all movie files inside those paths.  Unchanged
+                    # files keep their Movie object (and playcount) from the
+                    # previous build.
+                    movies = self._scanner.scan(paths)
+                    self._metadata.prune(paths, [x.filename for x in movies])
+                    movies = [x for x in movies if self._is_playable(x)]
+                # Create a playlist with the sorted list of movies.
+                playlist = Playlist(output.movies(movies), output.is_random)
+            output.playlist = playlist
+        self._metadata.save()
+        self._schedule = self._ini_schedule
+        self._weights = []
         for path in paths:
             # Skip paths that don't exist or are files.
-            if not os.path.exists(path) or not os.path.isdir(path):
+            if not os.path.isdir(path):
                 continue
+            self._load_sound_vol(path)
+            self._load_schedule_file(path)
+            self._load_weights_file(path)
+        for output in self._outputs:
+            if output.picker is not None:
+                # Keep picking with the same state (like the movies already
+                # played in this shuffle cycle).
+                output.picker.invalidate()
+                output.playlist.set_picker(output.picker)
+            self._apply_schedule(output, force=True)
+        if self._scan is None:
+            metrics.PLAYLIST_BUILD.observe(time.monotonic() - start)
+
+    def _start_scan(self, paths, start):
+        """Start walking the paths in the background.  start is the time the
+        playlists started to be built.
+        """
+        self._scan = BackgroundScan(self._scanner, paths)
+        self._scan_start = start
+        self._scan_directories = []
+        self._scan_movies = []
+        self._selector.register(self._scan.fileno(), selectors.EVENT_READ)
+
+    def _stop_scan(self):
+        """Stop the background scan if one is running."""
+        if self._scan is None:
+            return
+        self._selector.unregister(self._scan.fileno())
+        self._scan.close()
+        self._scan = None
+
+    def _handle_scan(self):
+        """Add the movies the background scan found to the playlists, in
+        sorted order, and start outputs that had nothing to play.
+        """
+        directories, movies, done = self._scan.get()
+        self._scan_directories += directories
+        self._scan_movies += movies
+        playable = [x for x in movies if self._is_playable(x)]
+        if playable:
+            for output in self._outputs:
+                if output.using_playlist_file:
+                    continue
+                old_length = output.playlist.length()
+                for movie in playable:
+                    own = output.movie_for(movie)
+                    if own is not None:
+                        output.playlist.add(own)
+                if old_length == 0 and output.playlist.length() > 0:
+                    self._playlist_changed(output, old_length)
+            self._update_playlist_metric()
+        if not done:
+            return
+        self._stop_scan()
+        self._metadata.prune(self._scan_directories, [x.filename for x in self._scan_movies])
+        self._metadata.save()
+        for output in self._outputs:
+            if not output.using_playlist_file:
+                # Drop the copies of movies that weren't found again.
+                output.movies(self._scan_movies)
+                if output.playlist.length() == 0:
+                    self._prepare_output(output)
+        elapsed = time.monotonic() - self._scan_start
+        metrics.PLAYLIST_BUILD.observe(elapsed)
+        self._print('Found {0} movies in {1} directories in {2:.0f} ms'.format(
+            len(self._scan_movies), len(self._scan_directories), 1000 * elapsed))
+        self._scan_directories = []
+        self._scan_movies = []
+
+    def _find_playlist_file(self, output, paths):
+        """Return the path of the playlist file of an output, looking for it
+        in the provided paths unless it is an absolute path.  Returns None if
+        there is no playlist file.
+        """
+        if not output.playlist_file:
+            return None
+        if os.path.isabs(output.playlist_file):
+            candidates = [output.playlist_file]
+        else:
+            candidates = ['{0}/{1}'.format(x.rstrip('/'), output.playlist_file) for x in paths]
+        for candidate in candidates:
+            if os.path.isfile(candidate):
+                return candidate
+        return None
+
+    def _load_playlist_file(self, output, path):
+        """Load a playlist file, returns None if it can't be read."""
+        start = time.monotonic()
+        try:
+            playlist = read_playlist_file(path, output.is_random, accept=self._is_playlist_entry_playable)
+        except (OSError, ValueError) as e:
+            self._print('{0}Failed to read playlist {1}: {2}'.format(output.prefix, path, e))
+            return None
+        self._print('{0}Loaded playlist {1} with {2} entries in {3:.0f} ms'.format(
+            output.prefix, path, playlist.length(), 1000 * (time.monotonic() - start)))
+        return playlist
+
+    def _is_playlist_entry_playable(self, movie):
+        """Return false if the movie of a playlist file entry doesn't exist or
+        is broken.
+        """
+        if '://' not in movie.filename and not os.path.isfile(movie.filename):
+            self._print('Skipping missing movie: {0}'.format(movie))
+            return False
+        return self._is_playable(movie)
+
+    def _playlist_file_changed(self, output, added, removed):
+        """Return true if the playlist file of an output was added, changed or
+        removed, or if movies were added while it is used (they may be
+        entries that were missing before).
+        """
+        if output.using_playlist_file and added:
+            return True
+        name = os.path.basename(output.playlist_file)
+        return bool(name) and any(os.path.basename(x) == name for x in added + removed)
+
+    def _movie_vol(self, output, movie):
+        """Return the volume to play a movie with on an output."""
+        if movie.volume is not None:
+            return movie.volume
+        return output.volume if output.volume is not None else self._sound_vol
 
-            for x in os.listdir(path):
-                # Ignore hidden files (useful when file loaded on usb key from an OSX computer
-                if x[0] is not '.' and re.search('\.{0}$'.format(self._extensions), x, flags=re.IGNORECASE):
-                    repeatsetting = re.search('_repeat_([0-9]*)x', x, flags=re.IGNORECASE)
-                    if (repeatsetting is not None):
-                        repeat = repeatsetting.group(1)
-                    else:
-                        repeat = 1
-                    movies.append(Movie('{0}/{1}'.format(path.rstrip('/'), x), repeat))
-
-            # Get the video volume from the file in the usb key
-            sound_vol_file_path = '{0}/{1}'.format(path.rstrip('/'), self._sound_vol_file)
-            if os.path.exists(sound_vol_file_path):
-                with open(sound_vol_file_path, 'r') as sound_file:
-                    sound_vol_string = sound_file.readline()
-                    if self._is_number(sound_vol_string):
-                        self._sound_vol = int(float(sound_vol_string))
-        # Create a playlist with the sorted list of movies.
-        return Playlist(sorted(movies), self._is_random)
+    def _is_playable(self, movie):
+        """Look up the metadata of a movie and return false if it is broken and
+        should be skipped.
+        """
+        if movie.info is None:
+            movie.info = self._metadata.get(movie.filename)
+        if self._skip_unplayable and movie.info is not None and movie.info.valid is False:
+            self._print('Skipping unplayable movie: {0} ({1})'.format(movie, movie.info.error))
+            return False
+        return True
+
+    def _invalidate_pickers(self):
+        """Let the random pickers of all outputs know the weights changed."""
+        for output in self._outputs:
+            if output.picker is not None:
+                output.picker.invalidate()
+
+    def _update_playlists(self, added, removed):
+        """Apply lists of added and removed file paths reported by the file
+        reader to the playlists of all outputs.
+        """
+        if not added and not removed:
+            return
+        for filename in removed:
+            if self._schedule_file and os.path.basename(filename) == self._schedule_file:
+                self._schedule = self._ini_schedule
+            if self._weights_file and os.path.basename(filename) == self._weights_file:
+                self._weights = []
+                self._invalidate_pickers()
+            for output in self._outputs:
+                output.playlist.remove(filename)
+                output.forget(filename)
+        for filename in added:
+            path, x = os.path.split(filename)
+            if x == self._sound_vol_file:
+                self._load_sound_vol(path)
+                continue
+            if self._schedule_file and x == self._schedule_file:
+                self._load_schedule_file(path)
+                continue
+            if self._weights_file and x == self._weights_file:
+                self._load_weights_file(path)
+                self._invalidate_pickers()
+                continue
+            movie = self._scanner.create_movie(path, x)
+            if movie is None or not self._is_playable(movie):
+                continue
+            for output in self._outputs:
+                own = output.movie_for(movie)
+                if own is not None:
+                    output.playlist.add(own)
+        self._metadata.save()
+        for output in self._outputs:
+            self._apply_schedule(output)
+            self._print('{0}Playlist updated: {1} added, {2} removed, {3} movies'.format(
+                output.prefix, len(added), len(removed), output.playlist.length()))
+        self._update_playlist_metric()
 
     def _blank_screen(self):
         """Render a blank screen filled with the background color."""
-        self._screen.fill(self._bgcolor)
-        if self._bgimage is not None:
-            rect = self._bgimage.get_rect()
-            self._screen.blit(self._bgimage, rect)
-        pygame.display.update()
+        self._renderer.blank()
 
-    def _render_text(self, message, font=None):
+    def _render_text(self, message, size=SMALL_FONT_SIZE):
         """Draw the provided message and return as pygame surface of it rendered
-        with the configured foreground and background color.
+        with the configured foreground and background color.  The surfaces are
+        cached by the renderer.
         """
-        # Default to small font if not provided.
-        if font is None:
-            font = self._small_font
-        return font.render(message, True, self._fgcolor, self._bgcolor)
+        return self._renderer.text(message, size)
 
     def _animate_countdown(self, playlist):
         """Print text with the number of loaded movies and a quick countdown
@@ -187,14 +711,12 @@ class VideoLooper:
         sw, sh = self._screen.get_size()
         for i in range(self._countdown_time, 0, -1):
             # Each iteration of the countdown rendering changing text.
-            label2 = self._render_text(str(i), self._big_font)
+            label2 = self._render_text(str(i), BIG_FONT_SIZE)
             l2w, l2h = label2.get_size()
-            # Clear screen and draw text with line1 above line2 and all
-            # centered horizontally and vertically.
-            self._screen.fill(self._bgcolor)
-            self._screen.blit(label1, (sw/2-l1w/2, sh/2-l2h/2-l1h))
-            self._screen.blit(label2, (sw/2-l2w/2, sh/2-l2h/2))
-            pygame.display.update()
+            # Draw text with line1 above line2 and all centered horizontally
+            # and vertically, only the changed part of the screen is updated.
+            self._renderer.draw([(label1, (sw/2-l1w/2, sh/2-l2h/2-l1h)),
+                                 (label2, (sw/2-l2w/2, sh/2-l2h/2))])
             # Pause for a second between each frame.
             time.sleep(1)
 
@@ -210,14 +732,13 @@ class VideoLooper:
         label = self._render_text(message)
         lw, lh = label.get_size()
         sw, sh = self._screen.get_size()
-        self._screen.fill(self._bgcolor)
-        self._screen.blit(label, (sw/2-lw/2, sh/2-lh/2))
+        labels = [(label, (sw/2-lw/2, sh/2-lh/2))]
         # If keyboard control is enabled, display message about it
         if self._keyboard_control:
             label2 = self._render_text('press ESC to quit')
             l2w, l2h = label2.get_size()
-            self._screen.blit(label2, (sw/2-l2w/2, sh/2-l2h/2+lh))
-        pygame.display.update()
+            labels.append((label2, (sw/2-l2w/2, sh/2-l2h/2+lh)))
+        self._renderer.draw(labels)
 
     def display_message(self,message):
         self._print(message)
@@ -228,90 +749,545 @@ class VideoLooper:
         label = self._render_text(message)
         lw, lh = label.get_size()
         sw, sh = self._screen.get_size()
-        self._screen.fill(self._bgcolor)
-        self._screen.blit(label, (sw/2-lw/2, sh/2-lh/2))
-        pygame.display.update()
+        self._renderer.draw([(label, (sw/2-lw/2, sh/2-lh/2))])
 
     def _prepare_to_run_playlist(self, playlist):
         """Display messages when a new playlist is loaded."""
         # If there are movies to play show a countdown first (if OSD enabled),
         # or if no movies are available show the idle message.
         self._blank_screen()
-        self._firstStart = True
         if playlist.length() > 0:
             self._animate_countdown(playlist)
             self._blank_screen()
+        elif self._scan is not None:
+            # Playback starts as soon as the background scan finds a movie.
+            self.display_message('Searching for movies...')
         else:
             self._idle_message()
 
+    def _prepare_output(self, output):
+        """Start an output with a new playlist from the beginning.  The first
+        output shows its playlist on the display, the others only print it.
+        """
+        output.first_start = True
+        output.wait_until = None
+        output.sync_start = None
+        if output is self._outputs[0]:
+            self._prepare_to_run_playlist(output.playlist)
+        else:
+            self._print('{0}Found {1} movie{2}.'.format(
+                output.prefix, output.playlist.length(), 's' if output.playlist.length() >= 2 else ''))
+
+    def _next_movie(self, output, movie):
+        """Return the movie to play after the provided one.  The playlist only
+        advances once the movie was repeated as often as requested.
+        """
+        if movie.playcount >= movie.repeats:
+            movie.clear_playcount()
+            return output.playlist.get_next()
+        elif output.player.can_loop_count() and movie.playcount > 0:
+            movie.clear_playcount()
+            return output.playlist.get_next()
+        return movie
+
+    def _playlist_changed(self, output, old_length, stop_removed=False):
+        """Adjust the playback of an output to a playlist that changed while
+        running without stopping the current movie if possible.  If
+        stop_removed is true a movie that isn't part of the playlist anymore
+        is stopped.
+        """
+        playlist = output.playlist
+        player = output.player
+        if playlist.length() == 0:
+            player.stop(3)
+            self._prepare_output(output)
+            output.movie, output.upcoming = None, None
+        elif old_length == 0:
+            self._prepare_output(output)
+            output.movie, output.upcoming = playlist.get_next(), None
+        elif old_length == 1 and playlist.length() > 1:
+            # A single movie is looped endlessly by the player and would never
+            # end, stop it to continue with the others.
+            player.stop(3)
+            output.upcoming = None
+        elif stop_removed and output.movie is not None and output.movie not in playlist:
+            player.stop(3)
+            output.movie.clear_playcount()
+            output.movie, output.upcoming = playlist.get_next(), None
+        elif output.upcoming is not None and output.upcoming not in playlist:
+            output.upcoming = playlist.get_next()
+            # Replace the prepared movie, one that isn't prepared yet is when
+            # its time comes.
+            if output.prepare_at is None:
+                player.prepare(output.upcoming.filename, loop=self._loop_count(playlist, output.upcoming),
+                               vol = self._movie_vol(output, output.upcoming))
+
+    def _reload_playlists(self):
+        """Stop the players and build the playlists again.  Every output
+        continues after its interrupted movie if it is still part of the
+        playlist.
+        """
+        for output in self._outputs:
+            player = output.player
+            player.stop(3)  # Up to 3 second delay waiting for old
+                            # player to stop.
+            if hasattr(player, 'last_stop_latency') and player.last_stop_latency() is not None:
+                self._print('{0}player stopped in {1:.1f} ms'.format(output.prefix, player.last_stop_latency() * 1000))
+            else:
+                self._print('{0}player stopped'.format(output.prefix))
+            output.paused = False
+        # Rebuild playlists and show countdown again (if OSD enabled).
+        self._build_playlists()
+        for output in self._outputs:
+            self._prepare_output(output)
+            if output.movie is None or not output.playlist.seek(output.movie):
+                output.movie = output.playlist.get_next()
+            output.upcoming = None
+
+    def _find_movie(self, playlist, name):
+        """Return the movie of the playlist with the provided file name or
+        path.  Raises ValueError if there is none.
+        """
+        for x in playlist.movies():
+            if x.filename == name or os.path.basename(x.filename) == name:
+                return x
+        raise ValueError('no movie {0} in the playlist'.format(name))
+
+    def _find_output(self, name):
+        """Return the output with the provided name, or the first output if
+        name is None.  Raises ValueError if there is none.
+        """
+        if name is None:
+            return self._outputs[0]
+        for output in self._outputs:
+            if output.name == name:
+                return output
+        raise ValueError('no output {0}'.format(name))
+
+    def _control_status(self, output):
+        """Return the state of an output reported by the status command."""
+        movie = output.movie
+        upcoming = output.upcoming
+        return {
+            'output': output.name,
+            'outputs': [x.name for x in self._outputs],
+            'movie': movie.filename if movie is not None else None,
+            'playcount': movie.playcount if movie is not None else 0,
+            'repeats': movie.repeats if movie is not None else 0,
+            'upcoming': upcoming.filename if upcoming is not None else None,
+            'playing': output.player.is_playing(),
+            'paused': output.paused,
+            'movies': output.playlist.length(),
+            'volume': output.volume if output.volume is not None else self._sound_vol,
+            'schedule': list(output.schedule_segment[0]) if output.schedule_segment else [],
+        }
+
+    def _control_command(self, output, command, args):
+        """Run a command of the control server on an output and return the
+        response.  Raises ValueError if the command can't be run.
+        """
+        if command == 'status':
+            return self._control_status(output)
+        if command == 'reload':
+            # The outputs share the scan, all of them are reloaded.
+            self._print('Reloading playlists')
+            self._reload_playlists()
+            return {'movies': output.playlist.length()}
+        if command == 'volume':
+            if not args:
+                raise ValueError('volume needs a value in millibels')
+            try:
+                volume = float(args[0])
+            except (TypeError, ValueError):
+                raise ValueError('volume must be a number of millibels')
+            if not math.isfinite(volume):
+                raise ValueError('volume must be a number of millibels')
+            output.volume = int(volume)
+            # Players that can change the volume while playing apply it to
+            # the current movie (unless it has its own volume in the
+            # playlist), the others from the next movie on.
+            applied = hasattr(output.player, 'set_volume') and output.movie is not None \
+                and output.player.is_playing()
+            if applied:
+                output.player.set_volume(self._movie_vol(output, output.movie))
+            return {'volume': output.volume, 'applied': applied}
+        if command in ('pause', 'resume'):
+            if not hasattr(output.player, command):
+                raise ValueError('the player can\'t {0}'.format(command))
+            getattr(output.player, command)()
+            output.paused = command == 'pause'
+            return {'paused': output.paused}
+        # next, previous and jump: stop the current movie and let the main
+        # loop play the selected one as the upcoming movie.
+        playlist = output.playlist
+        if playlist.length() == 0:
+            raise ValueError('the playlist is empty')
+        if command == 'next':
+            if output.upcoming is not None and output.upcoming is not output.movie:
+                target = output.upcoming
+            else:
+                target = playlist.get_next()
+        elif command == 'previous':
+            if len(output.history) < 2:
+                raise ValueError('no previous movie')
+            target = output.history[-2]
+            if not playlist.seek(target):
+                raise ValueError('{0} is not in the playlist anymore'.format(target))
+            # The target is added to the history again when it starts.
+            output.history.pop()
+            output.history.pop()
+        else:
+            if not args:
+                raise ValueError('jump needs a playlist entry or file name')
+            arg = str(args[0])
+            if arg.isdigit():
+                target = playlist.jump(int(arg))
+            else:
+                target = self._find_movie(playlist, arg)
+                playlist.seek(target)
+        if output.movie is not None:
+            output.movie.clear_playcount()
+        target.clear_playcount()
+        output.player.stop(3)
+        output.paused = False
+        # Start the selected movie right away.
+        output.first_start = True
+        output.wait_until = None
+        output.upcoming, output.prepare_at = target, None
+        return {'movie': target.filename}
+
+    def _handle_control(self):
+        """Run the waiting commands of the control server."""
+
+        def handler(command, args, name):
+            output = self._find_output(name)
+            self._print('{0}Control command: {1}'.format(
+                output.prefix, ' '.join([command] + [str(x) for x in args])))
+            return self._control_command(output, command, args)
+
+        self._control.handle(handler)
+
+    def _loop_count(self, playlist, movie):
+        """Return the loop parameter to pass to the player for a movie.  A
+        single movie is looped endlessly, unless a scan might still find
+        more.
+        """
+        return -1 if playlist.length()==1 and self._scan is None else movie.repeats
+
+    def _step_output(self, output):
+        """Advance the playback of an output: switch to the movies of schedule
+        windows that became active and start the next movie if nothing is
+        playing.
+        """
+        playlist = output.playlist
+        player = output.player
+        # Switch to the movies of the schedule windows that became active.
+        old_length = playlist.length()
+        if self._apply_schedule(output):
+            self._playlist_changed(output, old_length, stop_removed=True)
+        self._prepare_upcoming(output)
+        # The first output plays what the sync leader says if enabled.
+        if self._sync is not None and output is self._outputs[0] and self._sync_step(output):
+            return
+        # Load and play a new movie if nothing is playing.
+        if output.movie is None or player.is_playing(): #just to avoid errors
+            return
+        # Wait between movies without blocking the other outputs, the main
+        # loop wakes up when the time is over.
+        if output.wait_time > 0 and not output.first_start:
+            now = time.monotonic()
+            if output.wait_until is None:
+                output.wait_until = now + output.wait_time
+                self._print('{0}Waiting for: {1} seconds'.format(output.prefix, output.wait_time))
+            if now < output.wait_until:
+                return
+        output.wait_until = None
+        output.first_start = False
+        self._start_movie(output, self._select_movie(output))
+
+    def _select_movie(self, output):
+        """Return the movie to play next on an output, the prepared one or
+        the next of the playlist.
+        """
+        if output.upcoming is not None:
+            movie = output.upcoming
+            output.upcoming, output.prepare_at = None, None
+            return movie
+        return self._next_movie(output, output.movie)
+
+    def _start_movie(self, output, movie, prepare_next=True):
+        """Play a movie on an output.  In gapless mode the movie after it is
+        prepared unless prepare_next is false.
+        """
+        playlist = output.playlist
+        player = output.player
+        output.movie = movie
+
+        movie.was_played()
+        output.history.append(movie)
+
+        #generating infotext
+        if player.can_loop_count():
+            infotext = '{0} time{1} (player counts loops)'.format(movie.repeats, "s" if movie.repeats>1 else "")
+        else:
+            infotext = '{0}/{1}'.format(movie.playcount, movie.repeats)
+        if self._loop_count(playlist, movie) == -1:
+            infotext = '(endless loop)'
+
+        # Start playing the first available movie.
+        self._print('{0}Playing movie: {1} {2}'.format(output.prefix, movie, infotext))
+        # todo: maybe clear screen to black so that background (image/color) is not visible for videos with a resolution that is < screen resolution
+        player.play(movie.filename, loop=self._loop_count(playlist, movie), vol = self._movie_vol(output, movie))
+        metrics.MOVIES_PLAYED.inc()
+
+        if output.gapless:
+            gap = player.last_transition_gap()
+            if gap is not None:
+                metrics.TRANSITION_GAP.observe(gap)
+                self._print('{0}Transition gap: {1:.1f} ms'.format(output.prefix, gap * 1000))
+            # An endlessly looping movie never ends, so there is nothing to
+            # prepare.
+            if prepare_next and playlist.length() > 1:
+                output.upcoming = self._next_movie(output, movie)
+                output.prepare_at = self._prepare_time(output, movie)
+                self._prepare_upcoming(output)
+        if self._prefetcher is not None:
+            self._prefetch()
+
+    def _prepare_time(self, output, movie):
+        """Return the time (monotonic) at which the player of an output
+        prepares the movie after the one it started just now: gapless_preload
+        seconds before the end of the movie, or right away if its duration is
+        unknown.  A player that is loaded early holds its first frame (and
+        the memory of a second player) for the rest of the movie.
+        """
+        now = time.monotonic()
+        if movie.info is None or not movie.info.duration:
+            return now
+        duration = movie.info.duration
+        if output.player.can_loop_count():
+            duration *= max(1, movie.repeats)
+        return now + max(0.0, duration - output.gapless_preload)
+
+    def _prepare_upcoming(self, output):
+        """Let the player of an output prepare the upcoming movie once its
+        time has come.  A paused output waits with it.
+        """
+        if output.upcoming is None or output.prepare_at is None or output.paused \
+                or time.monotonic() < output.prepare_at:
+            return
+        output.prepare_at = None
+        movie = output.upcoming
+        output.player.prepare(movie.filename, loop=self._loop_count(output.playlist, movie),
+                              vol = self._movie_vol(output, movie))
+
+    def _prefetch(self):
+        """Let the prefetcher load the movies that are played next on all
+        outputs into the page cache.
+        """
+        playing = set(x.movie.filename for x in self._outputs if x.movie is not None)
+        filenames = []
+        for output in self._outputs:
+            upcoming = [output.upcoming] if output.upcoming is not None else []
+            for movie in upcoming + output.playlist.peek(self._prefetch_lookahead):
+                # Streams and the movies already playing are left out.
+                if '://' in movie.filename or movie.filename in playing or movie.filename in filenames:
+                    continue
+                filenames.append(movie.filename)
+        self._prefetcher.prefetch(filenames)
+
+    def _start_sync(self):
+        """Create the sync leader or follower if synchronized playback is
+        enabled and register it with the selector.  Returns None otherwise.
+        """
+        from .sync import create_sync
+        try:
+            sync = create_sync(self._config)
+        except (OSError, ValueError) as e:
+            self._print('Failed to start synchronized playback: {0}'.format(e))
+            return None
+        if sync is not None:
+            self._selector.register(sync.fileno(), selectors.EVENT_READ)
+            self._print('Synchronized playback as {0}'.format(sync.role))
+        return sync
+
+    def _handle_sync(self):
+        """Handle the messages of the other units of synchronized playback."""
+        output = self._outputs[0]
+        if self._sync.role == 'leader':
+            for address, seq, skew in self._sync.handle():
+                self._print('Sync: {0} started movie {1} {2:+.1f} ms off'.format(address[0], seq, skew * 1000))
+            return
+        self._sync.probe()
+        messages = self._sync.handle()
+        metrics.SYNC_DELAY.set(self._sync.delay())
+        for message in messages:
+            if output.sync_start is not None and output.sync_start[1] == message['seq']:
+                continue
+            movie = self._sync_movie(output.playlist, message['index'], message['file'])
+            if movie is None:
+                self._print('Sync: no movie {0} in the playlist'.format(message['file']))
+                continue
+            output.sync_start = (movie, message['seq'], message['at'])
+            # Start the player now, so it only has to continue when the movie
+            # is due.
+            if hasattr(output.player, 'prepare'):
+                output.player.prepare(movie.filename, loop=self._loop_count(output.playlist, movie),
+                                      vol = self._movie_vol(output, movie))
+            output.upcoming = None
+
+    def _sync_movie(self, playlist, index, name):
+        """Return the movie of the playlist the leader announced with its entry
+        index and file name, or None if there is none.
+        """
+        if isinstance(index, int) and 0 <= index < playlist.length():
+            movie = playlist.jump(index)
+            if os.path.basename(movie.filename) == name:
+                return movie
+        try:
+            movie = self._find_movie(playlist, name)
+        except ValueError:
+            return None
+        playlist.seek(movie)
+        return movie
+
+    def _sync_step(self, output):
+        """Start the movies of the output synchronized with the other units.
+        Returns false if the output plays on its own because it is a follower
+        that lost its leader or didn't hear from it since it was started.
+        """
+        sync = self._sync
+        player = output.player
+        if output.sync_start is None:
+            if sync.role == 'follower':
+                # Wait for the leader to announce the next movie, and for a
+                # while for the first one after starting.
+                return sync.following() or sync.waiting()
+            if output.movie is None or player.is_playing():
+                return True
+            prepared = output.upcoming is not None and output.prepare_at is None
+            movie = self._select_movie(output)
+            delay = self._sync_lead_time
+            if output.wait_time > 0 and not output.first_start:
+                delay += output.wait_time
+            output.first_start = False
+            seq, at = sync.announce(output.playlist.position(), os.path.basename(movie.filename), delay)
+            if not prepared and hasattr(player, 'prepare'):
+                player.prepare(movie.filename, loop=self._loop_count(output.playlist, movie),
+                               vol = self._movie_vol(output, movie))
+            output.sync_start = (movie, seq, at)
+        movie, seq, at = output.sync_start
+        remaining = sync.remaining(at)
+        if remaining > SYNC_SPIN_TIME:
+            return True
+        # Timeouts of the selector aren't exact, sleep for the last bit.
+        if remaining > 0:
+            time.sleep(remaining)
+        output.sync_start = None
+        # Followers only prepare what the leader announces.
+        self._start_movie(output, movie, prepare_next=sync.role == 'leader')
+        skew = sync.started(seq, at)
+        metrics.SYNC_SKEW.observe(abs(skew))
+        return True
+
     def run(self):
         """Main program loop.  Will never return!"""
-        # Get playlist of movies to play from file reader.
-        playlist = self._build_playlist()
-        self._prepare_to_run_playlist(playlist)
-        movie = playlist.get_next()
-        # Main loop to play videos in the playlist and listen for file changes.
+        # Get playlists of movies to play from file reader.
+        self._build_playlists()
+        for output in self._outputs:
+            self._prepare_output(output)
+            output.movie = output.playlist.get_next()
+            output.upcoming = None
+        self._reader_status = None
+        # Main loop to play videos in the playlists and listen for file
+        # changes.
         while self._running:
-            # Load and play a new movie if nothing is playing.
-            if not self._player.is_playing():
-                if movie is not None: #just to avoid errors
-
-                    if movie.playcount >= movie.repeats:
-                        movie.clear_playcount()
-                        movie = playlist.get_next()
-                    elif self._player.can_loop_count() and movie.playcount > 0:
-                        movie.clear_playcount()
-                        movie = playlist.get_next()
-
-                    movie.was_played()
-
-                    if self._wait_time > 0 and not self._firstStart:
-                        self._print('Waiting for: {0} seconds'.format(self._wait_time))
-                        time.sleep(self._wait_time)
-                    self._firstStart = False
-
-                    #generating infotext
-                    if self._player.can_loop_count():
-                        infotext = '{0} time{1} (player counts loops)'.format(movie.repeats, "s" if movie.repeats>1 else "")
-                    else:
-                        infotext = '{0}/{1}'.format(movie.playcount, movie.repeats)
-                    if playlist.length()==1:
-                        infotext = '(endless loop)'
-
-                    # Start playing the first available movie.
-                    self._print('Playing movie: {0} {1}'.format(movie, infotext))
-                    # todo: maybe clear screen to black so that background (image/color) is not visible for videos with a resolution that is < screen resolution
-                    self._player.play(movie.filename, loop=-1 if playlist.length()==1 else movie.repeats, vol = self._sound_vol)
+            # Add the movies found by a background scan.
+            if self._scan is not None:
+                self._handle_scan()
+            # Run commands received by the control server.
+            if self._control is not None:
+                self._handle_control()
+            # Handle the messages of the other units of synchronized
+            # playback.
+            if self._sync is not None:
+                self._handle_sync()
+            for output in self._outputs:
+                self._step_output(output)
 
             # Check for changes in the file search path (like USB drives added)
-            # and rebuild the playlist.
+            # and rebuild the playlists.
             if self._reader.is_changed():
-                self._print("reader changed, stopping player")
-                self._player.stop(3)  # Up to 3 second delay waiting for old 
-                                      # player to stop.
-                self._print("player stopped")
-                # Rebuild playlist and show countdown again (if OSD enabled).
-                playlist = self._build_playlist()
-                self._prepare_to_run_playlist(playlist)
-                movie = playlist.get_next()
+                changes = None
+                if hasattr(self._reader, 'get_changes'):
+                    changes = self._reader.get_changes()
+                # A changed playlist file needs a full rebuild.
+                if changes is not None and any(self._playlist_file_changed(x, *changes) for x in self._outputs):
+                    changes = None
+                if changes is not None:
+                    # Apply the added and removed files to the running
+                    # playlists without stopping the current movies.
+                    old = [(x.playlist.length(), x.schedule_segment) for x in self._outputs]
+                    self._update_playlists(*changes)
+                    # A changed schedule file stops a movie that isn't part
+                    # of the active windows anymore.
+                    for output, (old_length, old_segment) in zip(self._outputs, old):
+                        self._playlist_changed(output, old_length,
+                                               stop_removed=old_segment != output.schedule_segment)
+                else:
+                    self._print("reader changed, stopping player")
+                    self._reload_playlists()
+            # Print progress messages of the file reader (like a copy running
+            # in the background).
+            if hasattr(self._reader, 'status_message'):
+                status = self._reader.status_message()
+                if status != self._reader_status:
+                    self._reader_status = status
+                    if status is not None:
+                        self._print(status)
             # Event handling for key press, if keyboard control is enabled
             if self._keyboard_control:
-                for event in pygame.event.get():
-                    if event.type == pygame.KEYDOWN:
-                        # If pressed key is ESC quit program
-                        if event.key == pygame.K_ESCAPE:
-                            self._print("ESC was pressed. quitting...")
-                            self.quit()
-            # Give the CPU some time to do other tasks.
-            time.sleep(0.002)
+                if time.monotonic() >= self._keyboards_checked + KEYBOARD_RESCAN_INTERVAL:
+                    self._watch_keyboards()
+                # If pressed key is ESC quit program
+                if self._renderer.escape_pressed():
+                    self._print("ESC was pressed. quitting...")
+                    self.quit()
+            if not self._running:
+                break
+            # Sleep until something happens instead of polling.
+            self._wait_for_events()
 
     def quit(self):
         """Shut down the program"""
         self._print("quitting Video Looper")
+        self._print_loop_stats()
         self._running = False
-        if self._player is not None:
-            self._player.stop()
-        pygame.quit()
+        self._stop_scan()
+        # Movies of playlist files are looked up when they are first played.
+        self._metadata.save()
+        for output in self._outputs:
+            output.player.stop()
+            # Quit a player process that keeps running between movies.
+            if hasattr(output.player, 'close'):
+                output.player.close()
+        for exporter in self._exporters:
+            exporter.close()
+        self._exporters = []
+        for fd in self._keyboards.values():
+            self._selector.unregister(fd)
+            os.close(fd)
+        self._keyboards = {}
+        if self._control is not None:
+            self._control.close()
+            self._control = None
+        if self._sync is not None:
+            self._sync.close()
+            self._sync = None
+        if self._prefetcher is not None:
+            self._prefetcher.close()
+            self._prefetcher = None
+        self._renderer.close()
 
     def signal_quit(self, signal, frame):
         """Shut down the program, meant to by called by signal handler."""